@@ -0,0 +1,240 @@
+"""Throughput benchmark of the service by number of gunicorn workers.
+
+It starts stubs of the SSO, RHOBS and inference services, runs the service
+with gunicorn.conf.py for each number of workers and sends multi cluster
+prediction requests from several client processes for some seconds. The
+caches are disabled, so every request parses a RHOBS response and builds the
+predictions of all its clusters.
+
+Run it from the root of the repository, after installing the "gunicorn"
+extra:
+
+    python benchmarks/throughput.py --workers 1 2 4 --clusters 50
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ALERTS_PER_CLUSTER = 10
+FOCS_PER_CLUSTER = 5
+CLUSTER_ID = re.compile(r'_id=~"([^"]+)"')
+
+
+def rhobs_results(cluster_ids: list[str]) -> list[dict]:
+    """Build the RHOBS results with a console URL, alerts and FOCs for each cluster."""
+    results = []
+    for cluster_id in cluster_ids:
+        results.append(
+            {
+                "metric": {
+                    "__name__": "console_url",
+                    "_id": cluster_id,
+                    "url": "https://console-openshift-console.example.com",
+                },
+                "value": [1677825120.237, "1"],
+            }
+        )
+        for i in range(ALERTS_PER_CLUSTER):
+            results.append(
+                {
+                    "metric": {
+                        "__name__": "alerts",
+                        "_id": cluster_id,
+                        "alertname": f"Alert{i}",
+                        "namespace": "openshift-monitoring",
+                        "severity": "warning",
+                    },
+                    "value": [1677825120.237, "1"],
+                }
+            )
+        for i in range(FOCS_PER_CLUSTER):
+            results.append(
+                {
+                    "metric": {
+                        "__name__": "cluster_operator_conditions",
+                        "_id": cluster_id,
+                        "condition": "Degraded",
+                        "name": f"operator{i}",
+                        "reason": "AsExpected",
+                    },
+                    "value": [1677825120.237, "1"],
+                }
+            )
+
+    return results
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answer like the SSO, RHOBS and inference services would."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        """Do not log the requests."""
+
+    def send_json(self, content):
+        """Send the content as a JSON response."""
+        body = json.dumps(content).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        """Read the JSON body of the request."""
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length)) if length else None
+
+    def do_GET(self):
+        """Return the SSO configuration, the RHOBS results or the inference."""
+        url = urlparse(self.path)
+        if url.path == "/.well-known/openid-configuration":
+            port = self.server.server_address[1]
+            self.send_json({"token_endpoint": f"http://127.0.0.1:{port}/token"})
+        elif url.path.endswith("/api/v1/query"):
+            query = parse_qs(url.query)["query"][0]
+            cluster_ids = CLUSTER_ID.search(query).group(1).split("|")
+            self.send_json({"data": {"result": rhobs_results(cluster_ids)}})
+        else:
+            self.send_json({"upgrade_risks_predictors": self.read_json()})
+
+    def do_POST(self):
+        """Return a new SSO token."""
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_json(
+            {"access_token": "token", "token_type": "Bearer", "expires_in": 3600}
+        )
+
+
+def wait_for_service(port: int, timeout: float = 30) -> None:
+    """Wait until the service accepts requests."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/openapi.json")
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+
+    raise RuntimeError("The service did not start")
+
+
+def run_client(port: int, clusters: int, duration: float, counts) -> None:
+    """Send requests for new clusters until the duration is over."""
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    deadline = time.time() + duration
+    ok = errors = 0
+    while time.time() < deadline:
+        body = json.dumps({"clusters": [str(uuid.uuid4()) for _ in range(clusters)]})
+        connection.request(
+            "POST",
+            "/upgrade-risks-prediction",
+            body,
+            {"Content-Type": "application/json"},
+        )
+        response = connection.getresponse()
+        response.read()
+        if response.status == 200:
+            ok += 1
+        else:
+            errors += 1
+
+    counts.put((ok, errors))
+
+
+def measure(args, workers: int, stub_port: int) -> tuple[int, int]:
+    """Run the service with the given workers and return the requests sent."""
+    env = {
+        **os.environ,
+        "WEB_CONCURRENCY": str(workers),
+        "BIND": f"127.0.0.1:{args.port}",
+        "PROMETHEUS_MULTIPROC_DIR": tempfile.mkdtemp(),
+        "CLIENT_ID": "benchmark",
+        "CLIENT_SECRET": "benchmark",
+        "SSO_ISSUER": f"http://127.0.0.1:{stub_port}",
+        "RHOBS_URL": f"http://127.0.0.1:{stub_port}",
+        "INFERENCE_URL": f"http://127.0.0.1:{stub_port}",
+        "ALLOW_INSECURE": "1",
+        "OAUTHLIB_INSECURE_TRANSPORT": "1",
+        "LOGGING_CONFIG": args.logging_config,
+    }
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "-c",
+            "gunicorn.conf.py",
+            "ccx_upgrades_data_eng.main:app",
+        ],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_service(args.port)
+        counts = multiprocessing.Queue()
+        clients = [
+            multiprocessing.Process(
+                target=run_client,
+                args=(args.port, args.clusters, args.duration, counts),
+            )
+            for _ in range(args.clients)
+        ]
+        for client in clients:
+            client.start()
+        results = [counts.get() for _ in clients]
+        for client in clients:
+            client.join()
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+    return sum(ok for ok, _ in results), sum(errors for _, errors in results)
+
+
+def main():
+    """Measure the throughput for each number of workers and print it as CSV."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--clusters", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--logging-config",
+        default=os.path.join(os.path.dirname(__file__), "logging.yaml"),
+    )
+    args = parser.parse_args()
+
+    stub = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+
+    print("workers,requests,errors,requests_per_second,clusters_per_second")
+    for workers in args.workers:
+        ok, errors = measure(args, workers, stub.server_address[1])
+        rps = ok / args.duration
+        print(f"{workers},{ok},{errors},{rps:.1f},{rps * args.clusters:.0f}")
+
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
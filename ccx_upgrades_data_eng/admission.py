@@ -0,0 +1,160 @@
+"""Admission control in front of the prediction endpoints."""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from functools import lru_cache
+
+from ccx_upgrades_data_eng import metrics
+from ccx_upgrades_data_eng.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+REJECTED_QUEUE_TIMEOUT = "queue_timeout"
+REJECTED_EVENT_LOOP_LAG = "event_loop_lag"
+
+
+class AdmissionRejectedError(Exception):
+    """The request was rejected to protect the service from overload."""
+
+    def __init__(self, reason: str) -> None:
+        """Initialize the exception with the reason of the rejection."""
+        super().__init__(reason)
+        self.reason = reason
+
+
+class AdmissionController:
+    """Limit the prediction requests in progress, shedding the excess.
+
+    At most max_in_flight requests run at the same time, and at most
+    max_bulk_in_flight of them are bulk (multi cluster) requests. The others
+    wait in a queue, where the single cluster requests go first, as they are
+    cheap and usually served from the cache. A request waiting for more than
+    max_queue_time seconds is rejected, and so are the new bulk requests
+    while the event loop lag is over max_event_loop_lag seconds.
+
+    It must only be used from the event loop.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int,
+        max_bulk_in_flight: int,
+        max_queue_time: float,
+        max_event_loop_lag: float,
+    ) -> None:
+        """Initialize the admission controller."""
+        self.max_in_flight = max_in_flight
+        self.max_bulk_in_flight = max_bulk_in_flight
+        self.max_queue_time = max_queue_time
+        self.max_event_loop_lag = max_event_loop_lag
+        self.in_flight = 0
+        self.bulk_in_flight = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self._bulk_waiters: deque[asyncio.Future] = deque()
+
+    def _can_run(self, bulk: bool) -> bool:
+        """Check if there is a free slot for the request."""
+        if self.in_flight >= self.max_in_flight:
+            return False
+        return not bulk or self.bulk_in_flight < self.max_bulk_in_flight
+
+    def _take(self, bulk: bool) -> None:
+        """Take a slot for the request."""
+        self.in_flight += 1
+        if bulk:
+            self.bulk_in_flight += 1
+
+    def _release(self, bulk: bool) -> None:
+        """Free the slot of the request and wake up the next waiting request."""
+        self.in_flight -= 1
+        if bulk:
+            self.bulk_in_flight -= 1
+        self._wake_up_next()
+
+    def _wake_up_next(self) -> None:
+        """Wake up the first waiting request that can run, single clusters first."""
+        for bulk, waiters in ((False, self._waiters), (True, self._bulk_waiters)):
+            if waiters and self._can_run(bulk):
+                future = waiters.popleft()
+                future.set_result(None)
+                return
+
+    async def _acquire(self, bulk: bool) -> None:
+        """Take a slot, waiting for it at most max_queue_time seconds."""
+        waiters = self._bulk_waiters if bulk else self._waiters
+        # Don't overtake the waiting requests with the same or higher priority
+        if not waiters and (not bulk or not self._waiters) and self._can_run(bulk):
+            self._take(bulk)
+            return
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_queue_time
+        future = loop.create_future()
+        waiters.append(future)
+        admitted = False
+        try:
+            while True:
+                await asyncio.wait_for(future, deadline - loop.time())
+                if self._can_run(bulk):
+                    self._take(bulk)
+                    admitted = True
+                    return
+
+                # Another request took the slot: wait again in the same place
+                future = loop.create_future()
+                waiters.appendleft(future)
+        except asyncio.TimeoutError:
+            raise AdmissionRejectedError(REJECTED_QUEUE_TIMEOUT) from None
+        finally:
+            if future in waiters:
+                waiters.remove(future)
+            elif not admitted and future.done() and not future.cancelled():
+                # Woken up but timed out before running: pass the slot on
+                self._wake_up_next()
+
+    @asynccontextmanager
+    async def admit(self, endpoint: str, bulk: bool) -> AsyncIterator[None]:
+        """Run the block once the request is admitted.
+
+        Raise AdmissionRejectedError if the request is shed.
+        """
+        try:
+            if (
+                bulk
+                and self.max_event_loop_lag > 0
+                and metrics.get_event_loop_lag() > self.max_event_loop_lag
+            ):
+                raise AdmissionRejectedError(REJECTED_EVENT_LOOP_LAG)
+
+            start = time.perf_counter()
+            await self._acquire(bulk)
+        except AdmissionRejectedError as ex:
+            logger.warning("Request to %s rejected: %s", endpoint, ex.reason)
+            metrics.CCX_UPGRADES_ADMISSION_REJECTED_TOTAL.labels(
+                endpoint, ex.reason
+            ).inc()
+            raise
+
+        metrics.CCX_UPGRADES_ADMISSION_QUEUE_TIME.labels(endpoint).observe(
+            time.perf_counter() - start
+        )
+        try:
+            yield
+        finally:
+            self._release(bulk)
+
+
+@lru_cache
+def get_admission_controller() -> AdmissionController:
+    """AdmissionController cache."""
+    settings = get_settings()
+    return AdmissionController(
+        settings.admission_max_in_flight,
+        settings.admission_max_bulk_in_flight or settings.admission_max_in_flight,
+        settings.admission_max_queue_time,
+        settings.admission_max_event_loop_lag,
+    )
@@ -10,10 +10,57 @@ RH_OAUTH_ISSUER = "https://sso.redhat.com/auth/realms/redhat-external"
 RHOBS_URL = "https://observatorium.api.stage.openshift.com"
 RHOBS_DEFAULT_TENANT = "telemeter"
 RHOBS_DEFAULT_REQUEST_TIMEOUT = 10.0
+RHOBS_DEFAULT_MULTI_CLUSTER_CHUNK_SIZE = 100
+RHOBS_DEFAULT_PARSING_PROCESSES = 0
+RHOBS_DEFAULT_PARSING_MIN_BYTES = 1024 * 1024
+RHOBS_DEFAULT_MAX_IN_FLIGHT_CLUSTERS = 0
+RHOBS_DEFAULT_MAX_QUEUE_TIME = 5.0
+RHOBS_DEFAULT_HEDGING_ENABLED = False
+RHOBS_DEFAULT_HEDGE_PERCENTILE = 95.0
+RHOBS_DEFAULT_HEDGE_MIN_DELAY = 0.1
+RHOBS_DEFAULT_HEDGE_BUDGET = 0.05
+
+INFERENCE_DEFAULT_REQUEST_TIMEOUT = 5.0
+
+DEFAULT_REQUEST_DEADLINE = 0.0
 
 DEFAULT_CACHE_ENABLED = False
 DEFAULT_CACHE_TTL = 0
 DEFAULT_CACHE_SIZE = 128
+DEFAULT_CACHE_TTL_JITTER = 0.0
+DEFAULT_CACHE_MAX_BYTES = 0
+DEFAULT_RESPONSE_CACHE_ENABLED = False
+DEFAULT_MULTI_CLUSTER_RESPONSE_CACHE_TTL = 10
+
+DEFAULT_SERVER_TIMING_ENABLED = False
+DEFAULT_TRACING_ENABLED = False
+DEFAULT_LOGGING_QUEUE_ENABLED = False
+DEFAULT_LOGGING_QUEUE_SIZE = 10000
+DEFAULT_EVENT_LOOP_LAG_INTERVAL = 0.5
+
+DEFAULT_WEB_CONCURRENCY = 1
+
+DEFAULT_CIRCUIT_BREAKER_ENABLED = False
+DEFAULT_CIRCUIT_BREAKER_FAILURE_RATE = 0.5
+DEFAULT_CIRCUIT_BREAKER_WINDOW = 20
+DEFAULT_CIRCUIT_BREAKER_MIN_CALLS = 10
+DEFAULT_CIRCUIT_BREAKER_OPEN_TIME = 30.0
+
+DEFAULT_RETRY_ENABLED = False
+DEFAULT_RETRY_MAX_ATTEMPTS = 3
+DEFAULT_RETRY_BASE_DELAY = 0.1
+DEFAULT_RETRY_MAX_DELAY = 1.0
+DEFAULT_RETRY_BUDGET = 0.1
+
+DEFAULT_ADMISSION_MAX_IN_FLIGHT = 0
+DEFAULT_ADMISSION_MAX_BULK_IN_FLIGHT = 0
+DEFAULT_ADMISSION_MAX_QUEUE_TIME = 1.0
+DEFAULT_ADMISSION_MAX_EVENT_LOOP_LAG = 0.0
+DEFAULT_ADMISSION_RETRY_AFTER = 1
+
+DEFAULT_JOBS_TTL = 3600
+DEFAULT_JOBS_MAX_COUNT = 100
+DEFAULT_JOBS_MAX_CONCURRENCY = 4
 
 logger = logging.getLogger(__name__)
 
@@ -35,14 +82,68 @@ class Settings(BaseSettings):
     rhobs_tenant: str = RHOBS_DEFAULT_TENANT
     rhobs_request_timeout: float = RHOBS_DEFAULT_REQUEST_TIMEOUT
     rhobs_query_max_minutes_for_data: int = 60
+    rhobs_multi_cluster_chunk_size: int = RHOBS_DEFAULT_MULTI_CLUSTER_CHUNK_SIZE
+    rhobs_parsing_processes: int = RHOBS_DEFAULT_PARSING_PROCESSES
+    rhobs_parsing_min_bytes: int = RHOBS_DEFAULT_PARSING_MIN_BYTES
+    rhobs_max_in_flight_clusters: int = RHOBS_DEFAULT_MAX_IN_FLIGHT_CLUSTERS
+    rhobs_max_queue_time: float = RHOBS_DEFAULT_MAX_QUEUE_TIME
+    rhobs_hedging_enabled: bool = RHOBS_DEFAULT_HEDGING_ENABLED
+    rhobs_hedge_percentile: float = RHOBS_DEFAULT_HEDGE_PERCENTILE
+    rhobs_hedge_min_delay: float = RHOBS_DEFAULT_HEDGE_MIN_DELAY
+    rhobs_hedge_budget: float = RHOBS_DEFAULT_HEDGE_BUDGET
 
     # Inference service configuration
     inference_url: str
+    inference_request_timeout: float = INFERENCE_DEFAULT_REQUEST_TIMEOUT
+
+    # Maximum time, in seconds, to process a prediction request. 0 disables it
+    request_deadline: float = DEFAULT_REQUEST_DEADLINE
 
     # Caching configuration
     cache_enabled: bool = DEFAULT_CACHE_ENABLED
     cache_ttl: int = DEFAULT_CACHE_TTL
     cache_size: int = DEFAULT_CACHE_SIZE
+    cache_ttl_jitter: float = DEFAULT_CACHE_TTL_JITTER
+    # Memory budget of each cache, in bytes. 0 bounds them by cache_size instead
+    cache_max_bytes: int = DEFAULT_CACHE_MAX_BYTES
+    response_cache_enabled: bool = DEFAULT_RESPONSE_CACHE_ENABLED
+    multi_cluster_response_cache_ttl: int = DEFAULT_MULTI_CLUSTER_RESPONSE_CACHE_TTL
+
+    # Observability configuration
+    server_timing_enabled: bool = DEFAULT_SERVER_TIMING_ENABLED
+    tracing_enabled: bool = DEFAULT_TRACING_ENABLED
+    logging_queue_enabled: bool = DEFAULT_LOGGING_QUEUE_ENABLED
+    logging_queue_size: int = DEFAULT_LOGGING_QUEUE_SIZE
+    event_loop_lag_interval: float = DEFAULT_EVENT_LOOP_LAG_INTERVAL
+
+    # Number of worker processes, as configured for gunicorn
+    web_concurrency: int = DEFAULT_WEB_CONCURRENCY
+
+    # Circuit breakers of the RHOBS and inference clients
+    circuit_breaker_enabled: bool = DEFAULT_CIRCUIT_BREAKER_ENABLED
+    circuit_breaker_failure_rate: float = DEFAULT_CIRCUIT_BREAKER_FAILURE_RATE
+    circuit_breaker_window: int = DEFAULT_CIRCUIT_BREAKER_WINDOW
+    circuit_breaker_min_calls: int = DEFAULT_CIRCUIT_BREAKER_MIN_CALLS
+    circuit_breaker_open_time: float = DEFAULT_CIRCUIT_BREAKER_OPEN_TIME
+
+    # Retries of the RHOBS and inference requests
+    retry_enabled: bool = DEFAULT_RETRY_ENABLED
+    retry_max_attempts: int = DEFAULT_RETRY_MAX_ATTEMPTS
+    retry_base_delay: float = DEFAULT_RETRY_BASE_DELAY
+    retry_max_delay: float = DEFAULT_RETRY_MAX_DELAY
+    retry_budget: float = DEFAULT_RETRY_BUDGET
+
+    # Admission control of the prediction endpoints
+    admission_max_in_flight: int = DEFAULT_ADMISSION_MAX_IN_FLIGHT
+    admission_max_bulk_in_flight: int = DEFAULT_ADMISSION_MAX_BULK_IN_FLIGHT
+    admission_max_queue_time: float = DEFAULT_ADMISSION_MAX_QUEUE_TIME
+    admission_max_event_loop_lag: float = DEFAULT_ADMISSION_MAX_EVENT_LOOP_LAG
+    admission_retry_after: int = DEFAULT_ADMISSION_RETRY_AFTER
+
+    # Asynchronous prediction jobs configuration
+    jobs_ttl: int = DEFAULT_JOBS_TTL
+    jobs_max_count: int = DEFAULT_JOBS_MAX_COUNT
+    jobs_max_concurrency: int = DEFAULT_JOBS_MAX_CONCURRENCY
 
 
 @lru_cache
@@ -0,0 +1,86 @@
+"""Deadline of the request being processed, shared by all its upstream calls."""
+
+import logging
+import time
+from contextvars import ContextVar
+
+from fastapi import HTTPException, status
+
+logger = logging.getLogger(__name__)
+
+# Header clients can use to set a shorter timeout, in seconds, for their request
+DEADLINE_HEADER = "X-Request-Timeout"
+
+DEADLINE_EXCEEDED_STATUS = "Request timed out"
+
+# time.monotonic() value after which the request being processed must stop.
+# It is set by the middleware and inherited by the tasks and threads handling
+# the request.
+current_deadline: ContextVar[float | None] = ContextVar(
+    "current_deadline", default=None
+)
+
+
+class DeadlineExceededError(HTTPException):
+    """The deadline of the request expired before it was completed."""
+
+    def __init__(self) -> None:
+        """Initialize the exception as a 504 response."""
+        super().__init__(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail=DEADLINE_EXCEEDED_STATUS,
+        )
+
+
+def get_request_timeout(header_value: str | None, default: float) -> float | None:
+    """Return the timeout of the request, or None if it has none.
+
+    It is the default timeout (REQUEST_DEADLINE, disabled if 0), shortened by
+    the DEADLINE_HEADER of the request if valid.
+    """
+    timeouts = [default] if default > 0 else []
+    if header_value:
+        try:
+            timeout = float(header_value)
+        except ValueError:
+            logger.debug("Ignoring invalid %s: %s", DEADLINE_HEADER, header_value)
+        else:
+            if timeout > 0:
+                timeouts.append(timeout)
+
+    return min(timeouts) if timeouts else None
+
+
+def start_deadline(timeout: float | None) -> None:
+    """Set the deadline of the current request timeout seconds from now."""
+    current_deadline.set(None if timeout is None else time.monotonic() + timeout)
+
+
+def remaining_time() -> float | None:
+    """Return the seconds left before the deadline, or None if there is none."""
+    deadline = current_deadline.get()
+    if deadline is None:
+        return None
+
+    return deadline - time.monotonic()
+
+
+def is_expired() -> bool:
+    """Check if the deadline of the current request expired."""
+    remaining = remaining_time()
+    return remaining is not None and remaining <= 0
+
+
+def get_timeout(timeout: float) -> float:
+    """Return the timeout for an upstream call, shortened to fit in the deadline.
+
+    Raise DeadlineExceededError if the deadline already expired.
+    """
+    remaining = remaining_time()
+    if remaining is None:
+        return timeout
+
+    if remaining <= 0:
+        raise DeadlineExceededError()
+
+    return min(timeout, remaining)
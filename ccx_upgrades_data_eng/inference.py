@@ -1,13 +1,18 @@
 """Utils to interact with Inference service."""
 
 import logging
+import time
 from datetime import datetime, timezone
 
 import requests
 from cachetools import cached
+from cachetools.keys import hashkey
 from fastapi import HTTPException
 
+from ccx_upgrades_data_eng import deadline, metrics, sentry, tracing
 from ccx_upgrades_data_eng.config import get_settings
+from ccx_upgrades_data_eng.deadline import DeadlineExceededError
+from ccx_upgrades_data_eng.logging_utils import LogPayload
 from ccx_upgrades_data_eng.models import (
     InferenceResponse,
     UpgradeApiResponse,
@@ -15,29 +20,95 @@ from ccx_upgrades_data_eng.models import (
     UpgradeRisksPredictorsWithURLs,
 )
 from ccx_upgrades_data_eng.urls import fill_urls
-from ccx_upgrades_data_eng.utils import CustomTTLCache
+from ccx_upgrades_data_eng.utils import (
+    CircuitOpenError,
+    CustomTTLCache,
+    get_circuit_breaker,
+    get_retry_policy,
+)
 
 logger = logging.getLogger(__name__)
 
 
-def get_inference_for_predictors(
+def send_inference_request(
     risk_predictors: UpgradeRisksPredictors,
-) -> UpgradeApiResponse:
-    """Request the inference service with a set of predictors."""
+) -> requests.Response:
+    """Send the predictors to the inference service through the circuit breaker.
+
+    The timeout is shortened to fit in the deadline of the request.
+    """
     settings = get_settings()
 
     inference_endpoint = f"{settings.inference_url}/upgrade-risks-prediction"
-    inference_response = requests.get(
-        inference_endpoint, json=risk_predictors.model_dump(), timeout=5
+    timeout = deadline.get_timeout(settings.inference_request_timeout)
+    breaker = get_circuit_breaker("inference")
+    if breaker is not None:
+        breaker.before_call()
+
+    start = time.perf_counter()
+    try:
+        with (
+            tracing.start_span("inference.request") as span,
+            sentry.start_span("inference.request", inference_endpoint),
+            metrics.observe_stage_time("inference"),
+            metrics.CCX_UPGRADES_INFERENCE_IN_FLIGHT.track_inprogress(),
+        ):
+            inference_response = requests.get(
+                inference_endpoint,
+                json=risk_predictors.model_dump(),
+                headers=tracing.inject_trace_headers({}),
+                timeout=timeout,
+            )
+            tracing.set_span_attribute(
+                span, "http.response.status_code", inference_response.status_code
+            )
+    except requests.exceptions.RequestException as ex:
+        metrics.update_ccx_upgrades_inference_time(
+            "connection_error", time.perf_counter() - start
+        )
+        if deadline.is_expired():
+            # Not a failure of the inference service: the request ran out of time
+            if breaker is not None:
+                breaker.cancel_call()
+            raise DeadlineExceededError() from ex
+        if breaker is not None:
+            breaker.record_failure()
+        raise
+    except Exception:
+        if breaker is not None:
+            breaker.record_failure()
+        raise
+
+    if breaker is not None:
+        breaker.record(inference_response.status_code < 500)
+
+    metrics.update_ccx_upgrades_inference_time(
+        str(inference_response.status_code), time.perf_counter() - start
     )
+    return inference_response
+
+
+def get_inference_for_predictors(
+    risk_predictors: UpgradeRisksPredictors,
+) -> UpgradeApiResponse:
+    """Request the inference service with a set of predictors.
+
+    The transient errors are retried, if enabled.
+    """
+    retry_policy = get_retry_policy("inference")
+    if retry_policy is None:
+        inference_response = send_inference_request(risk_predictors)
+    else:
+        inference_response = retry_policy.call(send_inference_request, risk_predictors)
 
     if inference_response.status_code != 200:
         raise HTTPException(status_code=inference_response.status_code)
 
     logger.debug("Inference response status code: %s", inference_response.status_code)
-    logger.debug("Inference response text: %s", inference_response.text)
+    logger.debug("Inference response text: %s", LogPayload(inference_response.text))
 
-    inference_response = InferenceResponse.model_validate(inference_response.json())
+    with metrics.observe_stage_time("json_decode"):
+        inference_response = InferenceResponse.model_validate(inference_response.json())
     risks = inference_response.upgrade_risks_predictors
 
     response = UpgradeApiResponse(
@@ -51,14 +122,44 @@ def get_inference_for_predictors(
     return response
 
 
-@cached(cache=CustomTTLCache())
+def get_filled_inference_with_fallback(
+    risk_predictors: UpgradeRisksPredictors, console_url: str
+) -> UpgradeApiResponse:
+    """Return the result of get_filled_inference_for_predictors.
+
+    While the circuit breaker of the inference service is open, the expired
+    result for the same predictors is returned if still kept. It is looked up
+    here, outside of the cached function, so it is not stored again as a live
+    entry.
+    """
+    try:
+        return get_filled_inference_for_predictors(risk_predictors, console_url)
+    except CircuitOpenError as e:
+        stale_result = get_filled_inference_for_predictors.cache.get_stale(
+            hashkey(risk_predictors, console_url)
+        )
+        if stale_result is None:
+            raise HTTPException(
+                status_code=503, detail="Inference service unavailable"
+            ) from e
+        logger.info("Inference service unavailable. Using stale result")
+        return stale_result
+
+
+@cached(cache=CustomTTLCache("inference", keep_stale=True))
 def get_filled_inference_for_predictors(
     risk_predictors: UpgradeRisksPredictors, console_url: str
 ) -> UpgradeApiResponse:
-    """Return inference data with risk predictors and urls set."""
+    """Return inference data with risk predictors and urls set.
+
+    Raise CircuitOpenError while the circuit breaker of the inference service
+    is open.
+    """
     inference_response = get_inference_for_predictors(risk_predictors)
+
     logger.debug("Filling alerts and focs with the console url")
-    fill_urls(inference_response, console_url)
+    with metrics.observe_stage_time("fill_urls"):
+        fill_urls(inference_response, console_url)
     return inference_response
 
 
@@ -0,0 +1,226 @@
+"""Asynchronous jobs to run the multi cluster predictions in the background."""
+
+import asyncio
+import logging
+import math
+from datetime import datetime, timezone
+from functools import lru_cache
+from uuid import UUID, uuid4
+
+from cachetools import TLRUCache
+from fastapi import HTTPException, status
+from starlette.concurrency import run_in_threadpool
+
+from ccx_upgrades_data_eng import deadline
+from ccx_upgrades_data_eng.config import get_settings
+from ccx_upgrades_data_eng.models import (
+    ClusterPrediction,
+    ClustersList,
+    PredictionJob,
+    UpgradeRisksPredictors,
+)
+from ccx_upgrades_data_eng.responses import get_cluster_prediction
+from ccx_upgrades_data_eng.rhobs import (
+    RHOBSUnavailableError,
+    get_cached_results_multi_cluster,
+    perform_rhobs_request_chunk,
+    split_in_chunks,
+)
+
+logger = logging.getLogger(__name__)
+
+JOB_STATUS_PENDING = "pending"
+JOB_STATUS_RUNNING = "running"
+JOB_STATUS_DONE = "done"
+JOB_STATUS_FAILED = "failed"
+
+
+class Job:
+    """Keep track of the progress and results of a prediction job."""
+
+    def __init__(self, clusters_list: ClustersList) -> None:
+        """Initialize a pending job for the given clusters."""
+        self.job_id = uuid4()
+        self.clusters_list = clusters_list
+        self.status = JOB_STATUS_PENDING
+        self.predictions: list[ClusterPrediction] = []
+        self.created_at = datetime.now(tz=timezone.utc)
+        self.finished_at: datetime | None = None
+        self.task: asyncio.Task | None = None
+
+    def to_model(self) -> PredictionJob:
+        """Return the status of the job."""
+        return PredictionJob(
+            job_id=self.job_id,
+            status=self.status,
+            total_clusters=len(self.clusters_list.clusters),
+            processed_clusters=len(self.predictions),
+            created_at=self.created_at,
+            finished_at=self.finished_at,
+        )
+
+
+class JobManager:
+    """Run the prediction jobs and keep them until they expire.
+
+    The jobs are processed through the same chunked RHOBS and inference
+    pipeline as the multi cluster endpoint, running at most max_concurrency
+    chunks at the same time across all the jobs. Finished jobs expire after
+    ttl seconds. The jobs are kept in the memory of the worker, so they are
+    rejected when running several workers.
+    """
+
+    def __init__(
+        self, ttl: int, max_count: int, max_concurrency: int, workers: int = 1
+    ) -> None:
+        """Initialize the job manager."""
+        self.ttl = ttl
+        self.max_count = max_count
+        self.workers = workers
+        self.jobs = TLRUCache(maxsize=math.inf, ttu=self._get_job_expiration)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+    def _get_job_expiration(self, _job_id: UUID, job: Job, now: float) -> float:
+        """Return the expiration time of a job: only finished jobs expire."""
+        if job.finished_at is None:
+            return math.inf
+        return now + self.ttl
+
+    def submit(self, clusters_list: ClustersList) -> Job:
+        """Create a job for the given clusters and start running it."""
+        if self.workers > 1:
+            # The job could be polled from a worker that doesn't know it
+            raise HTTPException(
+                status_code=status.HTTP_501_NOT_IMPLEMENTED,
+                detail="Prediction jobs need a single worker (WEB_CONCURRENCY=1)",
+            )
+
+        if len(self.jobs) >= self.max_count:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many prediction jobs",
+            )
+
+        job = Job(clusters_list)
+        self.jobs[job.job_id] = job
+        job.task = asyncio.create_task(self.run(job))
+        logger.info(
+            "Prediction job %s submitted for %s clusters",
+            job.job_id,
+            len(clusters_list.clusters),
+        )
+        return job
+
+    def get(self, job_id: UUID) -> Job:
+        """Return the job with the given ID."""
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Job not found"
+            )
+        return job
+
+    async def run(self, job: Job) -> None:
+        """Run the predictions for all the clusters of the job."""
+        # The job outlives the request that submitted it, and its deadline
+        deadline.start_deadline(None)
+        job.status = JOB_STATUS_RUNNING
+        clusters = job.clusters_list.clusters
+        try:
+            cached_results, missing_clusters = await run_in_threadpool(
+                get_cached_results_multi_cluster, clusters
+            )
+            await self._process_results(job, cached_results)
+            await asyncio.gather(
+                *(
+                    self._process_chunk(job, chunk)
+                    for chunk in split_in_chunks(missing_clusters)
+                )
+            )
+
+            processed_clusters = {
+                UUID(prediction.cluster_id) for prediction in job.predictions
+            }
+            for cluster in clusters:
+                if cluster not in processed_clusters:
+                    job.predictions.append(
+                        ClusterPrediction(
+                            cluster_id=str(cluster),
+                            prediction_status="No data for the cluster",
+                        )
+                    )
+            job.status = JOB_STATUS_DONE
+        except Exception:
+            logger.exception("Prediction job %s failed", job.job_id)
+            job.status = JOB_STATUS_FAILED
+        finally:
+            job.finished_at = datetime.now(tz=timezone.utc)
+            self.jobs[job.job_id] = job  # start the expiration countdown
+            logger.info("Prediction job %s finished", job.job_id)
+
+    async def _process_chunk(self, job: Job, chunk: list[UUID]) -> None:
+        """Request RHOBS for a chunk of clusters and run their inference."""
+        async with self.semaphore:
+            try:
+                chunk_results = await run_in_threadpool(
+                    perform_rhobs_request_chunk, chunk
+                )
+            except RHOBSUnavailableError as ex:
+                logger.error("RHOBS unavailable for job %s", job.job_id)
+                chunk_results = ex.stale_results
+                self._report_failed(
+                    job, [c for c in chunk if c not in chunk_results], ex.detail
+                )
+            except HTTPException as ex:
+                logger.error("RHOBS request failed for job %s: %s", job.job_id, ex)
+                self._report_failed(job, chunk, ex.detail)
+                return
+
+            await self._process_results(job, chunk_results)
+
+    @staticmethod
+    def _report_failed(job: Job, clusters: list[UUID], status: str) -> None:
+        """Store a prediction with the given status for every cluster."""
+        job.predictions.extend(
+            ClusterPrediction(cluster_id=str(cluster), prediction_status=status)
+            for cluster in clusters
+        )
+
+    async def _process_results(
+        self, job: Job, results: dict[UUID, tuple[UpgradeRisksPredictors, str]]
+    ) -> None:
+        """Run the inference for the RHOBS results and store the predictions."""
+        predictions = await run_in_threadpool(get_predictions, job, results)
+        job.predictions.extend(predictions)
+
+
+def get_predictions(
+    job: Job, results: dict[UUID, tuple[UpgradeRisksPredictors, str]]
+) -> list[ClusterPrediction]:
+    """Run the inference for every cluster, reporting the failed ones in their status."""
+    predictions = []
+    for cluster, rhobs_result in results.items():
+        try:
+            prediction = get_cluster_prediction(
+                cluster, rhobs_result, job.clusters_list.etags.get(cluster)
+            )
+        except HTTPException as ex:
+            logger.error("Inference failed for cluster %s: %s", cluster, ex)
+            prediction = ClusterPrediction(
+                cluster_id=str(cluster), prediction_status=ex.detail
+            )
+        predictions.append(prediction)
+
+    return predictions
+
+
+@lru_cache
+def get_job_manager() -> JobManager:
+    """JobManager cache."""
+    settings = get_settings()
+    return JobManager(
+        settings.jobs_ttl,
+        settings.jobs_max_count,
+        settings.jobs_max_concurrency,
+        settings.web_concurrency,
+    )
@@ -12,16 +12,27 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""Utility functions to redirect logs to cloudwatch."""
+"""Utility functions to redirect logs to cloudwatch and handle them in background."""
 
-# Copied from https://github.com/RedHatInsights/insights-ccx-messaging/
+# InitializedCloudWatchLogger copied from
+# https://github.com/RedHatInsights/insights-ccx-messaging/
 # blob/main/ccx_messaging/utils/logging.py
 
 import logging
 import os
+import queue
+import reprlib
+from logging.handlers import QueueHandler, QueueListener
 
-from boto3.session import Session
-from watchtower import CloudWatchLogHandler
+from ccx_upgrades_data_eng import metrics
+
+# Limits used to format large payloads, like RHOBS results or clusters lists
+payload_repr = reprlib.Repr()
+payload_repr.maxlevel = 4
+payload_repr.maxlist = 10
+payload_repr.maxdict = 10
+payload_repr.maxstring = 200
+payload_repr.maxother = 200
 
 
 class InitializedCloudWatchLogger(logging.Handler):
@@ -60,6 +71,10 @@ class InitializedCloudWatchLogger(logging.Handler):
             print(f"Missing envs: {missing_envs}, so not starting cloudwatch")
             return logging.NullHandler()
 
+        # Imported here as they are heavy and only needed if CloudWatch is enabled
+        from boto3.session import Session
+        from watchtower import CloudWatchLogHandler
+
         session = Session(
             aws_access_key_id=os.environ["CW_AWS_ACCESS_KEY_ID"],
             aws_secret_access_key=os.environ["CW_AWS_SECRET_ACCESS_KEY"],
@@ -75,3 +90,108 @@ class InitializedCloudWatchLogger(logging.Handler):
             log_stream_name=os.environ["CW_STREAM_NAME"],
             create_log_group=False,
         )
+
+
+class LogPayload:
+    """Large value to be logged, truncated when the record is formatted.
+
+    Only the first items of lists and dicts are formatted, so the cost does
+    not grow with the payload, and nothing is formatted if the record is not
+    emitted.
+    """
+
+    def __init__(self, value) -> None:
+        """Keep the value to be logged."""
+        self.value = value
+
+    def __str__(self) -> str:
+        """Return the truncated representation of the value."""
+        if isinstance(self.value, str):
+            return payload_repr.repr_str(self.value, payload_repr.maxlevel)
+        return payload_repr.repr(self.value)
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """Send the records to a queue, to be handled by the given handlers in background.
+
+    If the queue is full the record is dropped, instead of blocking the caller.
+    """
+
+    def __init__(self, log_queue: queue.Queue, handlers: list[logging.Handler]) -> None:
+        """Initialize the handler with the handlers the records are sent to."""
+        super().__init__(log_queue)
+        self.handlers = handlers
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Enqueue the record as is, leaving all the formatting to the listener.
+
+        The record is handled in the same process, so it does not need to be
+        pickled, and its arguments are kept for formatters that read them, like
+        the uvicorn access one.
+        """
+        return record
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """Enqueue the record with the handlers it has to be sent to."""
+        try:
+            self.queue.put_nowait((self.prepare(record), self.handlers))
+        except queue.Full:
+            metrics.CCX_UPGRADES_LOG_RECORDS_DROPPED_TOTAL.inc()
+        except Exception:
+            self.handleError(record)
+        metrics.CCX_UPGRADES_LOG_QUEUE_SIZE.set(self.queue.qsize())
+
+
+class BackgroundQueueListener(QueueListener):
+    """Handle the records enqueued by BackgroundQueueHandler in a background thread."""
+
+    def __init__(self, log_queue: queue.Queue) -> None:
+        """Initialize the listener for the queue."""
+        super().__init__(log_queue, respect_handler_level=True)
+        self.original_handlers: dict[logging.Logger, list[logging.Handler]] = {}
+
+    def handle(self, item) -> None:
+        """Send the record to the handlers of the logger it was emitted to."""
+        record, handlers = item
+        for handler in handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        metrics.CCX_UPGRADES_LOG_QUEUE_SIZE.set(self.queue.qsize())
+
+    def enqueue_sentinel(self) -> None:
+        """Wait for room in the queue to stop the listener after the pending records."""
+        self.queue.put(self._sentinel)
+
+
+def start_background_logging(maxsize: int) -> BackgroundQueueListener:
+    """Move the handling of the logs to a background thread.
+
+    The handlers of the configured loggers, like the ones set by logging.yaml,
+    are replaced by a handler that enqueues the records, so formatting and I/O
+    are done by the listener thread instead of the event loop.
+    """
+    log_queue = queue.Queue(maxsize)
+    listener = BackgroundQueueListener(log_queue)
+
+    loggers = [logging.getLogger()] + [
+        logger
+        for logger in logging.Logger.manager.loggerDict.values()
+        if isinstance(logger, logging.Logger)
+    ]
+    for logger in loggers:
+        if not logger.handlers:
+            continue
+
+        listener.original_handlers[logger] = logger.handlers
+        logger.handlers = [BackgroundQueueHandler(log_queue, logger.handlers)]
+
+    listener.start()
+    return listener
+
+
+def stop_background_logging(listener: BackgroundQueueListener) -> None:
+    """Handle the pending records and restore the original handlers."""
+    for logger, handlers in listener.original_handlers.items():
+        logger.handlers = handlers
+
+    listener.stop()
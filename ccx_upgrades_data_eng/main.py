@@ -1,65 +1,157 @@
 """Definition of the REST API for the inference service."""
 
+import asyncio
 import logging
 import os
-from contextlib import asynccontextmanager
+from collections.abc import AsyncIterator, Iterator
+from contextlib import AsyncExitStack, asynccontextmanager
+from operator import itemgetter
 from uuid import UUID
 
-from fastapi import Depends, FastAPI, Request, status
-from fastapi.responses import JSONResponse
+from fastapi import (
+    Depends,
+    FastAPI,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    status,
+)
+from fastapi.responses import JSONResponse, StreamingResponse
 from prometheus_fastapi_instrumentator import Instrumentator
+from starlette.concurrency import run_in_threadpool
+from starlette.routing import Match
 
+import ccx_upgrades_data_eng.deadline as deadline
 import ccx_upgrades_data_eng.metrics as metrics
+import ccx_upgrades_data_eng.tracing as tracing
+from ccx_upgrades_data_eng.admission import (
+    AdmissionRejectedError,
+    get_admission_controller,
+)
 from ccx_upgrades_data_eng.auth import (
     SessionManagerError,
     TokenError,
     get_session_manager,
 )
 from ccx_upgrades_data_eng.config import Settings, get_settings
-from ccx_upgrades_data_eng.inference import get_filled_inference_for_predictors
+from ccx_upgrades_data_eng.deadline import DeadlineExceededError
+from ccx_upgrades_data_eng.inference import get_filled_inference_with_fallback
+from ccx_upgrades_data_eng.jobs import get_job_manager
+from ccx_upgrades_data_eng.logging_utils import (
+    LogPayload,
+    start_background_logging,
+    stop_background_logging,
+)
 from ccx_upgrades_data_eng.models import (
     ClusterPrediction,
     ClustersList,
     MultiClusterUpgradeApiResponse,
+    PredictionJob,
+    PredictionJobResults,
     UpgradeApiResponse,
 )
+from ccx_upgrades_data_eng.responses import (
+    PreSerializedJSONResponse,
+    build_cluster_prediction,
+    cache_multi_cluster_response,
+    cache_response,
+    compute_etag,
+    etag_matches,
+    get_cached_multi_cluster_response,
+    get_cached_response,
+    get_caching_headers,
+    get_cluster_inference,
+    get_cluster_prediction,
+    get_clusters_digest,
+    not_modified_response,
+    serialize_response,
+)
 from ccx_upgrades_data_eng.rhobs import (
-    perform_rhobs_request,
+    RHOBS_UNAVAILABLE_STATUS,
+    iter_rhobs_request_multi_cluster,
+    needs_rhobs_query,
     perform_rhobs_request_multi_cluster,
+    perform_rhobs_request_with_fallback,
+    start_parsing_pool,
+    stop_parsing_pool,
 )
 from ccx_upgrades_data_eng.sentry import init_sentry
-from ccx_upgrades_data_eng.utils import get_retry_decorator
+from ccx_upgrades_data_eng.utils import SingleFlight, get_retry_decorator
 
 logger = logging.getLogger(__name__)
 
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Routes under admission control, and whether they are bulk requests
+ADMISSION_CONTROLLED_ROUTES = {
+    ("GET", "/cluster/{cluster_id}/upgrade-risks-prediction"): False,
+    ("POST", "/upgrade-risks-prediction"): True,
+}
+
+# Shares the predictions computed for a set of clusters between the identical
+# requests arriving while they are computed
+# The partial responses are not shared, as they depend on the deadline of the
+# request that computed them
+multi_cluster_predictions_flight = SingleFlight(
+    "multi_cluster_predictions", shareable=itemgetter(1)
+)
+
 init_sentry(
     os.environ.get("SENTRY_DSN", None), None, os.environ.get("SENTRY_ENVIRONMENT", None)
 )
 
 
-def create_lifespan_handler(instrumentator: Instrumentator):
-    """Create a FastAPI lifespan handler for the application.
+def get_metrics(request: Request) -> Response:
+    """Return the Prometheus metrics.
 
-    @param instrumentator: A prometheus instrumentator used to expose metrics
+    The OpenMetrics format, which includes the exemplars linking the histograms
+    to the traces, is used if requested in the Accept header.
     """
+    content, content_type = metrics.generate_metrics(request.headers.get("Accept"))
+    return Response(content=content, headers={"Content-Type": content_type})
+
+
+def create_lifespan_handler():
+    """Create a FastAPI lifespan handler for the application."""
 
     @asynccontextmanager
     async def lifespan(app: FastAPI):
         logger.debug("Exposing metrics")
-        instrumentator.expose(app)
+        app.add_api_route("/metrics", get_metrics, include_in_schema=False)
         logger.info("Metrics available at /metrics")
+        settings = get_settings()
+        log_listener = None
+        if settings.logging_queue_enabled:
+            log_listener = start_background_logging(settings.logging_queue_size)
+        tracing.init_tracing(settings.tracing_enabled)
+        if settings.rhobs_parsing_processes > 0:
+            start_parsing_pool(settings.rhobs_parsing_processes)
+        lag_monitor = None
+        if settings.event_loop_lag_interval > 0:
+            lag_monitor = asyncio.create_task(
+                metrics.monitor_event_loop_lag(settings.event_loop_lag_interval)
+            )
         yield
+        if lag_monitor is not None:
+            lag_monitor.cancel()
+        stop_parsing_pool()
+        tracing.shutdown_tracing()
+        if log_listener is not None:
+            stop_background_logging(log_listener)
 
     return lifespan
 
 
 def create_app():
     """Initialize the app."""
-    instrumentator = Instrumentator()
     app = FastAPI(
-        lifespan=create_lifespan_handler(instrumentator),
+        lifespan=create_lifespan_handler(),
     )
-    instrumentator.instrument(app)
+    Instrumentator(
+        should_instrument_requests_inprogress=True, inprogress_labels=True
+    ).instrument(app)
     return app
 
 
@@ -73,24 +165,126 @@ async def get_session_and_refresh_token():
     session_manager.refresh_token()
 
 
-@app.middleware("http")
-async def refresh_sso_token(request: Request, call_next) -> JSONResponse:
-    """Middleware to ensure SSO token is refreshed before processing the request."""
+def get_route_path(request: Request) -> str:
+    """Return the path template of the route handling the request."""
+    if "path" not in request.scope:
+        return "other"
+
+    for route in app.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+
+    return "other"
+
+
+async def ensure_sso_token() -> None:
+    """Refresh the SSO token needed to query RHOBS, with retries.
+
+    Raise a 503 HTTPException if the token cannot be obtained.
+    """
     try:
-        await get_session_and_refresh_token()
+        with (
+            tracing.start_span("sso.token_refresh"),
+            metrics.observe_stage_time("sso_token_refresh"),
+        ):
+            await get_session_and_refresh_token()
     except SessionManagerError as ex:
         logger.error("Unable to initialize SSO session: %s", ex)
-        return JSONResponse(
-            "Unable to initialize SSO session",
+        raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-        )
+            detail="Unable to initialize SSO session",
+        ) from ex
     except TokenError as ex:
         logger.error("Unable to update SSO token: %s", ex)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Unable to update SSO token",
+        ) from ex
+
+
+@app.middleware("http")
+async def prepare_request(request: Request, call_next) -> Response:
+    """Middleware setting the route, deadline, timings and span of the request."""
+    route = get_route_path(request)
+    metrics.current_endpoint.set(route)
+    settings = get_settings()
+    timeout_header = None
+    if "headers" in request.scope:
+        timeout_header = request.headers.get(deadline.DEADLINE_HEADER)
+    deadline.start_deadline(
+        deadline.get_request_timeout(timeout_header, settings.request_deadline)
+    )
+    timings = None
+    if settings.server_timing_enabled:
+        timings = metrics.RequestTimings()
+        metrics.current_timings.set(timings)
+
+    with tracing.start_request_span(request, route) as span:
+        response = await admit_request(request, call_next, route, timings)
+        if span is not None:
+            span.set_attribute("http.response.status_code", response.status_code)
+
+    return response
+
+
+async def admit_request(
+    request: Request, call_next, route: str, timings: metrics.RequestTimings | None
+) -> Response:
+    """Process the request once admitted, if its route is under admission control.
+
+    Shed requests get a 503 with a Retry-After header. The slot is held until
+    the body of the response is sent, as a streamed response is produced then.
+    """
+    settings = get_settings()
+    bulk = ADMISSION_CONTROLLED_ROUTES.get((request.scope.get("method"), route))
+    if bulk is None or settings.admission_max_in_flight <= 0:
+        return await process_request(request, call_next, timings)
+
+    admission = AsyncExitStack()
+    try:
+        await admission.enter_async_context(
+            get_admission_controller().admit(route, bulk)
+        )
+    except AdmissionRejectedError:
         return JSONResponse(
-            "Unable to update SSO token",
+            "Too many requests in progress",
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": str(settings.admission_retry_after)},
         )
-    return await call_next(request)
+
+    try:
+        response = await process_request(request, call_next, timings)
+    except BaseException:
+        await admission.aclose()
+        raise
+
+    response.body_iterator = release_after_body(response.body_iterator, admission)
+    return response
+
+
+async def release_after_body(
+    body_iterator: AsyncIterator[bytes], admission: AsyncExitStack
+) -> AsyncIterator[bytes]:
+    """Yield the body of the response, then free its admission slot."""
+    try:
+        async for chunk in body_iterator:
+            yield chunk
+    finally:
+        await admission.aclose()
+
+
+async def process_request(
+    request: Request, call_next, timings: metrics.RequestTimings | None
+) -> Response:
+    """Process the request, adding the Server-Timing header."""
+    response = await call_next(request)
+    if timings is not None:
+        server_timing = timings.to_header()
+        if server_timing:
+            response.headers["Server-Timing"] = server_timing
+
+    return response
 
 
 @app.get(
@@ -98,12 +292,33 @@ async def refresh_sso_token(request: Request, call_next) -> JSONResponse:
 )
 async def upgrade_risks_prediction(
     cluster_id: UUID,
+    if_none_match: str | None = Header(default=None),  # noqa: B008
     settings: Settings = Depends(get_settings),  # noqa: B008
 ):
     """Return the predition of an upgrade failure given a set of alerts and focs."""
     logger.info(f"Received cluster: {cluster_id}")
+    if settings.response_cache_enabled:
+        cached_response = get_cached_response(cluster_id)
+        if cached_response is not None:
+            inference_result, body, etag = cached_response
+            metrics.update_ccx_upgrades_prediction_total(inference_result)
+            metrics.update_ccx_upgrades_risks_total(inference_result)
+            if etag_matches(if_none_match, etag):
+                return not_modified_response(etag, settings)
+            return PreSerializedJSONResponse(
+                body, headers=get_caching_headers(etag, settings)
+            )
+
+    if needs_rhobs_query([cluster_id]):
+        await ensure_sso_token()
+
     logger.debug("Getting predictors from RHOBS")
-    predictors, console_url = perform_rhobs_request(cluster_id)
+    # The RHOBS and inference requests block, with their retries and waits,
+    # so they run in a thread
+    rhobs_result = await run_in_threadpool(
+        perform_rhobs_request_with_fallback, cluster_id
+    )
+    predictors, console_url = rhobs_result
 
     if console_url is None or console_url == "":
         return JSONResponse(
@@ -111,50 +326,230 @@ async def upgrade_risks_prediction(
         )
 
     logger.debug("Getting inference result")
-    inference_result = get_filled_inference_for_predictors(predictors, console_url)
+    inference_result = await run_in_threadpool(
+        get_filled_inference_with_fallback, predictors, console_url
+    )
 
     metrics.update_ccx_upgrades_prediction_total(inference_result)
     metrics.update_ccx_upgrades_risks_total(inference_result)
 
-    return inference_result
+    if settings.response_cache_enabled:
+        body, etag = cache_response(cluster_id, rhobs_result, inference_result)
+    else:
+        body, etag = (
+            serialize_response(inference_result),
+            compute_etag(inference_result),
+        )
 
+    if etag_matches(if_none_match, etag):
+        return not_modified_response(etag, settings)
 
-@app.post("/upgrade-risks-prediction", response_model=MultiClusterUpgradeApiResponse)
-async def upgrade_risks_multi_cluster_predictions(
+    return PreSerializedJSONResponse(body, headers=get_caching_headers(etag, settings))
+
+
+def stream_multi_cluster_predictions(clusters_list: ClustersList) -> Iterator[bytes]:
+    """Yield the predictions as NDJSON lines as soon as each RHOBS chunk is processed.
+
+    The clusters without data are yielded at the end. If a RHOBS request fails once
+    the response has started, the clusters not yet processed are reported with the
+    error as prediction status.
+    """
+    missing_status = "No data for the cluster"
+    processed_clusters = set()
+
+    try:
+        for chunk_results in iter_rhobs_request_multi_cluster(clusters_list.clusters):
+            for cluster, rhobs_result in chunk_results.items():
+                prediction = get_cluster_prediction(
+                    cluster, rhobs_result, clusters_list.etags.get(cluster)
+                )
+                processed_clusters.add(cluster)
+                yield serialize_response(prediction) + b"\n"
+    except HTTPException as ex:
+        logger.error("Unable to complete the streamed predictions: %s", ex.detail)
+        missing_status = ex.detail
+    except Exception:
+        # The response already started, so the error can only be reported in it
+        logger.exception("Unexpected error while streaming the predictions")
+        missing_status = "Internal Server Error"
+
+    for cluster in clusters_list.clusters:
+        if cluster in processed_clusters:
+            continue
+
+        prediction = ClusterPrediction(
+            cluster_id=str(cluster), prediction_status=missing_status
+        )
+        yield serialize_response(prediction) + b"\n"
+
+
+def get_multi_cluster_predictions(
     clusters_list: ClustersList,
-    settings: Settings = Depends(get_settings),  # noqa: B008
-):
-    """Return the upgrade risks predictions for the provided clusters."""
-    logger.info("Received clusters list: %s", clusters_list)
-    logger.debug("Getting predictors from RHOBS or cache")
-    predictors_per_cluster = perform_rhobs_request_multi_cluster(clusters_list.clusters)
+) -> tuple[bytes, list | None]:
+    """Return the serialized predictions for the clusters, with or without data.
+
+    Also return the RHOBS and inference results of each cluster with data,
+    or None if the response is partial. If the deadline of the request
+    expires, the clusters not processed yet are reported as timed out, except
+    the ones RHOBS was queried for and had no data. If RHOBS is unavailable,
+    the clusters without a stale result are reported as such.
+    """
+    predictors_per_cluster, queried_clusters = perform_rhobs_request_multi_cluster(
+        clusters_list.clusters
+    )
 
     results = []
-    for cluster, prediction in predictors_per_cluster.items():
-        inference_result = get_filled_inference_for_predictors(
-            prediction[0], prediction[1]
-        )
-        results.append(
-            ClusterPrediction(
-                cluster_id=str(cluster),
-                prediction_status="ok",
-                upgrade_recommended=inference_result.upgrade_recommended,
-                upgrade_risks_predictors=inference_result.upgrade_risks_predictors,
-                last_checked_at=inference_result.last_checked_at,
-            ),
-        )
-        metrics.update_ccx_upgrades_prediction_total(inference_result)
-        metrics.update_ccx_upgrades_risks_total(inference_result)
+    components = []
+    processed_clusters = set()
+    try:
+        for cluster, rhobs_result in predictors_per_cluster.items():
+            inference_result = get_cluster_inference(rhobs_result)
+            results.append(
+                build_cluster_prediction(
+                    cluster, inference_result, clusters_list.etags.get(cluster)
+                )
+            )
+            components.append((cluster, rhobs_result, inference_result))
+            processed_clusters.add(cluster)
+    except DeadlineExceededError:
+        logger.warning("Request deadline exceeded while running the inference")
+
+    timed_out = deadline.is_expired()
+    if timed_out or not queried_clusters.issuperset(clusters_list.clusters):
+        components = None
 
     for cluster in clusters_list.clusters:
-        if cluster in predictors_per_cluster:
+        if cluster in processed_clusters:
             continue
 
+        missing_status = "No data for the cluster"
+        if timed_out and (
+            cluster in predictors_per_cluster or cluster not in queried_clusters
+        ):
+            missing_status = deadline.DEADLINE_EXCEEDED_STATUS
+        elif cluster not in queried_clusters:
+            missing_status = RHOBS_UNAVAILABLE_STATUS
+
         results.append(
             ClusterPrediction(
                 cluster_id=str(cluster),
-                prediction_status="No data for the cluster",
+                prediction_status=missing_status,
             )
         )
 
-    return MultiClusterUpgradeApiResponse(predictions=results)
+    body = serialize_response(MultiClusterUpgradeApiResponse(predictions=results))
+    return body, components
+
+
+async def compute_multi_cluster_predictions(
+    clusters_list: ClustersList, digest: str | None = None
+) -> tuple[bytes, bool]:
+    """Return the serialized predictions and whether they are complete.
+
+    The complete predictions are cached for the digest, if given.
+    """
+    if needs_rhobs_query(clusters_list.clusters):
+        await ensure_sso_token()
+
+    logger.debug("Getting predictors from RHOBS or cache")
+    # Querying RHOBS and parsing its response block, so they run in a thread
+    body, components = await run_in_threadpool(
+        get_multi_cluster_predictions, clusters_list
+    )
+    if digest is not None and components is not None:
+        cache_multi_cluster_response(digest, clusters_list.clusters, components, body)
+
+    return body, components is not None
+
+
+@app.post(
+    "/upgrade-risks-prediction",
+    response_model=MultiClusterUpgradeApiResponse,
+    responses={
+        200: {
+            "content": {NDJSON_MEDIA_TYPE: {}},
+            "description": f"Return the predictions as {NDJSON_MEDIA_TYPE} if requested "
+            "in the Accept header, one ClusterPrediction per line.",
+        }
+    },
+)
+async def upgrade_risks_multi_cluster_predictions(
+    clusters_list: ClustersList,
+    accept: str | None = Header(default=None),  # noqa: B008
+    settings: Settings = Depends(get_settings),  # noqa: B008
+):
+    """Return the upgrade risks predictions for the provided clusters."""
+    logger.info(
+        "Received %s clusters: %s",
+        len(clusters_list.clusters),
+        LogPayload(clusters_list.clusters),
+    )
+    if accept is not None and NDJSON_MEDIA_TYPE in accept:
+        if needs_rhobs_query(clusters_list.clusters):
+            await ensure_sso_token()
+
+        logger.debug("Streaming predictors from RHOBS or cache")
+        return StreamingResponse(
+            stream_multi_cluster_predictions(clusters_list),
+            media_type=NDJSON_MEDIA_TYPE,
+        )
+
+    # The predictions depend on the ETags sent, so these requests are not cached
+    if not settings.response_cache_enabled or clusters_list.etags:
+        body, _ = await compute_multi_cluster_predictions(clusters_list)
+        return PreSerializedJSONResponse(body)
+
+    digest = get_clusters_digest(clusters_list.clusters)
+    body = get_cached_multi_cluster_response(digest)
+    if body is None:
+        # Identical requests arriving meanwhile wait for this one
+        body, _ = await multi_cluster_predictions_flight.run(
+            digest, compute_multi_cluster_predictions, clusters_list, digest
+        )
+
+    return PreSerializedJSONResponse(body)
+
+
+@app.post(
+    "/upgrade-risks-prediction/jobs",
+    response_model=PredictionJob,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def submit_upgrade_risks_prediction_job(
+    clusters_list: ClustersList,
+    response: Response,
+):
+    """Start an asynchronous job to predict the upgrade risks of the provided clusters."""
+    logger.info(
+        "Received %s clusters for a prediction job", len(clusters_list.clusters)
+    )
+    job = get_job_manager().submit(clusters_list)
+    response.headers["Location"] = f"/upgrade-risks-prediction/jobs/{job.job_id}"
+    return job.to_model()
+
+
+@app.get("/upgrade-risks-prediction/jobs/{job_id}", response_model=PredictionJob)
+async def get_upgrade_risks_prediction_job(job_id: UUID):
+    """Return the status and progress of a prediction job."""
+    return get_job_manager().get(job_id).to_model()
+
+
+@app.get(
+    "/upgrade-risks-prediction/jobs/{job_id}/results",
+    response_model=PredictionJobResults,
+)
+async def get_upgrade_risks_prediction_job_results(
+    job_id: UUID,
+    offset: int = Query(default=0, ge=0),  # noqa: B008
+    limit: int = Query(default=100, ge=1, le=1000),  # noqa: B008
+):
+    """Return a page of the predictions completed by a prediction job."""
+    job = get_job_manager().get(job_id)
+    return PredictionJobResults(
+        job_id=job.job_id,
+        status=job.status,
+        offset=offset,
+        limit=limit,
+        total=len(job.predictions),
+        predictions=job.predictions[offset : offset + limit],
+    )
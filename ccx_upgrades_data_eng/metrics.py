@@ -1,14 +1,85 @@
 """Custom Prometheus metrics."""
 
+import asyncio
 import logging
+import os
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
 
-from prometheus_client import Counter, Histogram
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    multiprocess,
+)
+from prometheus_client.exposition import choose_encoder
 from prometheus_client.utils import INF
 
+from ccx_upgrades_data_eng import tracing
 from ccx_upgrades_data_eng.models import UpgradeApiResponse
 
 logger = logging.getLogger(__name__)
 
+# Route of the request being processed, used to label the per-stage metrics.
+# It is set by the middleware and inherited by the tasks and threads handling
+# the request.
+current_endpoint: ContextVar[str] = ContextVar("current_endpoint", default="other")
+
+
+class RequestTimings:
+    """Accumulate the stage times and cache results of a request for Server-Timing.
+
+    Only sums and counters are kept, so recording is cheap enough to be
+    enabled in production.
+    """
+
+    def __init__(self) -> None:
+        """Initialize empty timings."""
+        self.durations: dict[str, float] = {}
+        self.cache_results: dict[str, list[int]] = {}
+        self.counts: dict[str, int] = {}
+
+    def add_duration(self, stage: str, elapsed: float) -> None:
+        """Add the time spent in a stage."""
+        self.durations[stage] = self.durations.get(stage, 0) + elapsed
+
+    def add_cache_result(self, cache: str, hit: bool) -> None:
+        """Count a hit or a miss in the given cache."""
+        results = self.cache_results.setdefault(cache, [0, 0])
+        results[0 if hit else 1] += 1
+
+    def add_count(self, name: str, value: int) -> None:
+        """Add a value to a counter, like the number of cached clusters."""
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def to_header(self) -> str:
+        """Format the timings as a Server-Timing header value."""
+        entries = [
+            f"{stage};dur={elapsed * 1000:.1f}"
+            for stage, elapsed in self.durations.items()
+        ]
+        for cache, (hits, misses) in self.cache_results.items():
+            if not misses:
+                result = "hit"
+            elif not hits:
+                result = "miss"
+            else:
+                result = f"hit={hits} miss={misses}"
+            entries.append(f'cache-{cache};desc="{result}"')
+
+        entries.extend(f"{name};desc={value}" for name, value in self.counts.items())
+        return ", ".join(entries)
+
+
+# Timings of the request being processed, only set if Server-Timing is enabled.
+current_timings: ContextVar[RequestTimings | None] = ContextVar(
+    "current_timings", default=None
+)
+
 CCX_UPGRADES_PREDICTION_TOTAL = Counter(
     "ccx_upgrades_prediction_total",
     "Number of upgrades predictions.",
@@ -27,6 +98,166 @@ CCX_UPGRADES_RHOBS_TIME = Histogram(
     "Time to query RHOBS.",
 )
 
+CCX_UPGRADES_RHOBS_QUEUE_TIME = Histogram(
+    "ccx_upgrades_rhobs_queue_time",
+    "Time the RHOBS queries waited for the concurrency limiter.",
+)
+
+CCX_UPGRADES_STAGE_TIME = Histogram(
+    "ccx_upgrades_stage_time",
+    "Time spent in each stage of the prediction pipeline.",
+    labelnames=("endpoint", "stage"),
+)
+
+CCX_UPGRADES_INFERENCE_TIME = Histogram(
+    "ccx_upgrades_inference_time",
+    "Time to query the inference service.",
+    labelnames=("status_code",),
+)
+
+CCX_UPGRADES_CACHE_HITS_TOTAL = Counter(
+    "ccx_upgrades_cache_hits_total",
+    "Number of reads that found the key in the cache.",
+    labelnames=("cache",),
+)
+
+CCX_UPGRADES_CACHE_MISSES_TOTAL = Counter(
+    "ccx_upgrades_cache_misses_total",
+    "Number of reads that did not find the key in the cache.",
+    labelnames=("cache",),
+)
+
+CCX_UPGRADES_CACHE_EVICTIONS_TOTAL = Counter(
+    "ccx_upgrades_cache_evictions_total",
+    "Number of items evicted from the cache to make room for new ones.",
+    labelnames=("cache",),
+)
+
+CCX_UPGRADES_CACHE_EXPIRATIONS_TOTAL = Counter(
+    "ccx_upgrades_cache_expirations_total",
+    "Number of items removed from the cache because their TTL expired.",
+    labelnames=("cache",),
+)
+
+CCX_UPGRADES_CACHE_EXPIRATIONS_PER_SWEEP = Histogram(
+    "ccx_upgrades_cache_expirations_per_sweep",
+    "Number of items removed together from the cache because their TTL expired.",
+    labelnames=("cache",),
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, INF),
+)
+
+CCX_UPGRADES_CACHE_SIZE = Gauge(
+    "ccx_upgrades_cache_size",
+    "Number of items in the cache.",
+    labelnames=("cache",),
+    multiprocess_mode="livesum",
+)
+
+CCX_UPGRADES_CACHE_BYTES = Gauge(
+    "ccx_upgrades_cache_bytes",
+    "Estimated bytes used by the items in the cache, if bounded by CACHE_MAX_BYTES.",
+    labelnames=("cache",),
+    multiprocess_mode="livesum",
+)
+
+CCX_UPGRADES_CACHE_FILL_RATIO = Gauge(
+    "ccx_upgrades_cache_fill_ratio",
+    "Ratio between the current and the maximum size of the cache.",
+    labelnames=("cache",),
+    multiprocess_mode="livemax",
+)
+
+CCX_UPGRADES_SINGLE_FLIGHT_WAITS_TOTAL = Counter(
+    "ccx_upgrades_single_flight_waits_total",
+    "Number of calls that waited for the result of the same call in progress.",
+    labelnames=("name",),
+)
+
+CCX_UPGRADES_LOG_RECORDS_DROPPED_TOTAL = Counter(
+    "ccx_upgrades_log_records_dropped_total",
+    "Number of log records dropped because the logging queue was full.",
+)
+
+CCX_UPGRADES_LOG_QUEUE_SIZE = Gauge(
+    "ccx_upgrades_log_queue_size",
+    "Number of log records waiting to be handled in background.",
+    multiprocess_mode="livesum",
+)
+
+
+CCX_UPGRADES_EVENT_LOOP_LAG = Gauge(
+    "ccx_upgrades_event_loop_lag",
+    "Delay, in seconds, of the last event loop lag probe over its scheduled time.",
+    multiprocess_mode="livemax",
+)
+
+CCX_UPGRADES_RHOBS_IN_FLIGHT = Gauge(
+    "ccx_upgrades_rhobs_in_flight",
+    "Number of RHOBS queries in progress.",
+    multiprocess_mode="livesum",
+)
+
+CCX_UPGRADES_INFERENCE_IN_FLIGHT = Gauge(
+    "ccx_upgrades_inference_in_flight",
+    "Number of requests to the inference service in progress.",
+    multiprocess_mode="livesum",
+)
+
+
+CCX_UPGRADES_CIRCUIT_BREAKER_STATE = Gauge(
+    "ccx_upgrades_circuit_breaker_state",
+    "State of the circuit breaker: 0 closed, 1 half-open, 2 open.",
+    labelnames=("dependency",),
+    multiprocess_mode="livemax",
+)
+
+CCX_UPGRADES_CIRCUIT_BREAKER_REJECTED_TOTAL = Counter(
+    "ccx_upgrades_circuit_breaker_rejected_total",
+    "Number of calls not made because the circuit breaker was open.",
+    labelnames=("dependency",),
+)
+
+CCX_UPGRADES_RETRIES_TOTAL = Counter(
+    "ccx_upgrades_retries_total",
+    "Number of requests retried, by the error that caused the retry.",
+    labelnames=("dependency", "reason"),
+)
+
+CCX_UPGRADES_RETRY_BUDGET_EXHAUSTED_TOTAL = Counter(
+    "ccx_upgrades_retry_budget_exhausted_total",
+    "Number of failed requests not retried because the retry budget was spent.",
+    labelnames=("dependency",),
+)
+
+CCX_UPGRADES_HEDGED_REQUESTS_TOTAL = Counter(
+    "ccx_upgrades_hedged_requests_total",
+    "Number of hedged requests, by whether the hedge or the first request won, "
+    "or none if both failed.",
+    labelnames=("dependency", "winner"),
+)
+
+CCX_UPGRADES_HEDGES_SKIPPED_TOTAL = Counter(
+    "ccx_upgrades_hedges_skipped_total",
+    "Number of slow requests not hedged, because the hedge budget was spent or "
+    "the limiter had no free slot.",
+    labelnames=("dependency", "reason"),
+)
+
+CCX_UPGRADES_ADMISSION_REJECTED_TOTAL = Counter(
+    "ccx_upgrades_admission_rejected_total",
+    "Number of prediction requests rejected by the admission control.",
+    labelnames=("endpoint", "reason"),
+)
+
+CCX_UPGRADES_ADMISSION_QUEUE_TIME = Histogram(
+    "ccx_upgrades_admission_queue_time",
+    "Time the admitted prediction requests waited for a free slot.",
+    labelnames=("endpoint",),
+)
+
+# Last event loop lag measured by monitor_event_loop_lag, in seconds
+_event_loop_lag = 0.0
+
 
 def update_ccx_upgrades_prediction_total(response: UpgradeApiResponse):
     """Update CCX_UPGRADES_PREDICTION_TOTAL."""
@@ -48,4 +279,64 @@ def update_ccx_upgrades_risks_total(response: UpgradeApiResponse):
 
 def update_ccx_upgrades_rhobs_time(elapsed: float):
     """Update CCX_UPGRADES_RHOBS_TIME."""
-    CCX_UPGRADES_RHOBS_TIME.observe(elapsed)
+    CCX_UPGRADES_RHOBS_TIME.observe(elapsed, tracing.get_exemplar())
+
+
+def update_ccx_upgrades_inference_time(status_code: str, elapsed: float):
+    """Update CCX_UPGRADES_INFERENCE_TIME."""
+    CCX_UPGRADES_INFERENCE_TIME.labels(status_code).observe(
+        elapsed, tracing.get_exemplar()
+    )
+
+
+@contextmanager
+def observe_stage_time(stage: str) -> Iterator[None]:
+    """Observe the time spent in a stage of the pipeline in CCX_UPGRADES_STAGE_TIME."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        CCX_UPGRADES_STAGE_TIME.labels(current_endpoint.get(), stage).observe(
+            elapsed, tracing.get_exemplar()
+        )
+        timings = current_timings.get()
+        if timings is not None:
+            timings.add_duration(stage, elapsed)
+
+
+async def monitor_event_loop_lag(interval: float) -> None:
+    """Measure how late the event loop wakes up from a sleep of the given interval.
+
+    A blocked or saturated event loop runs the callbacks late, so the lag is
+    the time every request waits before being handled.
+    """
+    global _event_loop_lag
+
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        _event_loop_lag = max(loop.time() - start - interval, 0)
+        CCX_UPGRADES_EVENT_LOOP_LAG.set(_event_loop_lag)
+
+
+def get_event_loop_lag() -> float:
+    """Return the last event loop lag measured, in seconds."""
+    return _event_loop_lag
+
+
+def generate_metrics(accept: str | None) -> tuple[bytes, str]:
+    """Generate the metrics in the format requested in the Accept header.
+
+    Return the metrics and their content type. When running several workers,
+    PROMETHEUS_MULTIPROC_DIR is set and the metrics of all the workers are
+    aggregated from the files they write in that directory.
+    """
+    registry = REGISTRY
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+
+    encoder, content_type = choose_encoder(accept)
+    return encoder(registry), content_type
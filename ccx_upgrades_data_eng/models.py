@@ -174,6 +174,9 @@ class ClusterPrediction(BaseModel):
     Contains the prediction for a single cluster, like UpgradeApiResponse, but including 2 extra
     fields: cluster_id and prediction_status. The later is to indicate if the prediction was
     performed correctly, not the result of the prediction.
+
+    If the client already holds the current prediction (its ETag was sent in the request), the
+    prediction_status is "unchanged" and only the cluster_id and etag are filled.
     """
 
     cluster_id: str
@@ -181,6 +184,7 @@ class ClusterPrediction(BaseModel):
     upgrade_recommended: bool | None = None
     upgrade_risks_predictors: UpgradeRisksPredictorsWithURLs | None = None
     last_checked_at: datetime | None = None
+    etag: str | None = None
 
 
 class MultiClusterUpgradeApiResponse(BaseModel):
@@ -204,6 +208,12 @@ class MultiClusterUpgradeApiResponse(BaseModel):
                             "operator_conditions": [],
                         },
                         "last_checked_at": "2011-15-04T00:05:23Z",
+                        "etag": 'W/"6a2f0c1d9e8b7a6f5e4d3c2b1a098765"',
+                    },
+                    {
+                        "cluster_id": "ffffffff-bbbb-cccc-dddd-eeeeeeeeeeee",
+                        "prediction_status": "unchanged",
+                        "etag": 'W/"0f1e2d3c4b5a69788796a5b4c3d2e1f0"',
                     },
                 ],
             }
@@ -214,7 +224,65 @@ class MultiClusterUpgradeApiResponse(BaseModel):
 class ClustersList(BaseModel):
     """ClustersList is the definition for the request body for the upgrade-risk-prediction endpoint.
 
-    It allows to include an array of cluster ids from the request.
+    It allows to include an array of cluster ids from the request and, optionally, the ETag of
+    the prediction the client already holds for some of them. Those clusters are only returned in
+    full if their prediction changed.
     """
 
     clusters: list[UUID]
+    etags: dict[UUID, str] = {}
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "clusters": [
+                    "aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee",
+                    "ffffffff-bbbb-cccc-dddd-eeeeeeeeeeee",
+                ],
+                "etags": {
+                    "ffffffff-bbbb-cccc-dddd-eeeeeeeeeeee": 'W/"0f1e2d3c4b5a69788796a5b4c3d2e1f0"',
+                },
+            }
+        }
+    )
+
+
+class PredictionJob(BaseModel):
+    """Represents the status of an asynchronous multi cluster prediction job.
+
+    The status is one of "pending", "running", "done" or "failed". processed_clusters tells how
+    many of the total_clusters have a prediction available in the job results.
+    """
+
+    job_id: UUID
+    status: str
+    total_clusters: int
+    processed_clusters: int
+    created_at: datetime
+    finished_at: datetime | None = None
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "job_id": "0c5d6f5e-7b0e-4c8e-9d55-2f1b1a0b3c4d",
+                "status": "running",
+                "total_clusters": 10000,
+                "processed_clusters": 2500,
+                "created_at": "2011-15-04T00:05:23Z",
+                "finished_at": None,
+            }
+        }
+    )
+
+
+class PredictionJobResults(BaseModel):
+    """Represents a page of the results of an asynchronous multi cluster prediction job.
+
+    The predictions are returned in the order they were completed. total is the number of
+    predictions available so far, which only grows while the job is running.
+    """
+
+    job_id: UUID
+    status: str
+    offset: int
+    limit: int
+    total: int
+    predictions: list[ClusterPrediction]
@@ -0,0 +1,282 @@
+"""Helpers to serve pre-serialized and conditional prediction responses."""
+
+import hashlib
+import logging
+from uuid import UUID
+
+from fastapi import Response, status
+from pydantic import BaseModel, ValidationError
+
+from ccx_upgrades_data_eng import inference, metrics, rhobs
+from ccx_upgrades_data_eng.config import (
+    DEFAULT_MULTI_CLUSTER_RESPONSE_CACHE_TTL,
+    Settings,
+    get_settings,
+)
+from ccx_upgrades_data_eng.models import (
+    ClusterPrediction,
+    UpgradeApiResponse,
+    UpgradeRisksPredictors,
+)
+from ccx_upgrades_data_eng.utils import CustomTTLCache
+
+logger = logging.getLogger(__name__)
+
+# Maps a cluster ID to the RHOBS result and inference result the response was
+# built from, the serialized JSON body and its ETag.
+serialized_responses_cache = CustomTTLCache("responses")
+
+
+def get_multi_cluster_response_cache_ttl() -> int:
+    """Return the TTL of the serialized multi cluster responses."""
+    try:
+        return get_settings().multi_cluster_response_cache_ttl
+    except ValidationError:
+        logger.debug("Settings not loaded yet. Using default values")
+        return DEFAULT_MULTI_CLUSTER_RESPONSE_CACHE_TTL
+
+
+# Maps the digest of a set of clusters to the RHOBS and inference results the
+# multi cluster response was built from, the clusters without data and the
+# serialized JSON body. Its TTL is short, as the response is only valid while
+# all these entries are cached.
+multi_cluster_responses_cache = CustomTTLCache(
+    "multi_cluster_responses", ttl=get_multi_cluster_response_cache_ttl()
+)
+
+
+class PreSerializedJSONResponse(Response):
+    """A response whose content is an already serialized JSON document."""
+
+    media_type = "application/json"
+
+
+def serialize_response(response: BaseModel) -> bytes:
+    """Serialize the response to JSON using the pydantic-core encoder."""
+    with metrics.observe_stage_time("serialization"):
+        return response.__pydantic_serializer__.to_json(response)
+
+
+def compute_etag(response: UpgradeApiResponse) -> str:
+    """Compute a weak ETag from the content of the prediction.
+
+    last_checked_at is excluded: it changes every time the inference is
+    refreshed even if the prediction is the same, and clients only care
+    about the prediction itself. As the body still contains it, the ETag
+    is a weak one. Its time is observed in a stage of its own, so the
+    serialization stage only counts the serialization of the body.
+    """
+    with metrics.observe_stage_time("etag"):
+        content = response.model_dump_json(exclude={"last_checked_at"})
+    digest = hashlib.sha256(content.encode()).hexdigest()[:32]
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Check if the If-None-Match header matches the ETag using weak comparison."""
+    if not if_none_match:
+        return False
+
+    opaque_tag = etag.removeprefix("W/")
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == opaque_tag:
+            return True
+
+    return False
+
+
+def get_caching_headers(etag: str, settings: Settings) -> dict[str, str]:
+    """Return the ETag and Cache-Control headers for a prediction response.
+
+    The max-age follows the configured cache TTL, as the response won't
+    change before the cached entries expire.
+    """
+    if settings.cache_enabled and settings.cache_ttl > 0:
+        cache_control = f"max-age={settings.cache_ttl}"
+    else:
+        cache_control = "no-cache"
+
+    return {"ETag": etag, "Cache-Control": cache_control}
+
+
+def not_modified_response(etag: str, settings: Settings) -> Response:
+    """Return an empty 304 response for the given ETag."""
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED,
+        headers=get_caching_headers(etag, settings),
+    )
+
+
+def is_cached_response_current(
+    rhobs_result: tuple[UpgradeRisksPredictors, str],
+    inference_result: UpgradeApiResponse,
+    cluster_id: UUID,
+) -> bool:
+    """Check the entries a serialized response was built from are still cached.
+
+    The serialized response is only valid as long as the same objects are
+    stored in the RHOBS and inference caches, so an eviction or expiration in
+    any of them invalidates the serialized body too. The lookups don't count
+    as reads in the cache metrics.
+    """
+    if rhobs.perform_rhobs_request.cache.peek((cluster_id,)) is not rhobs_result:
+        return False
+
+    cached_inference = inference.get_filled_inference_for_predictors.cache.peek(
+        tuple(rhobs_result)
+    )
+    return cached_inference is inference_result
+
+
+def get_cached_response(
+    cluster_id: UUID,
+) -> tuple[UpgradeApiResponse, bytes, str] | None:
+    """Return the cached inference result, its serialized body and ETag if still valid."""
+    entry = serialized_responses_cache.get(cluster_id)
+    if entry is None:
+        return None
+
+    rhobs_result, inference_result, body, etag = entry
+    if not is_cached_response_current(rhobs_result, inference_result, cluster_id):
+        logger.debug("Serialized response for cluster %s is stale", cluster_id)
+        serialized_responses_cache.pop(cluster_id, None)
+        return None
+
+    logger.debug("Using serialized response for cluster %s", cluster_id)
+    return inference_result, body, etag
+
+
+def cache_response(
+    cluster_id: UUID,
+    rhobs_result: tuple[UpgradeRisksPredictors, str],
+    inference_result: UpgradeApiResponse,
+) -> tuple[bytes, str]:
+    """Serialize the inference result, compute its ETag and store both in the cache."""
+    body = serialize_response(inference_result)
+    etag = compute_etag(inference_result)
+    if serialized_responses_cache.maxsize != 0:
+        serialized_responses_cache[cluster_id] = (
+            rhobs_result,
+            inference_result,
+            body,
+            etag,
+        )
+
+    return body, etag
+
+
+def get_clusters_digest(clusters: list[UUID]) -> str:
+    """Return a digest identifying the set of clusters, whatever their order."""
+    content = "\n".join(sorted({str(cluster) for cluster in clusters}))
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def has_rhobs_data(cluster_id: UUID) -> bool:
+    """Check if the RHOBS cache has data for the cluster, without counting a read."""
+    cached_result = rhobs.perform_rhobs_request.cache.peek((cluster_id,))
+    return cached_result is not None and cached_result[1] is not None
+
+
+def is_multi_cluster_response_current(
+    components: list[
+        tuple[UUID, tuple[UpgradeRisksPredictors, str], UpgradeApiResponse]
+    ],
+    clusters_without_data: set[UUID],
+) -> bool:
+    """Check the entries a multi cluster response was built from are still cached.
+
+    As for the single cluster responses, any change in the RHOBS or inference
+    entry of one of its clusters invalidates the response. So does new data in
+    the RHOBS cache for a cluster reported without data.
+    """
+    for cluster_id, rhobs_result, inference_result in components:
+        if not is_cached_response_current(rhobs_result, inference_result, cluster_id):
+            return False
+
+    return not any(has_rhobs_data(cluster_id) for cluster_id in clusters_without_data)
+
+
+def get_cached_multi_cluster_response(digest: str) -> bytes | None:
+    """Return the serialized multi cluster response for the digest if still valid."""
+    entry = multi_cluster_responses_cache.get(digest)
+    if entry is None:
+        return None
+
+    components, clusters_without_data, body = entry
+    if not is_multi_cluster_response_current(components, clusters_without_data):
+        logger.debug("Serialized multi cluster response %s is stale", digest)
+        multi_cluster_responses_cache.pop(digest, None)
+        return None
+
+    logger.debug("Using serialized multi cluster response %s", digest)
+    for _, _, inference_result in components:
+        metrics.update_ccx_upgrades_prediction_total(inference_result)
+        metrics.update_ccx_upgrades_risks_total(inference_result)
+    return body
+
+
+def cache_multi_cluster_response(
+    digest: str,
+    clusters: list[UUID],
+    components: list[
+        tuple[UUID, tuple[UpgradeRisksPredictors, str], UpgradeApiResponse]
+    ],
+    body: bytes,
+) -> None:
+    """Store the serialized multi cluster response with the entries it was built from."""
+    if multi_cluster_responses_cache.maxsize == 0:
+        return
+
+    clusters_without_data = set(clusters).difference(
+        cluster_id for cluster_id, _, _ in components
+    )
+    multi_cluster_responses_cache[digest] = (components, clusters_without_data, body)
+
+
+def get_cluster_inference(
+    rhobs_result: tuple[UpgradeRisksPredictors, str],
+) -> UpgradeApiResponse:
+    """Run the inference for a cluster and count the prediction in the metrics."""
+    predictors, console_url = rhobs_result
+    inference_result = inference.get_filled_inference_with_fallback(
+        predictors, console_url
+    )
+    metrics.update_ccx_upgrades_prediction_total(inference_result)
+    metrics.update_ccx_upgrades_risks_total(inference_result)
+    return inference_result
+
+
+def get_cluster_prediction(
+    cluster: UUID,
+    rhobs_result: tuple[UpgradeRisksPredictors, str],
+    known_etag: str | None,
+) -> ClusterPrediction:
+    """Run the inference for a cluster and build its ClusterPrediction."""
+    return build_cluster_prediction(
+        cluster, get_cluster_inference(rhobs_result), known_etag
+    )
+
+
+def build_cluster_prediction(
+    cluster: UUID,
+    inference_result: UpgradeApiResponse,
+    known_etag: str | None,
+) -> ClusterPrediction:
+    """Build the ClusterPrediction of a cluster from its inference result."""
+    etag = compute_etag(inference_result)
+    if etag_matches(known_etag, etag):
+        return ClusterPrediction(
+            cluster_id=str(cluster),
+            prediction_status="unchanged",
+            etag=etag,
+        )
+
+    return ClusterPrediction(
+        cluster_id=str(cluster),
+        prediction_status="ok",
+        upgrade_recommended=inference_result.upgrade_recommended,
+        upgrade_risks_predictors=inference_result.upgrade_risks_predictors,
+        last_checked_at=inference_result.last_checked_at,
+        etag=etag,
+    )
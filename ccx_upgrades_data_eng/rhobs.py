@@ -1,7 +1,15 @@
 """Functions for generating the RHOBS queries needed by the service."""
 
+import json
 import logging
+import multiprocessing
+import time
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from functools import lru_cache
 from uuid import UUID
 
 import requests
@@ -9,18 +17,141 @@ from cachetools import cached
 from fastapi import HTTPException
 from requests.exceptions import ConnectionError, ReadTimeout
 
-from ccx_upgrades_data_eng import metrics
-from ccx_upgrades_data_eng.auth import get_session_manager
+from ccx_upgrades_data_eng import deadline, metrics, sentry, tracing
+from ccx_upgrades_data_eng.auth import (
+    SessionManagerError,
+    TokenError,
+    get_session_manager,
+)
 from ccx_upgrades_data_eng.config import get_settings
+from ccx_upgrades_data_eng.deadline import DeadlineExceededError
+from ccx_upgrades_data_eng.logging_utils import LogPayload
 from ccx_upgrades_data_eng.models import (
     FOC,
     Alert,
     UpgradeRisksPredictors,
 )
-from ccx_upgrades_data_eng.utils import CustomTTLCache
+from ccx_upgrades_data_eng.utils import (
+    CircuitOpenError,
+    CustomTTLCache,
+    RequestHedger,
+    WeightedLimiter,
+    get_circuit_breaker,
+    get_retry_policy,
+)
 
 logger = logging.getLogger(__name__)
 
+# Compact result of a cluster sent back by the parsing processes: the alerts as
+# (name, namespace, severity), the FOCs as (name, condition, reason) and the
+# console URL.
+CompactClusterResult = tuple[
+    list[tuple[str, str | None, str]], list[tuple[str, str, str | None]], str
+]
+
+RHOBS_UNAVAILABLE_STATUS = "RHOBS unavailable"
+
+_parsing_pool: ProcessPoolExecutor | None = None
+
+
+class RHOBSUnavailableError(HTTPException):
+    """RHOBS was not queried for some clusters, as its circuit breaker is open.
+
+    The expired results still kept for the other clusters are in stale_results.
+    """
+
+    def __init__(
+        self, stale_results: dict[UUID, tuple[UpgradeRisksPredictors, str]]
+    ) -> None:
+        """Initialize the exception as a 503 response."""
+        super().__init__(status_code=503, detail=RHOBS_UNAVAILABLE_STATUS)
+        self.stale_results = stale_results
+
+
+def start_parsing_pool(processes: int) -> None:
+    """Start the pool of processes parsing the large multi cluster responses.
+
+    The processes are started with forkserver, so they don't inherit the
+    threads and the open connections of the service.
+    """
+    global _parsing_pool
+
+    logger.info("Starting %s RHOBS parsing processes", processes)
+    _parsing_pool = ProcessPoolExecutor(
+        max_workers=processes, mp_context=multiprocessing.get_context("forkserver")
+    )
+
+
+def stop_parsing_pool() -> None:
+    """Stop the parsing processes, if started."""
+    global _parsing_pool
+
+    if _parsing_pool is not None:
+        _parsing_pool.shutdown(cancel_futures=True)
+
+    _parsing_pool = None
+
+
+@lru_cache
+def get_rhobs_limiter() -> WeightedLimiter | None:
+    """Return the limiter of the concurrent RHOBS queries, if enabled."""
+    max_in_flight_clusters = get_settings().rhobs_max_in_flight_clusters
+    if max_in_flight_clusters <= 0:
+        return None
+
+    return WeightedLimiter(max_in_flight_clusters)
+
+
+@lru_cache
+def get_rhobs_hedger() -> RequestHedger | None:
+    """Return the hedger of the RHOBS queries, if enabled."""
+    settings = get_settings()
+    if not settings.rhobs_hedging_enabled:
+        return None
+
+    return RequestHedger(
+        "rhobs",
+        settings.rhobs_hedge_percentile,
+        settings.rhobs_hedge_min_delay,
+        settings.rhobs_hedge_budget,
+    )
+
+
+@contextmanager
+def rhobs_query_slot(cluster_count: int) -> Iterator[None]:
+    """Run the block once the limiter lets a query for cluster_count clusters start.
+
+    The queries are weighted by their number of clusters, as that's what makes
+    them heavy for Observatorium. The wait is capped by RHOBS_MAX_QUEUE_TIME:
+    raise DeadlineExceededError if the deadline of the request expires while
+    waiting, or a 503 HTTPException if the wait runs out first.
+    """
+    limiter = get_rhobs_limiter()
+    if limiter is None:
+        yield
+        return
+
+    timeout = get_settings().rhobs_max_queue_time
+    remaining = deadline.remaining_time()
+    if remaining is not None:
+        timeout = min(timeout, max(remaining, 0))
+
+    start = time.perf_counter()
+    with metrics.observe_stage_time("rhobs_queue"):
+        acquired = limiter.acquire(cluster_count, timeout)
+    metrics.CCX_UPGRADES_RHOBS_QUEUE_TIME.observe(time.perf_counter() - start)
+    if not acquired:
+        if deadline.is_expired():
+            raise DeadlineExceededError()
+        logger.warning("Too many RHOBS queries in progress, shedding the request")
+        raise HTTPException(
+            status_code=503, detail="Too many RHOBS queries in progress"
+        )
+    try:
+        yield
+    finally:
+        limiter.release(cluster_count)
+
 
 def alerts_and_focs(cluster_ids: list[UUID]) -> str:
     """Return a query for retrieving alerts and focs for serveral clusters."""
@@ -34,31 +165,162 @@ or
 cluster_operator_conditions{{_id=~"{clusters}", condition="Degraded"}} == 1"""
 
 
-def query_rhobs_endpoint(query: str) -> requests.Response:
-    """Request the RHOBS  for a given cluster ID."""
+def query_rhobs_endpoint(query: str, cluster_count: int = 1) -> requests.Response:
+    """Request the RHOBS  for a given cluster ID.
+
+    The transient errors are retried, if enabled.
+    """
+    retry_policy = get_retry_policy("rhobs")
+    if retry_policy is None:
+        return run_rhobs_query(query, cluster_count)
+
+    return retry_policy.call(run_rhobs_query, query, cluster_count)
+
+
+def get_rhobs_session() -> requests.Session:
+    """Return the session to query RHOBS, with a valid SSO token.
+
+    Raise a 503 HTTPException if the token cannot be obtained.
+    """
+    try:
+        return get_session_manager().get_session()
+    except SessionManagerError as ex:
+        logger.error("Unable to initialize SSO session: %s", ex)
+        raise HTTPException(
+            status_code=503, detail="Unable to initialize SSO session"
+        ) from ex
+    except TokenError as ex:
+        logger.error("Unable to update SSO token: %s", ex)
+        raise HTTPException(
+            status_code=503, detail="Unable to update SSO token"
+        ) from ex
+
+
+def run_rhobs_query(query: str, cluster_count: int) -> requests.Response:
+    """Send a query to RHOBS through the limiter and the circuit breaker.
+
+    The limiter is waited for before the circuit breaker, so the shed queries
+    are not counted as failures of RHOBS.
+    """
+    with rhobs_query_slot(cluster_count):
+        return call_rhobs_query(query, cluster_count)
+
+
+def call_rhobs_query(query: str, cluster_count: int) -> requests.Response:
+    """Send a query to RHOBS through the circuit breaker."""
     settings = get_settings()
-    session = get_session_manager().get_session()
+    session = get_rhobs_session()
 
     rhobs_endpoint = f"/api/metrics/v1/{settings.rhobs_tenant}/api/v1/query"
 
-    return session.get(
-        f"{settings.rhobs_url}{rhobs_endpoint}",
-        params={
-            "query": query,
-            "time": get_timestamp_minutes_before(
-                settings.rhobs_query_max_minutes_for_data
+    breaker = get_circuit_breaker("rhobs")
+    if breaker is not None:
+        breaker.before_call()
+
+    try:
+        with (
+            tracing.start_span(
+                "rhobs.query", {"rhobs.cluster_count": cluster_count}
+            ) as span,
+            sentry.start_span(
+                "rhobs.query", f"RHOBS query for {cluster_count} clusters"
             ),
-        },
-        timeout=settings.rhobs_request_timeout,
-        verify=not settings.allow_insecure,
+            metrics.observe_stage_time("rhobs_fetch"),
+            metrics.CCX_UPGRADES_RHOBS_IN_FLIGHT.track_inprogress(),
+        ):
+            response = send_rhobs_query(
+                session,
+                f"{settings.rhobs_url}{rhobs_endpoint}",
+                {
+                    "query": query,
+                    "time": get_timestamp_minutes_before(
+                        settings.rhobs_query_max_minutes_for_data
+                    ),
+                },
+                cluster_count,
+            )
+            tracing.set_span_attribute(
+                span, "http.response.status_code", response.status_code
+            )
+            tracing.set_span_attribute(
+                span, "rhobs.response_bytes", len(response.content)
+            )
+    except Exception as ex:
+        if not deadline.is_expired():
+            if breaker is not None:
+                breaker.record_failure()
+            raise
+
+        # Not a failure of RHOBS: the request ran out of time
+        if breaker is not None:
+            breaker.cancel_call()
+        if isinstance(ex, DeadlineExceededError):
+            raise
+        raise DeadlineExceededError() from ex
+
+    if breaker is not None:
+        breaker.record(response.status_code < 500)
+
+    return response
+
+
+def send_rhobs_query(
+    session: requests.Session, url: str, params: dict, cluster_count: int
+) -> requests.Response:
+    """Send the query, hedging it if enabled.
+
+    The single and multi cluster queries are hedged based on their own
+    latencies, as the multi cluster ones are much slower. The hedge takes a
+    limiter slot of its own. The timeout is shortened to fit in the deadline
+    of the request.
+    """
+    settings = get_settings()
+
+    def send() -> requests.Response:
+        return session.get(
+            url,
+            params=params,
+            timeout=deadline.get_timeout(settings.rhobs_request_timeout),
+            verify=not settings.allow_insecure,
+        )
+
+    hedger = get_rhobs_hedger()
+    if hedger is None:
+        return send()
+
+    return hedger.run(
+        send,
+        "single" if cluster_count == 1 else "multi",
+        get_rhobs_limiter(),
+        cluster_count,
     )
 
 
-@cached(cache=CustomTTLCache())
+def perform_rhobs_request_with_fallback(
+    cluster_id: UUID,
+) -> tuple[UpgradeRisksPredictors, str]:
+    """Return the result of perform_rhobs_request for the cluster.
+
+    While the circuit breaker of RHOBS is open, the expired result still kept
+    is returned instead. It is looked up here, outside of the cached function,
+    so it is not stored again as a live entry.
+    """
+    try:
+        return perform_rhobs_request(cluster_id)
+    except CircuitOpenError as e:
+        stale_result = perform_rhobs_request.cache.get_stale((cluster_id,))
+        if stale_result is None:
+            raise HTTPException(status_code=503, detail=RHOBS_UNAVAILABLE_STATUS) from e
+        logger.info("RHOBS unavailable. Using stale result for cluster %s", cluster_id)
+        return stale_result
+
+
+@cached(cache=CustomTTLCache("rhobs", keep_stale=True))
 def perform_rhobs_request(cluster_id: UUID) -> tuple[UpgradeRisksPredictors, str]:
     """Run the requests to RHOBS server and return the retrieved predictors.
 
-    Also return the console url.
+    Also return the console url. Raise CircuitOpenError while the circuit
+    breaker of RHOBS is open.
     """
     query = alerts_and_focs([cluster_id])
     try:
@@ -70,26 +332,35 @@ def perform_rhobs_request(cluster_id: UUID) -> tuple[UpgradeRisksPredictors, str
     if response.status_code == 404:
         logger.debug('cluster "%s" not found in Observatorium', cluster_id)
         logger.debug("Observatorium response status code: %s", response.status_code)
-        logger.debug("Observatorium response text: %s", response.text)
+        logger.debug("Observatorium response text: %s", LogPayload(response.text))
         raise HTTPException(status_code=404, detail="Cluster not found")
 
     if response.status_code != 200:
         logger.debug("Observatorium response status code: %s", response.status_code)
-        logger.debug("Observatorium response text: %s", response.text)
+        logger.debug("Observatorium response text: %s", LogPayload(response.text))
         raise HTTPException(status_code=response.status_code)
 
-    results = response.json().get("data", {}).get("result", [])
+    with metrics.observe_stage_time("json_decode"):
+        results = response.json().get("data", {}).get("result", [])
     logger.info("Observatorium response contains %s results", len(results))
     logger.debug(
         "Observatorium request elapsed time: %s", response.elapsed.total_seconds()
     )
-    logger.debug("Observatorium response results: %s", results)
+    logger.debug("Observatorium response results: %s", LogPayload(results))
     metrics.update_ccx_upgrades_rhobs_time(response.elapsed.total_seconds())
 
     # Differ between empty metrics and situation with no data for the cluster in RHOBS
     if len(results) == 0:
         return (None, None)
 
+    with metrics.observe_stage_time("predictor_parsing"):
+        return parse_single_cluster_results(results)
+
+
+def parse_single_cluster_results(
+    results: list[dict],
+) -> tuple[UpgradeRisksPredictors, str]:
+    """Parse the RHOBS results of a single cluster into its predictors and console URL."""
     alerts = set()
     focs = set()
 
@@ -124,45 +395,197 @@ def perform_rhobs_request(cluster_id: UUID) -> tuple[UpgradeRisksPredictors, str
     return predictors, console_url
 
 
-def perform_rhobs_request_multi_cluster(
-    clusters: list[UUID],
-) -> dict[UUID, tuple[UpgradeRisksPredictors, str]]:
-    """Run the requests to RHOBS server and return the predictors for all the clusters.
+def needs_rhobs_query(clusters: list[UUID]) -> bool:
+    """Check if RHOBS must be queried for any of the clusters, as it is not cached.
 
-    It shares, reads and updates the cache for perform_rhobs_request.
+    A cluster cached without data doesn't need a query either. The lookups don't
+    count as reads in the cache metrics.
+    """
+    return any(
+        perform_rhobs_request.cache.peek((cluster_id,)) is None
+        for cluster_id in clusters
+    )
 
-    Also return the console url.
+
+def get_cached_results_multi_cluster(
+    clusters: list[UUID],
+) -> tuple[dict[UUID, tuple[UpgradeRisksPredictors, str]], list[UUID]]:
+    """Split the clusters between the ones cached by perform_rhobs_request and the rest.
+
+    Return the cached results and the list of missing clusters, without duplicates.
+    The clusters cached without data are in neither of them.
     """
     clusters_results = {}
-    missing_clusters = set()
+    missing_clusters = []
+    unique_clusters = dict.fromkeys(clusters)
 
-    for cluster_id in clusters:
+    for cluster_id in unique_clusters:
         cached_result = perform_rhobs_request.cache.get((cluster_id,))
-        if cached_result:
-            _, console_url = cached_result
-            if console_url is not None:
-                logger.debug("Using cached result for cluster %s", cluster_id)
-                clusters_results[cluster_id] = cached_result
-                continue
+        if cached_result is None:
+            missing_clusters.append(cluster_id)
+            continue
 
-        missing_clusters.add(cluster_id)
+        _, console_url = cached_result
+        if console_url is None:
+            logger.debug("Cluster %s cached without data", cluster_id)
+        else:
+            logger.debug("Using cached result for cluster %s", cluster_id)
+            clusters_results[cluster_id] = cached_result
 
-    if len(missing_clusters) == 0:
-        return clusters_results
+    timings = metrics.current_timings.get()
+    if timings is not None:
+        timings.add_count(
+            "clusters-cached", len(unique_clusters) - len(missing_clusters)
+        )
+        timings.add_count("clusters-fetched", len(missing_clusters))
+
+    return clusters_results, missing_clusters
+
+
+def split_in_chunks(clusters: list[UUID]) -> list[list[UUID]]:
+    """Split the clusters in chunks of RHOBS_MULTI_CLUSTER_CHUNK_SIZE clusters.
+
+    If the chunk size is 0, all the clusters are returned in a single chunk.
+    """
+    if not clusters:
+        return []
+
+    chunk_size = get_settings().rhobs_multi_cluster_chunk_size or len(clusters)
+    return [clusters[i : i + chunk_size] for i in range(0, len(clusters), chunk_size)]
+
+
+def iter_rhobs_request_multi_cluster(
+    clusters: list[UUID],
+) -> Iterator[dict[UUID, tuple[UpgradeRisksPredictors, str]]]:
+    """Yield the predictors for the clusters as soon as they are available.
+
+    The cached results are yielded first. The missing clusters are then requested
+    to RHOBS in chunks of RHOBS_MULTI_CLUSTER_CHUNK_SIZE clusters (all of them in a
+    single request if it is 0), yielding the results of each chunk. If RHOBS is
+    unavailable, the stale results of the chunk are yielded before raising
+    RHOBSUnavailableError.
+    """
+    clusters_results, missing_clusters = get_cached_results_multi_cluster(clusters)
+    if clusters_results:
+        yield clusters_results
+
+    for chunk in split_in_chunks(missing_clusters):
+        try:
+            chunk_results = perform_rhobs_request_chunk(chunk)
+        except RHOBSUnavailableError as ex:
+            if ex.stale_results:
+                yield ex.stale_results
+            raise
+        yield chunk_results
+
+
+def perform_rhobs_request_multi_cluster(
+    clusters: list[UUID],
+) -> tuple[dict[UUID, tuple[UpgradeRisksPredictors, str]], set[UUID]]:
+    """Run the request to RHOBS server and return the predictors for all the clusters.
+
+    It shares, reads and updates the cache for perform_rhobs_request. The
+    missing clusters are requested in a single query, not in chunks: the
+    response is only sent once all of them are processed anyway.
+
+    Also return the console url, and the clusters found in the cache or
+    queried to RHOBS: the ones without results among them have no data. If
+    the deadline of the request expires, only the cached clusters are returned,
+    and if RHOBS is unavailable, the cached and stale ones.
+    """
+    clusters_results, missing_clusters = get_cached_results_multi_cluster(clusters)
+    queried_clusters = set(clusters).difference(missing_clusters)
+    if not missing_clusters:
+        return clusters_results, queried_clusters
 
-    query = alerts_and_focs(missing_clusters)
     try:
-        response = query_rhobs_endpoint(query)
+        clusters_results.update(perform_rhobs_request_chunk(missing_clusters))
+    except DeadlineExceededError:
+        logger.warning(
+            "Request deadline exceeded. Returning %s clusters of %s",
+            len(clusters_results),
+            len(clusters),
+        )
+    except RHOBSUnavailableError as ex:
+        logger.warning(
+            "RHOBS unavailable. Using stale results for %s clusters of %s",
+            len(ex.stale_results),
+            len(missing_clusters),
+        )
+        clusters_results.update(ex.stale_results)
+        queried_clusters.update(ex.stale_results)
+    else:
+        queried_clusters.update(missing_clusters)
+
+    return clusters_results, queried_clusters
+
+
+def perform_rhobs_request_chunk(
+    clusters: list[UUID],
+) -> dict[UUID, tuple[UpgradeRisksPredictors, str]]:
+    """Run a single request to RHOBS server for the given clusters.
+
+    It updates the cache for perform_rhobs_request with the results. While the
+    circuit breaker of RHOBS is open, the stale results are returned, or
+    RHOBSUnavailableError is raised if some clusters have none.
+    """
+    clusters_results = {}
+
+    query = alerts_and_focs(clusters)
+    try:
+        response = query_rhobs_endpoint(query, len(clusters))
     except (ConnectionError, ReadTimeout) as e:
         logger.warn(f"RHOBS connection failed due to: {str(e)}")
         raise HTTPException(status_code=424, detail="RHOBS connection failed") from e
-    results = response.json().get("data", {}).get("result", [])
+    except CircuitOpenError as e:
+        clusters_results = get_stale_results(clusters)
+        if not set(clusters).issubset(clusters_results):
+            raise RHOBSUnavailableError(clusters_results) from e
+        logger.info("RHOBS unavailable. Using stale results")
+        return clusters_results
+
+    if should_parse_in_pool(response):
+        clusters_results = parse_in_pool(response.content)
+        if clusters_results is not None:
+            for cluster_id, result in clusters_results.items():
+                update_cache_for_cluster(cluster_id, result)
+            return clusters_results
+
+    with metrics.observe_stage_time("json_decode"):
+        results = response.json().get("data", {}).get("result", [])
 
     if response.status_code != 200 or results is None:
         logger.debug("Observatorium response status code: %s", response.status_code)
-        logger.debug("Observatorium response text: %s", response.text)
-        return clusters_results  # returning only cached results
+        logger.debug("Observatorium response text: %s", LogPayload(response.text))
+        return clusters_results  # no results for this chunk
+
+    with metrics.observe_stage_time("predictor_parsing"):
+        clusters_results = parse_multi_cluster_results(results)
+
+    for cluster_id, result in clusters_results.items():
+        update_cache_for_cluster(cluster_id, result)  # Update single cluster cache
+
+    return clusters_results
+
+
+def get_stale_results(
+    clusters: list[UUID],
+) -> dict[UUID, tuple[UpgradeRisksPredictors, str]]:
+    """Return the expired results of perform_rhobs_request still kept for the clusters."""
+    clusters_results = {}
+    for cluster_id in clusters:
+        stale_result = perform_rhobs_request.cache.get_stale((cluster_id,))
+        if stale_result is not None and stale_result[1] is not None:
+            clusters_results[cluster_id] = stale_result
+
+    return clusters_results
 
+
+def parse_multi_cluster_results(
+    results: list[dict],
+) -> dict[UUID, tuple[UpgradeRisksPredictors, str]]:
+    """Parse the RHOBS results of several clusters into their predictors and console URLs."""
+    clusters_results = {}
     console_urls = {}
     predictors = {}
 
@@ -215,13 +638,98 @@ def perform_rhobs_request_multi_cluster(
         )
 
         clusters_results[cluster_id_as_uuid] = prediction, console_url
-        update_cache_for_cluster(
-            cluster_id_as_uuid, clusters_results[cluster_id_as_uuid]
-        )  # Update single cluster cache
 
     return clusters_results
 
 
+def should_parse_in_pool(response: requests.Response) -> bool:
+    """Check if the response is large enough to be parsed in the parsing processes.
+
+    Small responses are faster to parse inline than to send to another process.
+    """
+    return (
+        _parsing_pool is not None
+        and response.status_code == 200
+        and len(response.content) >= get_settings().rhobs_parsing_min_bytes
+    )
+
+
+def parse_in_pool(
+    content: bytes,
+) -> dict[UUID, tuple[UpgradeRisksPredictors, str]] | None:
+    """Decode and parse a multi cluster response in the parsing processes.
+
+    Return None if the response must be parsed inline, because the pool is
+    broken or the response has no results.
+    """
+    try:
+        with metrics.observe_stage_time("pool_parsing"):
+            compact_results = _parsing_pool.submit(
+                parse_multi_cluster_response, content
+            ).result()
+    except BrokenProcessPool:
+        logger.error("The RHOBS parsing processes died. Parsing inline")
+        return None
+
+    if compact_results is None:
+        return None
+
+    with metrics.observe_stage_time("predictor_parsing"):
+        return {
+            cluster_id: expand_compact_result(compact_result)
+            for cluster_id, compact_result in compact_results.items()
+        }
+
+
+def parse_multi_cluster_response(
+    content: bytes,
+) -> dict[UUID, CompactClusterResult] | None:
+    """Decode a multi cluster response and parse it into compact tuples per cluster.
+
+    It runs in the parsing processes: the predictors are validated here, but
+    plain tuples are sent back, as they are much cheaper to pickle than the
+    pydantic models. Return None if the response has no results.
+    """
+    results = json.loads(content).get("data", {}).get("result", [])
+    if results is None:
+        return None
+
+    return {
+        cluster_id: (
+            [
+                (alert.name, alert.namespace, alert.severity)
+                for alert in predictors.alerts
+            ],
+            [
+                (foc.name, foc.condition, foc.reason)
+                for foc in predictors.operator_conditions
+            ],
+            console_url,
+        )
+        for cluster_id, (predictors, console_url) in parse_multi_cluster_results(
+            results
+        ).items()
+    }
+
+
+def expand_compact_result(
+    compact_result: CompactClusterResult,
+) -> tuple[UpgradeRisksPredictors, str]:
+    """Build the predictors from the tuples validated in a parsing process."""
+    alerts, focs, console_url = compact_result
+    predictors = UpgradeRisksPredictors.model_construct(
+        alerts=[
+            Alert.model_construct(name=name, namespace=namespace, severity=severity)
+            for name, namespace, severity in alerts
+        ],
+        operator_conditions=[
+            FOC.model_construct(name=name, condition=condition, reason=reason)
+            for name, condition, reason in focs
+        ],
+    )
+    return predictors, console_url
+
+
 def get_timestamp_minutes_before(minutes):
     """Return the timestamp $hours_before."""
     d = datetime.now() - timedelta(minutes=minutes)
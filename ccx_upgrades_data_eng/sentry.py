@@ -16,9 +16,13 @@
 
 import logging
 import os
+import re
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
 
-import sentry_sdk
-from sentry_sdk.integrations.logging import LoggingIntegration
+# sentry_sdk is only imported when Sentry is enabled, as it is heavy to import
+_performance_enabled = False
 
 
 def get_event_level():
@@ -28,14 +32,92 @@ def get_event_level():
     return logging.ERROR
 
 
+# Only the prediction endpoints are traced in Sentry
+TRACED_ENDPOINTS = (
+    ("GET", re.compile(r"^/cluster/[^/]+/upgrade-risks-prediction$")),
+    ("POST", re.compile(r"^/upgrade-risks-prediction$")),
+)
+
+
+def get_traces_sample_rate():
+    """Get the rate of prediction requests traced as Sentry transactions.
+
+    An invalid SENTRY_TRACES_SAMPLE_RATE, or one outside 0 and 1, disables
+    performance monitoring.
+    """
+    value = os.environ.get("SENTRY_TRACES_SAMPLE_RATE")
+    if not value:
+        return 0
+
+    try:
+        rate = float(value)
+    except ValueError:
+        rate = None
+
+    if rate is None or not 0 <= rate <= 1:
+        logging.getLogger(__name__).warning(
+            "Ignoring invalid SENTRY_TRACES_SAMPLE_RATE: %s", value
+        )
+        return 0
+
+    return rate
+
+
+def traces_sampler(sampling_context: dict[str, Any]) -> float:
+    """Sample the prediction endpoints with SENTRY_TRACES_SAMPLE_RATE and nothing else.
+
+    The sampling decision of the incoming trace is kept if there is one.
+    """
+    scope = sampling_context.get("asgi_scope") or {}
+    method, path = scope.get("method"), scope.get("path", "")
+    if not any(
+        method == traced_method and pattern.match(path)
+        for traced_method, pattern in TRACED_ENDPOINTS
+    ):
+        return 0
+
+    parent_sampled = sampling_context.get("parent_sampled")
+    if parent_sampled is not None:
+        return float(parent_sampled)
+
+    return get_traces_sample_rate()
+
+
+@contextmanager
+def start_span(op: str, name: str) -> Iterator[None]:
+    """Run the block in a child span of the current Sentry transaction, if any."""
+    if not _performance_enabled:
+        yield
+        return
+
+    import sentry_sdk
+
+    if sentry_sdk.get_current_span() is None:
+        yield
+        return
+
+    with sentry_sdk.start_span(op=op, name=name):
+        yield
+
+
 def init_sentry(dsn=None, transport=None, environment=None):
     """Configure and initialize sentry SDK for this project."""
+    global _performance_enabled
+
     if dsn:
+        import sentry_sdk
+        from sentry_sdk.integrations.logging import LoggingIntegration
+
         logging.getLogger(__name__).info("Initializing sentry")
         sentry_logging = LoggingIntegration(
             level=logging.INFO, event_level=get_event_level()
         )
 
+        performance_options = {}
+        if get_traces_sample_rate() > 0:
+            performance_options["traces_sampler"] = traces_sampler
+            _performance_enabled = True
+
         sentry_sdk.init(
             dsn=dsn,
             ca_certs="/etc/pki/tls/certs/ca-bundle.crt",
@@ -43,4 +125,5 @@ def init_sentry(dsn=None, transport=None, environment=None):
             max_breadcrumbs=15,
             transport=transport,
             environment=environment,
+            **performance_options,
         )
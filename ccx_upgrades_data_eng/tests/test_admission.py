@@ -0,0 +1,108 @@
+"""Tests for the admission module."""
+
+import asyncio
+from unittest.mock import patch
+
+import pytest
+from prometheus_client import REGISTRY
+
+from ccx_upgrades_data_eng.admission import (
+    REJECTED_EVENT_LOOP_LAG,
+    REJECTED_QUEUE_TIMEOUT,
+    AdmissionController,
+    AdmissionRejectedError,
+)
+
+
+def get_rejected_count(endpoint, reason):
+    """Return the number of requests rejected for the given endpoint and reason."""
+    labels = {"endpoint": endpoint, "reason": reason}
+    return (
+        REGISTRY.get_sample_value("ccx_upgrades_admission_rejected_total", labels) or 0
+    )
+
+
+async def run_admitted(controller, name, bulk, admitted, release):
+    """Record the request as admitted and hold its slot until released."""
+    async with controller.admit("/test", bulk):
+        admitted.append(name)
+        await release.wait()
+
+
+@pytest.mark.asyncio
+async def test_single_cluster_requests_go_first():
+    """Waiting single cluster requests are admitted before the bulk ones."""
+    controller = AdmissionController(1, 1, 10, 0)
+    admitted = []
+    release = asyncio.Event()
+
+    tasks = [
+        asyncio.create_task(run_admitted(controller, "first", True, admitted, release))
+    ]
+    await asyncio.sleep(0)
+    for name, bulk in (("bulk", True), ("single", False)):
+        tasks.append(
+            asyncio.create_task(run_admitted(controller, name, bulk, admitted, release))
+        )
+        await asyncio.sleep(0)
+
+    assert admitted == ["first"]
+    release.set()
+    await asyncio.gather(*tasks)
+
+    assert admitted == ["first", "single", "bulk"]
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_bulk_requests_limit():
+    """Bulk requests only take up to max_bulk_in_flight slots."""
+    controller = AdmissionController(2, 1, 0.01, 0)
+    rejected = get_rejected_count("/test", REJECTED_QUEUE_TIMEOUT)
+
+    async with controller.admit("/test", bulk=True):
+        with pytest.raises(AdmissionRejectedError):
+            async with controller.admit("/test", bulk=True):
+                pass
+
+        async with controller.admit("/test", bulk=False):
+            assert controller.in_flight == 2
+
+    assert get_rejected_count("/test", REJECTED_QUEUE_TIMEOUT) == rejected + 1
+    assert controller.in_flight == 0
+    assert controller.bulk_in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_rejected_after_queue_time():
+    """A request waiting for longer than max_queue_time is rejected."""
+    controller = AdmissionController(1, 1, 0.01, 0)
+
+    async with controller.admit("/test", bulk=False):
+        with pytest.raises(AdmissionRejectedError) as ex:
+            async with controller.admit("/test", bulk=False):
+                pass
+
+    assert ex.value.reason == REJECTED_QUEUE_TIMEOUT
+    assert not controller._waiters
+
+    # The slot is free again
+    async with controller.admit("/test", bulk=False):
+        assert controller.in_flight == 1
+
+
+@pytest.mark.asyncio
+@patch("ccx_upgrades_data_eng.metrics.get_event_loop_lag", return_value=0.5)
+async def test_bulk_requests_shed_on_event_loop_lag(get_event_loop_lag_mock):
+    """Bulk requests are rejected while the event loop lag is too high."""
+    controller = AdmissionController(10, 10, 1, 0.1)
+    rejected = get_rejected_count("/test", REJECTED_EVENT_LOOP_LAG)
+
+    with pytest.raises(AdmissionRejectedError):
+        async with controller.admit("/test", bulk=True):
+            pass
+
+    async with controller.admit("/test", bulk=False):
+        pass
+
+    assert get_rejected_count("/test", REJECTED_EVENT_LOOP_LAG) == rejected + 1
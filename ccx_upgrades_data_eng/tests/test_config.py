@@ -43,10 +43,41 @@ def test_default_settings_not_set():
     assert settings.rhobs_tenant == RHOBS_DEFAULT_TENANT
     assert settings.rhobs_request_timeout == RHOBS_DEFAULT_REQUEST_TIMEOUT
     assert settings.rhobs_query_max_minutes_for_data == 60
+    assert settings.rhobs_hedging_enabled is False
+    assert settings.rhobs_hedge_percentile == 95
+    assert settings.rhobs_hedge_min_delay == 0.1
+    assert settings.rhobs_hedge_budget == 0.05
     assert settings.inference_url == "test-inference_url"
+    assert settings.inference_request_timeout == 5
+    assert settings.request_deadline == 0
     assert settings.cache_enabled is False
     assert settings.cache_ttl == 0
     assert settings.cache_size == 128
+    assert settings.cache_ttl_jitter == 0
+    assert settings.cache_max_bytes == 0
+    assert settings.response_cache_enabled is False
+    assert settings.multi_cluster_response_cache_ttl == 10
+    assert settings.server_timing_enabled is False
+    assert settings.tracing_enabled is False
+    assert settings.logging_queue_enabled is False
+    assert settings.logging_queue_size == 10000
+    assert settings.event_loop_lag_interval == 0.5
+    assert settings.circuit_breaker_enabled is False
+    assert settings.circuit_breaker_failure_rate == 0.5
+    assert settings.circuit_breaker_window == 20
+    assert settings.circuit_breaker_min_calls == 10
+    assert settings.circuit_breaker_open_time == 30
+    assert settings.retry_enabled is False
+    assert settings.retry_max_attempts == 3
+    assert settings.retry_base_delay == 0.1
+    assert settings.retry_max_delay == 1
+    assert settings.retry_budget == 0.1
+    assert settings.admission_max_in_flight == 0
+    assert settings.admission_max_bulk_in_flight == 0
+    assert settings.admission_max_queue_time == 1
+    assert settings.admission_max_event_loop_lag == 0
+    assert settings.admission_retry_after == 1
+    assert settings.web_concurrency == 1
     assert settings.sso_retry_max_attempts == 5
     assert settings.sso_retry_base_delay == 1
     assert settings.sso_retry_max_delay == 30
@@ -69,6 +100,13 @@ def test_get_settings_from_env():
         "CACHE_ENABLED": "true",
         "CACHE_TTL": "30",
         "CACHE_SIZE": "10",
+        "RESPONSE_CACHE_ENABLED": "true",
+        "SERVER_TIMING_ENABLED": "true",
+        "TRACING_ENABLED": "true",
+        "LOGGING_QUEUE_ENABLED": "true",
+        "LOGGING_QUEUE_SIZE": "100",
+        "EVENT_LOOP_LAG_INTERVAL": "0",
+        "WEB_CONCURRENCY": "4",
         "SSO_RETRY_MAX_ATTEMPTS": "3",
         "SSO_RETRY_BASE_DELAY": "2",
         "SSO_RETRY_MAX_DELAY": "60",
@@ -89,6 +127,13 @@ def test_get_settings_from_env():
     assert settings.cache_enabled
     assert settings.cache_ttl == 30
     assert settings.cache_size == 10
+    assert settings.response_cache_enabled
+    assert settings.server_timing_enabled
+    assert settings.tracing_enabled
+    assert settings.logging_queue_enabled
+    assert settings.logging_queue_size == 100
+    assert settings.event_loop_lag_interval == 0
+    assert settings.web_concurrency == 4
     assert settings.sso_retry_max_attempts == 3
     assert settings.sso_retry_base_delay == 2
     assert settings.sso_retry_max_delay == 60
@@ -0,0 +1,42 @@
+"""Tests for the deadline module."""
+
+import pytest
+
+from ccx_upgrades_data_eng import deadline
+from ccx_upgrades_data_eng.deadline import DeadlineExceededError
+
+
+def test_get_request_timeout():
+    """The header can only shorten the configured timeout, and enable it if 0."""
+    assert deadline.get_request_timeout(None, 0) is None
+    assert deadline.get_request_timeout(None, 10) == 10
+    assert deadline.get_request_timeout("2.5", 10) == 2.5
+    assert deadline.get_request_timeout("20", 10) == 10
+    assert deadline.get_request_timeout("2.5", 0) == 2.5
+
+    assert deadline.get_request_timeout("soon", 10) == 10
+    assert deadline.get_request_timeout("-1", 0) is None
+
+
+def test_get_timeout_without_deadline():
+    """The timeouts are not changed if the request has no deadline."""
+    deadline.start_deadline(None)
+    assert deadline.remaining_time() is None
+    assert not deadline.is_expired()
+    assert deadline.get_timeout(5) == 5
+
+
+def test_get_timeout_shortened_to_deadline():
+    """The timeouts are shortened to the time left before the deadline."""
+    try:
+        deadline.start_deadline(1)
+        assert 0.5 < deadline.get_timeout(5) <= 1
+        assert deadline.get_timeout(0.1) == 0.1
+
+        deadline.start_deadline(-1)
+        assert deadline.is_expired()
+        with pytest.raises(DeadlineExceededError) as ex:
+            deadline.get_timeout(5)
+        assert ex.value.status_code == 504
+    finally:
+        deadline.start_deadline(None)
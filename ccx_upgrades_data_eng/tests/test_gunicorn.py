@@ -0,0 +1,55 @@
+"""Test the gunicorn configuration in gunicorn.conf.py."""
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("uvicorn_worker")
+
+ROOT_DIR = Path(__file__).parents[2]
+
+# Start a worker with the configuration and print the handlers of the uvicorn loggers
+WORKER_STARTUP = """
+import json
+import logging
+import os
+import runpy
+
+from gunicorn.config import Config
+from gunicorn.glogging import Logger
+from uvicorn_worker import UvicornWorker
+
+cfg = Config()
+cfg.set("logconfig_dict", runpy.run_path("gunicorn.conf.py")["logconfig_dict"])
+UvicornWorker(0, os.getpid(), [], None, 30, cfg, Logger(cfg))
+print(json.dumps({
+    name: sorted(handler.name for handler in logging.getLogger(name).handlers)
+    for name in ("uvicorn.error", "uvicorn.access")
+}))
+"""
+
+
+def test_worker_keeps_uvicorn_handlers(tmp_path):
+    """The uvicorn loggers keep the handlers of logging.yaml once the worker starts."""
+    env = {
+        "PATH": os.environ.get("PATH", ""),
+        "PROMETHEUS_MULTIPROC_DIR": str(tmp_path),
+    }
+    result = subprocess.run(
+        [sys.executable, "-c", WORKER_STARTUP],
+        cwd=ROOT_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    handlers = json.loads(result.stdout.splitlines()[-1])
+    assert handlers == {
+        "uvicorn.error": ["cloudwatch", "default"],
+        "uvicorn.access": ["access", "cloudwatch"],
+    }
@@ -1,12 +1,19 @@
 """Tests for the inference module."""
 
 import os
+import time
 from datetime import datetime, timedelta, timezone
 from unittest.mock import MagicMock, patch
 
 import pytest
+import requests
+from cachetools.keys import hashkey
 from fastapi import HTTPException
+from prometheus_client import REGISTRY
 
+from ccx_upgrades_data_eng import deadline
+from ccx_upgrades_data_eng.config import get_settings
+from ccx_upgrades_data_eng.deadline import DeadlineExceededError
 from ccx_upgrades_data_eng.examples import (
     EXAMPLE_CONSOLE_URL,
     EXAMPLE_PREDICTORS,
@@ -15,6 +22,7 @@ from ccx_upgrades_data_eng.examples import (
 from ccx_upgrades_data_eng.inference import (
     calculate_upgrade_recommended,
     get_filled_inference_for_predictors,
+    get_filled_inference_with_fallback,
     get_inference_for_predictors,
 )
 from ccx_upgrades_data_eng.models import (
@@ -22,7 +30,13 @@ from ccx_upgrades_data_eng.models import (
     UpgradeRisksPredictors,
     UpgradeRisksPredictorsWithURLs,
 )
-from ccx_upgrades_data_eng.tests import needed_env
+from ccx_upgrades_data_eng.tests import needed_env, needed_env_cache_enabled
+from ccx_upgrades_data_eng.utils import (
+    CircuitBreaker,
+    CircuitOpenError,
+    CustomTTLCache,
+    get_retry_policy,
+)
 
 INFERENCE_UPGRADE_MOCKED_RESPONSE_EMPTY_PREDICTORS = {
     "upgrade_risks_predictors": {
@@ -56,6 +70,171 @@ def test_get_inference_for_predictors_inference_not_ok(get_mock):
         get_inference_for_predictors(risk_predictors)
 
 
+@patch.dict(os.environ, needed_env)
+@patch("requests.get")
+def test_get_inference_for_predictors_time_by_status_code(get_mock):
+    """Check the inference time is observed with the response status code."""
+    risk_predictors = UpgradeRisksPredictors(alerts=[], operator_conditions=[])
+
+    def get_count(status_code):
+        labels = {"status_code": status_code}
+        return (
+            REGISTRY.get_sample_value("ccx_upgrades_inference_time_count", labels) or 0
+        )
+
+    response_mock = MagicMock()
+    response_mock.status_code = 503
+    get_mock.return_value = response_mock
+    count_503 = get_count("503")
+    with pytest.raises(HTTPException):
+        get_inference_for_predictors(risk_predictors)
+    assert get_count("503") == count_503 + 1
+
+    get_mock.side_effect = requests.exceptions.ConnectionError()
+    count_error = get_count("connection_error")
+    with pytest.raises(requests.exceptions.ConnectionError):
+        get_inference_for_predictors(risk_predictors)
+    assert get_count("connection_error") == count_error + 1
+
+
+@patch.dict(os.environ, needed_env)
+@patch("requests.get")
+def test_get_inference_for_predictors_in_flight(get_mock):
+    """The request is counted as in flight until the inference service answers."""
+    in_flight = []
+
+    def get(*args, **kwargs):
+        in_flight.append(REGISTRY.get_sample_value("ccx_upgrades_inference_in_flight"))
+        response_mock = MagicMock(status_code=200)
+        response_mock.json.return_value = (
+            INFERENCE_UPGRADE_MOCKED_RESPONSE_EMPTY_PREDICTORS
+        )
+        return response_mock
+
+    get_mock.side_effect = get
+    get_inference_for_predictors(
+        UpgradeRisksPredictors(alerts=[], operator_conditions=[])
+    )
+
+    assert in_flight == [1]
+    assert REGISTRY.get_sample_value("ccx_upgrades_inference_in_flight") == 0
+
+
+@patch.dict(os.environ, needed_env)
+@patch("requests.get")
+@patch("ccx_upgrades_data_eng.inference.get_circuit_breaker")
+def test_get_filled_inference_circuit_open(get_circuit_breaker_mock, get_mock):
+    """The inference service is not called while the circuit breaker is open."""
+    get_circuit_breaker_mock.return_value.before_call.side_effect = CircuitOpenError()
+    risk_predictors = UpgradeRisksPredictors(alerts=[], operator_conditions=[])
+
+    with pytest.raises(HTTPException) as ex:
+        get_filled_inference_with_fallback(risk_predictors, "https://console.com")
+
+    assert ex.value.status_code == 503
+    get_mock.assert_not_called()
+
+
+@patch.dict(os.environ, needed_env)
+@patch("requests.get")
+@patch("ccx_upgrades_data_eng.inference.get_circuit_breaker")
+def test_get_filled_inference_circuit_open_serves_stale_result(
+    get_circuit_breaker_mock, get_mock
+):
+    """The expired result is served while the circuit breaker is open."""
+    risk_predictors = UpgradeRisksPredictors(alerts=[], operator_conditions=[])
+    stale_result = MagicMock()
+    get_settings.cache_clear()
+    with patch.dict(os.environ, needed_env_cache_enabled):
+        cache = CustomTTLCache("test_inference_stale", ttl=0.05, keep_stale=True)
+    get_settings.cache_clear()
+    cache[hashkey(risk_predictors, "https://console.com")] = stale_result
+    time.sleep(0.1)
+
+    get_circuit_breaker_mock.return_value.before_call.side_effect = CircuitOpenError()
+    with patch.object(get_filled_inference_for_predictors, "cache", cache):
+        # The cached function fails, so the stale result is not cached again
+        with pytest.raises(CircuitOpenError):
+            get_filled_inference_for_predictors(risk_predictors, "https://console.com")
+
+        result = get_filled_inference_with_fallback(
+            risk_predictors, "https://console.com"
+        )
+
+    assert result is stale_result
+    assert cache.peek(hashkey(risk_predictors, "https://console.com")) is None
+    get_mock.assert_not_called()
+
+
+@patch.dict(os.environ, needed_env)
+@patch("requests.get")
+def test_get_inference_for_predictors_records_breaker_results(get_mock):
+    """Server errors and connection errors count as failures for the breaker."""
+    breaker = CircuitBreaker("test_inference", 0.5, 10, 10, 30)
+    risk_predictors = UpgradeRisksPredictors(alerts=[], operator_conditions=[])
+    get_mock.return_value = MagicMock(status_code=500)
+
+    with patch(
+        "ccx_upgrades_data_eng.inference.get_circuit_breaker", return_value=breaker
+    ):
+        with pytest.raises(HTTPException):
+            get_inference_for_predictors(risk_predictors)
+
+        get_mock.side_effect = requests.exceptions.ConnectionError()
+        with pytest.raises(requests.exceptions.ConnectionError):
+            get_inference_for_predictors(risk_predictors)
+
+    assert list(breaker._outcomes) == [False, False]
+
+
+@patch.dict(os.environ, {**needed_env, "INFERENCE_REQUEST_TIMEOUT": "3"})
+@patch("requests.get")
+def test_get_inference_for_predictors_deadline(get_mock):
+    """The timeout fits in the request deadline and no call is made once expired."""
+    get_settings.cache_clear()
+    risk_predictors = UpgradeRisksPredictors(alerts=[], operator_conditions=[])
+    get_mock.return_value = MagicMock(status_code=500)
+
+    try:
+        with pytest.raises(HTTPException):
+            get_inference_for_predictors(risk_predictors)
+        assert get_mock.call_args.kwargs["timeout"] == 3
+
+        deadline.start_deadline(1)
+        with pytest.raises(HTTPException):
+            get_inference_for_predictors(risk_predictors)
+        assert get_mock.call_args.kwargs["timeout"] <= 1
+
+        deadline.start_deadline(-1)
+        with pytest.raises(DeadlineExceededError):
+            get_inference_for_predictors(risk_predictors)
+    finally:
+        deadline.start_deadline(None)
+
+    assert get_mock.call_count == 2
+
+
+@patch.dict(os.environ, {**needed_env, "RETRY_ENABLED": "1"})
+@patch("requests.get")
+@patch("time.sleep", return_value=None)
+def test_get_inference_for_predictors_retried(mock_sleep, get_mock):
+    """The connection errors with the inference service are retried."""
+    get_settings.cache_clear()
+    get_retry_policy.cache_clear()
+    ok_response = MagicMock(status_code=200)
+    ok_response.json.return_value = INFERENCE_UPGRADE_MOCKED_RESPONSE_EMPTY_PREDICTORS
+    get_mock.side_effect = [requests.exceptions.ConnectionError(), ok_response]
+    risk_predictors = UpgradeRisksPredictors(alerts=[], operator_conditions=[])
+
+    try:
+        response = get_inference_for_predictors(risk_predictors)
+    finally:
+        get_retry_policy.cache_clear()
+
+    assert response.upgrade_recommended
+    assert get_mock.call_count == 2
+
+
 @patch.dict(os.environ, needed_env)
 @patch("requests.get")
 def test_get_inference_for_predictors_inference_ok_empty(get_mock):
@@ -0,0 +1,254 @@
+"""Tests for the jobs module."""
+
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock, patch
+from urllib.parse import parse_qs, urlparse
+from uuid import UUID, uuid4
+
+import pytest
+import requests
+from fastapi.testclient import TestClient
+
+from ccx_upgrades_data_eng.config import get_settings
+from ccx_upgrades_data_eng.jobs import get_job_manager
+from ccx_upgrades_data_eng.main import app
+from ccx_upgrades_data_eng.tests import needed_env
+
+CONSOLE_URL = "https://console-openshift-console.some_url.com"
+
+
+class StubRHOBSHandler(BaseHTTPRequestHandler):
+    """Answer RHOBS queries with a console URL and an alert for known clusters."""
+
+    known_clusters: set[str] = set()
+
+    def do_GET(self):  # noqa: N802
+        """Return the metrics for the clusters in the query."""
+        query = parse_qs(urlparse(self.path).query)["query"][0]
+        clusters = re.search(r'_id=~"([^"]*)"', query).group(1).split("|")
+        result = []
+        for cluster in clusters:
+            if cluster not in self.known_clusters:
+                continue
+            result.append(
+                {
+                    "metric": {
+                        "__name__": "console_url",
+                        "_id": cluster,
+                        "url": CONSOLE_URL,
+                    }
+                }
+            )
+            result.append(
+                {
+                    "metric": {
+                        "__name__": "alerts",
+                        "_id": cluster,
+                        "alertname": "KubePodCrashLooping",
+                        "namespace": "openshift-monitoring",
+                        "severity": "warning",
+                    }
+                }
+            )
+
+        self.send_json({"status": "success", "data": {"result": result}})
+
+    def send_json(self, content):
+        """Send the content as a JSON response."""
+        body = json.dumps(content).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        """Do not log the requests."""
+
+
+class StubInferenceHandler(StubRHOBSHandler):
+    """Answer inference requests returning every predictor as a risk."""
+
+    def do_GET(self):  # noqa: N802
+        """Return the received predictors as risks."""
+        length = int(self.headers["Content-Length"])
+        predictors = json.loads(self.rfile.read(length))
+        self.send_json({"upgrade_risks_predictors": predictors})
+
+
+@pytest.fixture
+def stub_server():
+    """Start a stub HTTP server in a background thread."""
+    servers = []
+
+    def start(handler):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}"
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def wait_for_job(client, job_id, timeout=10):
+    """Poll the job until it is finished."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/upgrade-risks-prediction/jobs/{job_id}").json()
+        if job["finished_at"] is not None:
+            return job
+        time.sleep(0.05)
+
+    raise TimeoutError(f"job {job_id} did not finish in {timeout} seconds")
+
+
+@patch("ccx_upgrades_data_eng.main.get_session_manager")
+@patch("ccx_upgrades_data_eng.rhobs.get_session_manager")
+def test_prediction_job_with_stub_servers(
+    rhobs_session_manager_mock, main_session_manager_mock, stub_server
+):
+    """Run a job in chunks against local RHOBS and inference servers and page its results."""
+    clusters = [str(uuid4()) for _ in range(25)]
+    StubRHOBSHandler.known_clusters = set(clusters[:20])
+    env = {
+        **needed_env,
+        "RHOBS_URL": stub_server(StubRHOBSHandler),
+        "INFERENCE_URL": stub_server(StubInferenceHandler),
+        "RHOBS_MULTI_CLUSTER_CHUNK_SIZE": "4",
+        "JOBS_MAX_CONCURRENCY": "2",
+    }
+
+    session_manager_mock = MagicMock()
+    session_manager_mock.get_session.return_value = requests.Session()
+    rhobs_session_manager_mock.return_value = session_manager_mock
+
+    with patch.dict(os.environ, env):
+        get_settings.cache_clear()
+        get_job_manager.cache_clear()
+        try:
+            with TestClient(app) as client:
+                response = client.post(
+                    "/upgrade-risks-prediction/jobs", json={"clusters": clusters}
+                )
+                assert response.status_code == 202
+                job_id = response.json()["job_id"]
+                assert response.headers["location"] == (
+                    f"/upgrade-risks-prediction/jobs/{job_id}"
+                )
+
+                job = wait_for_job(client, job_id)
+                assert job["status"] == "done"
+                assert job["total_clusters"] == 25
+                assert job["processed_clusters"] == 25
+
+                predictions = []
+                for offset in range(0, 25, 10):
+                    page = client.get(
+                        f"/upgrade-risks-prediction/jobs/{job_id}/results",
+                        params={"offset": offset, "limit": 10},
+                    ).json()
+                    assert page["total"] == 25
+                    predictions.extend(page["predictions"])
+        finally:
+            get_settings.cache_clear()
+            get_job_manager.cache_clear()
+
+    statuses = {p["cluster_id"]: p["prediction_status"] for p in predictions}
+    assert statuses == {
+        cluster: "ok" if cluster in clusters[:20] else "No data for the cluster"
+        for cluster in clusters
+    }
+    assert all(
+        not p["upgrade_recommended"]
+        for p in predictions
+        if p["prediction_status"] == "ok"
+    )
+
+
+@patch.dict(os.environ, needed_env)
+@patch("ccx_upgrades_data_eng.main.get_session_manager")
+def test_prediction_job_not_found(get_session_manager_mock):
+    """Unknown or expired jobs return a 404."""
+    client = TestClient(app)
+    job_id = uuid4()
+    assert client.get(f"/upgrade-risks-prediction/jobs/{job_id}").status_code == 404
+    response = client.get(f"/upgrade-risks-prediction/jobs/{job_id}/results")
+    assert response.status_code == 404
+
+
+@patch.dict(os.environ, {**needed_env, "JOBS_MAX_COUNT": "1", "JOBS_TTL": "0"})
+@patch("ccx_upgrades_data_eng.main.get_session_manager")
+@patch("ccx_upgrades_data_eng.jobs.perform_rhobs_request_chunk")
+def test_prediction_job_limit_and_expiration(
+    perform_rhobs_request_chunk_mock, get_session_manager_mock
+):
+    """Jobs over the limit are rejected and finished jobs expire."""
+    get_settings.cache_clear()
+    get_job_manager.cache_clear()
+
+    # Keep the first job running until the second one is submitted
+    release = threading.Event()
+    perform_rhobs_request_chunk_mock.side_effect = lambda _: release.wait(5) and {}
+
+    cluster_id = "34c3ecc5-624a-49a5-bab8-4fdc5e51a266"
+    try:
+        with TestClient(app) as client:
+            response = client.post(
+                "/upgrade-risks-prediction/jobs", json={"clusters": [cluster_id]}
+            )
+            assert response.status_code == 202
+            job_id = response.json()["job_id"]
+
+            response = client.post(
+                "/upgrade-risks-prediction/jobs", json={"clusters": [cluster_id]}
+            )
+            assert response.status_code == 429
+
+            release.set()
+            job = get_job_manager().get(UUID(job_id))
+            deadline = time.monotonic() + 5
+            while job.finished_at is None and time.monotonic() < deadline:
+                time.sleep(0.05)
+
+            assert job.status == "done"
+            # With a TTL of 0 the finished job is expired right away
+            response = client.get(f"/upgrade-risks-prediction/jobs/{job_id}")
+            assert response.status_code == 404
+    finally:
+        get_settings.cache_clear()
+        get_job_manager.cache_clear()
+
+
+@patch.dict(os.environ, {**needed_env, "WEB_CONCURRENCY": "2"})
+@patch("ccx_upgrades_data_eng.main.get_session_manager")
+@patch("ccx_upgrades_data_eng.jobs.perform_rhobs_request_chunk")
+def test_prediction_job_rejected_with_several_workers(
+    perform_rhobs_request_chunk_mock, get_session_manager_mock
+):
+    """Jobs are rejected when running several workers, as each one keeps its jobs."""
+    get_settings.cache_clear()
+    get_job_manager.cache_clear()
+    try:
+        client = TestClient(app)
+        response = client.post(
+            "/upgrade-risks-prediction/jobs",
+            json={"clusters": ["34c3ecc5-624a-49a5-bab8-4fdc5e51a266"]},
+        )
+    finally:
+        get_settings.cache_clear()
+        get_job_manager.cache_clear()
+
+    assert response.status_code == 501
+    assert response.json()["detail"] == (
+        "Prediction jobs need a single worker (WEB_CONCURRENCY=1)"
+    )
+    perform_rhobs_request_chunk_mock.assert_not_called()
@@ -0,0 +1,111 @@
+"""Tests for the logging_utils module."""
+
+import logging
+import queue
+import threading
+
+from prometheus_client import REGISTRY
+from uvicorn.logging import AccessFormatter
+
+from ccx_upgrades_data_eng.logging_utils import (
+    BackgroundQueueHandler,
+    LogPayload,
+    start_background_logging,
+    stop_background_logging,
+)
+
+
+class ListHandler(logging.Handler):
+    """Keep the formatted records and the thread that handled them."""
+
+    def __init__(self):
+        """Initialize an empty list of records."""
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        """Store the formatted record."""
+        self.records.append((self.format(record), threading.current_thread()))
+
+
+def test_log_payload_is_truncated():
+    """Only the first items and characters of large payloads are formatted."""
+    payload = str(LogPayload(list(range(1000))))
+    assert payload.startswith("[0, 1, 2")
+    assert payload.endswith("...]")
+    assert len(payload) < 100
+
+    assert len(str(LogPayload("x" * 10000))) < 300
+    assert str(LogPayload({"a": 1})) == "{'a': 1}"
+
+
+def test_background_logging():
+    """The records are handled in the listener thread until it is stopped."""
+    logger = logging.getLogger("ccx_upgrades_data_eng.tests.background")
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    handler = ListHandler()
+    logger.handlers = [handler]
+
+    listener = start_background_logging(100)
+    try:
+        assert isinstance(logger.handlers[0], BackgroundQueueHandler)
+        logger.info("message %s", "argument")
+    finally:
+        stop_background_logging(listener)
+
+    assert logger.handlers == [handler]
+    [(message, thread)] = handler.records
+    assert message == "message argument"
+    assert thread is not threading.current_thread()
+
+
+def test_background_logging_uvicorn_access_record():
+    """The access records keep the arguments read by the uvicorn formatter."""
+    logger = logging.getLogger("ccx_upgrades_data_eng.tests.access")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    handler = ListHandler()
+    handler.setFormatter(
+        AccessFormatter(
+            fmt='%(client_addr)s - "%(request_line)s" %(status_code)s',
+            use_colors=False,
+        )
+    )
+    logger.handlers = [handler]
+
+    listener = start_background_logging(100)
+    try:
+        logger.info(
+            '%s - "%s %s HTTP/%s" %d',
+            "127.0.0.1:8000",
+            "GET",
+            "/metrics",
+            "1.1",
+            200,
+        )
+    finally:
+        stop_background_logging(listener)
+
+    [(message, _)] = handler.records
+    assert message == '127.0.0.1:8000 - "GET /metrics HTTP/1.1" 200 OK'
+
+
+def test_background_logging_drops_records_when_full():
+    """Records are dropped instead of blocking when the queue is full."""
+    log_queue = queue.Queue(1)
+    handler = BackgroundQueueHandler(log_queue, [ListHandler()])
+    logger = logging.getLogger("ccx_upgrades_data_eng.tests.dropped")
+    logger.propagate = False
+    logger.handlers = [handler]
+
+    dropped = REGISTRY.get_sample_value("ccx_upgrades_log_records_dropped_total")
+    logger.error("first")
+    logger.error("second")
+
+    assert log_queue.qsize() == 1
+    assert (
+        REGISTRY.get_sample_value("ccx_upgrades_log_records_dropped_total")
+        == dropped + 1
+    )
+    assert REGISTRY.get_sample_value("ccx_upgrades_log_queue_size") == 1
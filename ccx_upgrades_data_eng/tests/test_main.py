@@ -1,6 +1,9 @@
 """Test main.py."""
 
+import asyncio
+import json
 import os
+import time
 from datetime import datetime
 from unittest.mock import MagicMock, patch
 from uuid import UUID
@@ -8,13 +11,23 @@ from uuid import UUID
 from fastapi import HTTPException
 from fastapi.testclient import TestClient
 
+from ccx_upgrades_data_eng import responses, rhobs
+from ccx_upgrades_data_eng.admission import AdmissionController
+from ccx_upgrades_data_eng.config import Settings, get_settings
+from ccx_upgrades_data_eng.deadline import DeadlineExceededError
 from ccx_upgrades_data_eng.main import app
 from ccx_upgrades_data_eng.models import (
     UpgradeApiResponse,
     UpgradeRisksPredictors,
     UpgradeRisksPredictorsWithURLs,
 )
-from ccx_upgrades_data_eng.tests import needed_env
+from ccx_upgrades_data_eng.responses import compute_etag
+from ccx_upgrades_data_eng.tests import needed_env, needed_env_cache_enabled
+from ccx_upgrades_data_eng.utils import (
+    CircuitOpenError,
+    CustomTTLCache,
+    InstrumentedTTLCache,
+)
 
 client = TestClient(app)
 
@@ -45,7 +58,7 @@ class TestUpgradeRisksPrediction:  # pylint: disable=too-few-public-methods
             "Input should be a valid UUID, invalid character: found `t` at 1"
         )
 
-    @patch("ccx_upgrades_data_eng.main.perform_rhobs_request")
+    @patch("ccx_upgrades_data_eng.main.perform_rhobs_request_with_fallback")
     def test_valid_parameter_rhobs_error(
         self, perform_rhobs_request_mock, get_session_manager_mock
     ):
@@ -61,8 +74,8 @@ class TestUpgradeRisksPrediction:  # pylint: disable=too-few-public-methods
         assert perform_rhobs_request_mock.called
         assert response.status_code == 404
 
-    @patch("ccx_upgrades_data_eng.main.get_filled_inference_for_predictors")
-    @patch("ccx_upgrades_data_eng.main.perform_rhobs_request")
+    @patch("ccx_upgrades_data_eng.main.get_filled_inference_with_fallback")
+    @patch("ccx_upgrades_data_eng.main.perform_rhobs_request_with_fallback")
     def test_valid_parameter_rhobs_ok_inference_nok(
         self,
         perform_rhobs_request_mock,
@@ -87,8 +100,8 @@ class TestUpgradeRisksPrediction:  # pylint: disable=too-few-public-methods
         assert get_filled_inference_for_predictors_mock.called
         assert response.status_code == 500
 
-    @patch("ccx_upgrades_data_eng.main.get_filled_inference_for_predictors")
-    @patch("ccx_upgrades_data_eng.main.perform_rhobs_request")
+    @patch("ccx_upgrades_data_eng.main.get_filled_inference_with_fallback")
+    @patch("ccx_upgrades_data_eng.main.perform_rhobs_request_with_fallback")
     def test_valid_parameter_rhobs_ok_inference_ok(
         self,
         perform_rhobs_request_mock,
@@ -132,8 +145,50 @@ class TestUpgradeRisksPrediction:  # pylint: disable=too-few-public-methods
         }
         assert content["last_checked_at"] == test_date.isoformat()
 
-    @patch("ccx_upgrades_data_eng.main.get_filled_inference_for_predictors")
-    @patch("ccx_upgrades_data_eng.main.perform_rhobs_request")
+    @patch("ccx_upgrades_data_eng.main.get_filled_inference_with_fallback")
+    @patch("ccx_upgrades_data_eng.main.perform_rhobs_request_with_fallback")
+    def test_upstream_requests_off_the_event_loop(
+        self,
+        perform_rhobs_request_mock,
+        get_filled_inference_for_predictors_mock,
+        get_session_manager_mock,
+    ):
+        """The blocking RHOBS and inference requests don't run in the event loop."""
+        in_event_loop = []
+
+        def record_event_loop(result):
+            def side_effect(*args):
+                try:
+                    asyncio.get_running_loop()
+                    in_event_loop.append(True)
+                except RuntimeError:
+                    in_event_loop.append(False)
+                return result
+
+            return side_effect
+
+        risk_predictors = UpgradeRisksPredictors(alerts=[], operator_conditions=[])
+        perform_rhobs_request_mock.side_effect = record_event_loop(
+            (risk_predictors, "https://console_url.com")
+        )
+        get_filled_inference_for_predictors_mock.side_effect = record_event_loop(
+            UpgradeApiResponse(
+                upgrade_recommended=True,
+                upgrade_risks_predictors=UpgradeRisksPredictorsWithURLs(
+                    alerts=[], operator_conditions=[]
+                ),
+                last_checked_at=datetime.now(),
+            )
+        )
+
+        cluster_id = "34c3ecc5-624a-49a5-bab8-4fdc5e51a266"
+        response = client.get(f"/cluster/{cluster_id}/upgrade-risks-prediction")
+
+        assert response.status_code == 200
+        assert in_event_loop == [False, False]
+
+    @patch("ccx_upgrades_data_eng.main.get_filled_inference_with_fallback")
+    @patch("ccx_upgrades_data_eng.main.perform_rhobs_request_with_fallback")
     def test_valid_parameter_rhobs_no_cluster_version(
         self,
         perform_rhobs_request_mock,
@@ -194,7 +249,7 @@ def test_multi_cluster_endpoint_no_clusters(get_session_manager_mock):
 
 @patch.dict(os.environ, needed_env)
 @patch("ccx_upgrades_data_eng.main.get_session_manager")
-@patch("ccx_upgrades_data_eng.main.get_filled_inference_for_predictors")
+@patch("ccx_upgrades_data_eng.inference.get_filled_inference_for_predictors")
 @patch("ccx_upgrades_data_eng.main.perform_rhobs_request_multi_cluster")
 def test_multi_cluster_endpoint_rhobs_ok_inference_ok(
     perform_rhobs_request_multi_cluster_mock,
@@ -218,14 +273,19 @@ def test_multi_cluster_endpoint_rhobs_ok_inference_ok(
             "",
         ),
     }
-    perform_rhobs_request_multi_cluster_mock.return_value = clusters_predictions
-    get_filled_inference_for_predictors_mock.return_value = UpgradeApiResponse(
+    perform_rhobs_request_multi_cluster_mock.return_value = (
+        clusters_predictions,
+        {*clusters_predictions, UUID("aae0ff10-9892-4572-b77f-73eb3e39825f")},
+    )
+    inference_result = UpgradeApiResponse(
         upgrade_recommended=True,
         upgrade_risks_predictors=UpgradeRisksPredictorsWithURLs.model_validate(
             risk_predictors
         ),
         last_checked_at=test_date,
     )
+    get_filled_inference_for_predictors_mock.return_value = inference_result
+    etag = compute_etag(inference_result)
 
     response = client.post(
         "/upgrade-risks-prediction",
@@ -249,6 +309,7 @@ def test_multi_cluster_endpoint_rhobs_ok_inference_ok(
                 "operator_conditions": [],
             },
             "last_checked_at": test_date.isoformat(),
+            "etag": etag,
         },
         {
             "cluster_id": "2b9195d4-85d4-428f-944b-4b46f08911f8",
@@ -259,6 +320,7 @@ def test_multi_cluster_endpoint_rhobs_ok_inference_ok(
                 "operator_conditions": [],
             },
             "last_checked_at": test_date.isoformat(),
+            "etag": etag,
         },
         {
             "cluster_id": "aae0ff10-9892-4572-b77f-73eb3e39825f",
@@ -266,6 +328,7 @@ def test_multi_cluster_endpoint_rhobs_ok_inference_ok(
             "upgrade_recommended": None,
             "upgrade_risks_predictors": None,
             "last_checked_at": None,
+            "etag": None,
         },
     ]
 
@@ -276,3 +339,681 @@ def test_multi_cluster_endpoint_rhobs_ok_inference_ok(
 
     for expected_element_in_result in expected_elements_in_result_array:
         assert expected_element_in_result in content["predictions"]
+
+
+@patch.dict(os.environ, needed_env)
+@patch("ccx_upgrades_data_eng.main.get_session_manager")
+@patch("ccx_upgrades_data_eng.main.perform_rhobs_request_with_fallback")
+@patch("ccx_upgrades_data_eng.main.get_cached_response")
+def test_single_cluster_endpoint_serialized_response_cache_hit(
+    get_cached_response_mock,
+    perform_rhobs_request_mock,
+    get_session_manager_mock,
+):
+    """A cached serialized response is served without querying RHOBS."""
+    inference_result = UpgradeApiResponse(
+        upgrade_recommended=True,
+        upgrade_risks_predictors=UpgradeRisksPredictorsWithURLs(
+            alerts=[], operator_conditions=[]
+        ),
+        last_checked_at=datetime.now(),
+    )
+    body = inference_result.model_dump_json().encode()
+    get_cached_response_mock.return_value = inference_result, body, 'W/"etag"'
+
+    app.dependency_overrides[get_settings] = lambda: Settings(
+        response_cache_enabled=True
+    )
+    try:
+        cluster_id = "34c3ecc5-624a-49a5-bab8-4fdc5e51a266"
+        response = client.get(f"/cluster/{cluster_id}/upgrade-risks-prediction")
+    finally:
+        app.dependency_overrides.clear()
+
+    assert not perform_rhobs_request_mock.called
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.headers["etag"] == 'W/"etag"'
+    assert response.content == body
+
+
+@patch.dict(os.environ, needed_env)
+@patch("ccx_upgrades_data_eng.main.get_session_manager")
+@patch("ccx_upgrades_data_eng.main.cache_response")
+@patch("ccx_upgrades_data_eng.main.get_filled_inference_with_fallback")
+@patch("ccx_upgrades_data_eng.main.perform_rhobs_request_with_fallback")
+@patch("ccx_upgrades_data_eng.main.get_cached_response")
+def test_single_cluster_endpoint_serialized_response_cache_miss(
+    get_cached_response_mock,
+    perform_rhobs_request_mock,
+    get_filled_inference_for_predictors_mock,
+    cache_response_mock,
+    get_session_manager_mock,
+):
+    """On a miss the response is computed, serialized and stored."""
+    risk_predictors = UpgradeRisksPredictors(alerts=[], operator_conditions=[])
+    rhobs_result = risk_predictors, "https://console_url.com"
+    inference_result = UpgradeApiResponse(
+        upgrade_recommended=True,
+        upgrade_risks_predictors=UpgradeRisksPredictorsWithURLs(
+            alerts=[], operator_conditions=[]
+        ),
+        last_checked_at=datetime.now(),
+    )
+    body = inference_result.model_dump_json().encode()
+    get_cached_response_mock.return_value = None
+    perform_rhobs_request_mock.return_value = rhobs_result
+    get_filled_inference_for_predictors_mock.return_value = inference_result
+    cache_response_mock.return_value = body, 'W/"etag"'
+
+    app.dependency_overrides[get_settings] = lambda: Settings(
+        response_cache_enabled=True
+    )
+    try:
+        cluster_id = "34c3ecc5-624a-49a5-bab8-4fdc5e51a266"
+        response = client.get(f"/cluster/{cluster_id}/upgrade-risks-prediction")
+    finally:
+        app.dependency_overrides.clear()
+
+    cache_response_mock.assert_called_once_with(
+        UUID(cluster_id), rhobs_result, inference_result
+    )
+    assert response.status_code == 200
+    assert response.content == body
+
+
+@patch.dict(os.environ, needed_env)
+@patch("ccx_upgrades_data_eng.main.get_session_manager")
+@patch("ccx_upgrades_data_eng.main.get_filled_inference_with_fallback")
+@patch("ccx_upgrades_data_eng.main.perform_rhobs_request_with_fallback")
+def test_single_cluster_endpoint_conditional_get(
+    perform_rhobs_request_mock,
+    get_filled_inference_for_predictors_mock,
+    get_session_manager_mock,
+):
+    """The ETag is returned and a matching If-None-Match gets a 304."""
+    risk_predictors = UpgradeRisksPredictors(alerts=[], operator_conditions=[])
+    perform_rhobs_request_mock.return_value = (
+        risk_predictors,
+        "https://console_url.com",
+    )
+    get_filled_inference_for_predictors_mock.return_value = UpgradeApiResponse(
+        upgrade_recommended=True,
+        upgrade_risks_predictors=UpgradeRisksPredictorsWithURLs(
+            alerts=[], operator_conditions=[]
+        ),
+        last_checked_at=datetime.now(),
+    )
+
+    app.dependency_overrides[get_settings] = lambda: Settings(
+        cache_enabled=True, cache_ttl=60
+    )
+    try:
+        cluster_id = "34c3ecc5-624a-49a5-bab8-4fdc5e51a266"
+        url = f"/cluster/{cluster_id}/upgrade-risks-prediction"
+        response = client.get(url)
+        etag = response.headers["etag"]
+
+        assert response.status_code == 200
+        assert response.headers["cache-control"] == "max-age=60"
+
+        # last_checked_at is not part of the ETag
+        get_filled_inference_for_predictors_mock.return_value.last_checked_at = (
+            datetime.now()
+        )
+        response = client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == etag
+
+        response = client.get(url, headers={"If-None-Match": 'W/"other"'})
+        assert response.status_code == 200
+    finally:
+        app.dependency_overrides.clear()
+
+
+@patch.dict(os.environ, needed_env)
+@patch("ccx_upgrades_data_eng.main.get_session_manager")
+@patch("ccx_upgrades_data_eng.inference.get_filled_inference_for_predictors")
+@patch("ccx_upgrades_data_eng.main.perform_rhobs_request_multi_cluster")
+def test_multi_cluster_endpoint_conditional_fetch(
+    perform_rhobs_request_multi_cluster_mock,
+    get_filled_inference_for_predictors_mock,
+    get_session_manager_mock,
+):
+    """Clusters whose ETag matches are returned as unchanged."""
+    risk_predictors = {"alerts": [], "operator_conditions": []}
+    clusters_predictions = {
+        UUID("34c3ecc5-624a-49a5-bab8-4fdc5e51a266"): (
+            UpgradeRisksPredictors.model_validate(risk_predictors),
+            "https://console_url.com",
+        ),
+        UUID("2b9195d4-85d4-428f-944b-4b46f08911f8"): (
+            UpgradeRisksPredictors.model_validate(risk_predictors),
+            "https://console_url.com",
+        ),
+    }
+    perform_rhobs_request_multi_cluster_mock.return_value = (
+        clusters_predictions,
+        set(clusters_predictions),
+    )
+    inference_result = UpgradeApiResponse(
+        upgrade_recommended=True,
+        upgrade_risks_predictors=UpgradeRisksPredictorsWithURLs.model_validate(
+            risk_predictors
+        ),
+        last_checked_at=datetime.now(),
+    )
+    get_filled_inference_for_predictors_mock.return_value = inference_result
+    etag = compute_etag(inference_result)
+
+    response = client.post(
+        "/upgrade-risks-prediction",
+        json={
+            "clusters": [
+                "34c3ecc5-624a-49a5-bab8-4fdc5e51a266",
+                "2b9195d4-85d4-428f-944b-4b46f08911f8",
+            ],
+            "etags": {
+                "34c3ecc5-624a-49a5-bab8-4fdc5e51a266": etag,
+                "2b9195d4-85d4-428f-944b-4b46f08911f8": 'W/"outdated"',
+            },
+        },
+    )
+    predictions = {
+        prediction["cluster_id"]: prediction
+        for prediction in response.json()["predictions"]
+    }
+
+    assert response.status_code == 200
+    assert predictions["34c3ecc5-624a-49a5-bab8-4fdc5e51a266"] == {
+        "cluster_id": "34c3ecc5-624a-49a5-bab8-4fdc5e51a266",
+        "prediction_status": "unchanged",
+        "upgrade_recommended": None,
+        "upgrade_risks_predictors": None,
+        "last_checked_at": None,
+        "etag": etag,
+    }
+    assert (
+        predictions["2b9195d4-85d4-428f-944b-4b46f08911f8"]["prediction_status"] == "ok"
+    )
+    assert predictions["2b9195d4-85d4-428f-944b-4b46f08911f8"]["etag"] == etag
+
+
+@patch.dict(os.environ, needed_env)
+@patch("ccx_upgrades_data_eng.main.get_session_manager")
+@patch("ccx_upgrades_data_eng.inference.get_filled_inference_for_predictors")
+@patch("ccx_upgrades_data_eng.main.perform_rhobs_request_multi_cluster")
+@patch(
+    "ccx_upgrades_data_eng.responses.multi_cluster_responses_cache",
+    InstrumentedTTLCache("test_multi_cluster_responses", maxsize=10, ttl=100),
+)
+@patch.object(
+    rhobs.perform_rhobs_request,
+    "cache",
+    InstrumentedTTLCache("test_multi_cluster_rhobs", maxsize=10, ttl=100),
+)
+def test_multi_cluster_endpoint_response_cache(
+    perform_rhobs_request_multi_cluster_mock,
+    get_filled_inference_for_predictors_mock,
+    get_session_manager_mock,
+):
+    """The same set of clusters is served from the response cache, unless ETags are sent."""
+    cluster_id = UUID("34c3ecc5-624a-49a5-bab8-4fdc5e51a266")
+    rhobs_result = (
+        UpgradeRisksPredictors(alerts=[], operator_conditions=[]),
+        "https://console_url.com",
+    )
+    inference_result = UpgradeApiResponse(
+        upgrade_recommended=True,
+        upgrade_risks_predictors=UpgradeRisksPredictorsWithURLs(
+            alerts=[], operator_conditions=[]
+        ),
+        last_checked_at=datetime.now(),
+    )
+    rhobs.perform_rhobs_request.cache[(cluster_id,)] = rhobs_result
+    get_filled_inference_for_predictors_mock.cache = InstrumentedTTLCache(
+        "test_multi_cluster_inference", maxsize=10, ttl=100
+    )
+    get_filled_inference_for_predictors_mock.cache[rhobs_result] = inference_result
+    perform_rhobs_request_multi_cluster_mock.return_value = (
+        {cluster_id: rhobs_result},
+        {cluster_id, UUID("aae0ff10-9892-4572-b77f-73eb3e39825f")},
+    )
+    get_filled_inference_for_predictors_mock.return_value = inference_result
+
+    clusters = [str(cluster_id), "aae0ff10-9892-4572-b77f-73eb3e39825f"]
+    app.dependency_overrides[get_settings] = lambda: Settings(
+        response_cache_enabled=True
+    )
+    try:
+        first = client.post("/upgrade-risks-prediction", json={"clusters": clusters})
+        second = client.post(
+            "/upgrade-risks-prediction", json={"clusters": clusters[::-1]}
+        )
+        assert perform_rhobs_request_multi_cluster_mock.call_count == 1
+
+        conditional = client.post(
+            "/upgrade-risks-prediction",
+            json={
+                "clusters": clusters,
+                "etags": {str(cluster_id): compute_etag(inference_result)},
+            },
+        )
+        assert perform_rhobs_request_multi_cluster_mock.call_count == 2
+    finally:
+        app.dependency_overrides.clear()
+
+    assert first.status_code == second.status_code == 200
+    assert second.content == first.content
+    assert conditional.json()["predictions"][0]["prediction_status"] == "unchanged"
+
+
+@patch.dict(os.environ, needed_env)
+@patch("ccx_upgrades_data_eng.main.get_session_manager")
+@patch("ccx_upgrades_data_eng.inference.get_filled_inference_for_predictors")
+@patch("ccx_upgrades_data_eng.main.iter_rhobs_request_multi_cluster")
+def test_multi_cluster_endpoint_ndjson_stream(
+    iter_rhobs_request_multi_cluster_mock,
+    get_filled_inference_for_predictors_mock,
+    get_session_manager_mock,
+):
+    """The predictions are streamed per chunk, with the missing clusters at the end."""
+    risk_predictors = UpgradeRisksPredictors(alerts=[], operator_conditions=[])
+    iter_rhobs_request_multi_cluster_mock.return_value = iter(
+        [
+            {
+                UUID("34c3ecc5-624a-49a5-bab8-4fdc5e51a266"): (
+                    risk_predictors,
+                    "https://console_url.com",
+                )
+            },
+            {
+                UUID("2b9195d4-85d4-428f-944b-4b46f08911f8"): (
+                    risk_predictors,
+                    "https://console_url.com",
+                )
+            },
+        ]
+    )
+    get_filled_inference_for_predictors_mock.return_value = UpgradeApiResponse(
+        upgrade_recommended=True,
+        upgrade_risks_predictors=UpgradeRisksPredictorsWithURLs(
+            alerts=[], operator_conditions=[]
+        ),
+        last_checked_at=datetime.now(),
+    )
+
+    response = client.post(
+        "/upgrade-risks-prediction",
+        headers={"Accept": "application/x-ndjson"},
+        json={
+            "clusters": [
+                "aae0ff10-9892-4572-b77f-73eb3e39825f",  # Cluster not in RHOBS
+                "34c3ecc5-624a-49a5-bab8-4fdc5e51a266",
+                "2b9195d4-85d4-428f-944b-4b46f08911f8",
+            ],
+        },
+    )
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [(line["cluster_id"], line["prediction_status"]) for line in lines] == [
+        ("34c3ecc5-624a-49a5-bab8-4fdc5e51a266", "ok"),
+        ("2b9195d4-85d4-428f-944b-4b46f08911f8", "ok"),
+        ("aae0ff10-9892-4572-b77f-73eb3e39825f", "No data for the cluster"),
+    ]
+
+
+@patch.dict(os.environ, needed_env)
+@patch("ccx_upgrades_data_eng.main.get_session_manager")
+@patch("ccx_upgrades_data_eng.main.iter_rhobs_request_multi_cluster")
+def test_multi_cluster_endpoint_ndjson_stream_rhobs_error(
+    iter_rhobs_request_multi_cluster_mock,
+    get_session_manager_mock,
+):
+    """Clusters not processed when RHOBS fails are reported with the error."""
+
+    def failing_chunks(clusters):
+        raise HTTPException(status_code=424, detail="RHOBS connection failed")
+        yield  # pragma: no cover
+
+    iter_rhobs_request_multi_cluster_mock.side_effect = failing_chunks
+
+    response = client.post(
+        "/upgrade-risks-prediction",
+        headers={"Accept": "application/x-ndjson"},
+        json={"clusters": ["34c3ecc5-624a-49a5-bab8-4fdc5e51a266"]},
+    )
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.status_code == 200
+    assert lines[0]["prediction_status"] == "RHOBS connection failed"
+
+
+@patch.dict(os.environ, needed_env)
+@patch("ccx_upgrades_data_eng.main.get_session_manager")
+@patch("ccx_upgrades_data_eng.main.iter_rhobs_request_multi_cluster")
+def test_multi_cluster_endpoint_ndjson_stream_unexpected_error(
+    iter_rhobs_request_multi_cluster_mock,
+    get_session_manager_mock,
+):
+    """An unexpected error once the stream started is reported for each remaining cluster."""
+    clusters = [
+        "34c3ecc5-624a-49a5-bab8-4fdc5e51a266",
+        "2b9195d4-85d4-428f-944b-4b46f08911f8",
+    ]
+
+    def failing_chunks(clusters):
+        raise ValueError("unexpected")
+        yield  # pragma: no cover
+
+    iter_rhobs_request_multi_cluster_mock.side_effect = failing_chunks
+
+    response = client.post(
+        "/upgrade-risks-prediction",
+        headers={"Accept": "application/x-ndjson"},
+        json={"clusters": clusters},
+    )
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.status_code == 200
+    assert [(line["cluster_id"], line["prediction_status"]) for line in lines] == [
+        (cluster, "Internal Server Error") for cluster in clusters
+    ]
+
+
+@patch.dict(os.environ, {**needed_env, "SERVER_TIMING_ENABLED": "true"})
+@patch("ccx_upgrades_data_eng.main.get_session_manager")
+@patch("ccx_upgrades_data_eng.inference.get_filled_inference_for_predictors")
+@patch("ccx_upgrades_data_eng.rhobs.perform_rhobs_request_chunk")
+@patch.object(
+    rhobs.perform_rhobs_request,
+    "cache",
+    InstrumentedTTLCache("test_server_timing", maxsize=10, ttl=100),
+)
+def test_multi_cluster_endpoint_server_timing(
+    perform_rhobs_request_chunk_mock,
+    get_filled_inference_for_predictors_mock,
+    get_session_manager_mock,
+):
+    """The Server-Timing header reports the stages and the cached clusters."""
+    cached_cluster = UUID("34c3ecc5-624a-49a5-bab8-4fdc5e51a266")
+    fetched_cluster = UUID("2b9195d4-85d4-428f-944b-4b46f08911f8")
+    risk_predictors = UpgradeRisksPredictors(alerts=[], operator_conditions=[])
+    rhobs.perform_rhobs_request.cache[(cached_cluster,)] = (
+        risk_predictors,
+        "https://console_url.com",
+    )
+    perform_rhobs_request_chunk_mock.return_value = {
+        fetched_cluster: (risk_predictors, "https://console_url.com")
+    }
+    get_filled_inference_for_predictors_mock.return_value = UpgradeApiResponse(
+        upgrade_recommended=True,
+        upgrade_risks_predictors=UpgradeRisksPredictorsWithURLs(
+            alerts=[], operator_conditions=[]
+        ),
+        last_checked_at=datetime.now(),
+    )
+
+    get_settings.cache_clear()
+    try:
+        response = client.post(
+            "/upgrade-risks-prediction",
+            json={"clusters": [str(cached_cluster), str(fetched_cluster)]},
+        )
+    finally:
+        get_settings.cache_clear()
+
+    assert response.status_code == 200
+    server_timing = response.headers["server-timing"].split(", ")
+    assert any(entry.startswith("sso_token_refresh;dur=") for entry in server_timing)
+    assert any(entry.startswith("serialization;dur=") for entry in server_timing)
+    assert 'cache-test_server_timing;desc="hit=1 miss=1"' in server_timing
+    assert "clusters-cached;desc=1" in server_timing
+    assert "clusters-fetched;desc=1" in server_timing
+
+
+@patch.dict(os.environ, needed_env)
+@patch("ccx_upgrades_data_eng.main.get_session_manager")
+def test_server_timing_disabled(get_session_manager_mock):
+    """The Server-Timing header is not sent by default."""
+    get_settings.cache_clear()
+    response = client.post("/upgrade-risks-prediction", json={"clusters": []})
+    assert response.status_code == 200
+    assert "server-timing" not in response.headers
+
+
+@patch.dict(os.environ, {**needed_env, "ADMISSION_MAX_IN_FLIGHT": "1"})
+@patch("ccx_upgrades_data_eng.main.get_session_manager")
+@patch("ccx_upgrades_data_eng.main.get_admission_controller")
+def test_admission_control_rejects_with_retry_after(
+    get_admission_controller_mock, get_session_manager_mock
+):
+    """The prediction requests are shed with a 503 when there is no free slot."""
+    controller = AdmissionController(1, 1, 0, 0)
+    controller.in_flight = 1
+    get_admission_controller_mock.return_value = controller
+
+    get_settings.cache_clear()
+    try:
+        response = client.post("/upgrade-risks-prediction", json={"clusters": []})
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "1"
+        get_session_manager_mock.assert_not_called()
+
+        # The other endpoints are not under admission control
+        response = client.get("/openapi.json")
+        assert response.status_code == 200
+    finally:
+        get_settings.cache_clear()
+
+
+@patch.dict(os.environ, {**needed_env, "ADMISSION_MAX_IN_FLIGHT": "1"})
+@patch("ccx_upgrades_data_eng.main.get_session_manager")
+@patch("ccx_upgrades_data_eng.main.get_admission_controller")
+@patch("ccx_upgrades_data_eng.main.iter_rhobs_request_multi_cluster")
+def test_admission_control_holds_slot_while_streaming(
+    iter_rhobs_request_multi_cluster_mock,
+    get_admission_controller_mock,
+    get_session_manager_mock,
+):
+    """A streamed response keeps its slot until the whole body is produced."""
+    controller = AdmissionController(1, 1, 0, 0)
+    get_admission_controller_mock.return_value = controller
+    in_flight_while_streaming = []
+
+    def rhobs_chunks(clusters):
+        in_flight_while_streaming.append(controller.in_flight)
+        yield {}
+
+    iter_rhobs_request_multi_cluster_mock.side_effect = rhobs_chunks
+
+    get_settings.cache_clear()
+    try:
+        response = client.post(
+            "/upgrade-risks-prediction",
+            headers={"Accept": "application/x-ndjson"},
+            json={"clusters": ["34c3ecc5-624a-49a5-bab8-4fdc5e51a266"]},
+        )
+    finally:
+        get_settings.cache_clear()
+
+    assert response.status_code == 200
+    assert in_flight_while_streaming == [1]
+    assert controller.in_flight == 0
+
+
+@patch.dict(os.environ, needed_env)
+@patch("ccx_upgrades_data_eng.main.get_session_manager")
+@patch("ccx_upgrades_data_eng.inference.get_filled_inference_for_predictors")
+@patch("ccx_upgrades_data_eng.main.perform_rhobs_request_multi_cluster")
+def test_multi_cluster_endpoint_deadline_partial_results(
+    perform_rhobs_request_multi_cluster_mock,
+    get_filled_inference_for_predictors_mock,
+    get_session_manager_mock,
+):
+    """The clusters not processed before the deadline are reported as timed out."""
+    done_cluster = UUID("34c3ecc5-624a-49a5-bab8-4fdc5e51a266")
+    risk_predictors = {"alerts": [], "operator_conditions": []}
+
+    def slow_rhobs_request(clusters):
+        # Only the cached cluster is returned, as the RHOBS query timed out
+        time.sleep(0.1)
+        results = {
+            done_cluster: (
+                UpgradeRisksPredictors.model_validate(risk_predictors),
+                "https://console_url.com",
+            )
+        }
+        return results, {done_cluster}
+
+    perform_rhobs_request_multi_cluster_mock.side_effect = slow_rhobs_request
+    get_filled_inference_for_predictors_mock.return_value = UpgradeApiResponse(
+        upgrade_recommended=True,
+        upgrade_risks_predictors=UpgradeRisksPredictorsWithURLs.model_validate(
+            risk_predictors
+        ),
+        last_checked_at=datetime.now(),
+    )
+
+    response = client.post(
+        "/upgrade-risks-prediction",
+        headers={"X-Request-Timeout": "0.05"},
+        json={
+            "clusters": [
+                "34c3ecc5-624a-49a5-bab8-4fdc5e51a266",
+                "2b9195d4-85d4-428f-944b-4b46f08911f8",
+            ],
+        },
+    )
+
+    assert response.status_code == 200
+    assert [
+        (prediction["cluster_id"], prediction["prediction_status"])
+        for prediction in response.json()["predictions"]
+    ] == [
+        ("34c3ecc5-624a-49a5-bab8-4fdc5e51a266", "ok"),
+        ("2b9195d4-85d4-428f-944b-4b46f08911f8", "Request timed out"),
+    ]
+
+
+@patch.dict(os.environ, needed_env)
+@patch("ccx_upgrades_data_eng.main.get_session_manager")
+@patch("ccx_upgrades_data_eng.main.get_cluster_inference")
+@patch("ccx_upgrades_data_eng.main.perform_rhobs_request_multi_cluster")
+def test_multi_cluster_endpoint_deadline_queried_clusters_without_data(
+    perform_rhobs_request_multi_cluster_mock,
+    get_cluster_inference_mock,
+    get_session_manager_mock,
+):
+    """The clusters queried to RHOBS without data are not reported as timed out."""
+    data_cluster = UUID("34c3ecc5-624a-49a5-bab8-4fdc5e51a266")
+    no_data_cluster = UUID("2b9195d4-85d4-428f-944b-4b46f08911f8")
+    risk_predictors = UpgradeRisksPredictors(alerts=[], operator_conditions=[])
+    perform_rhobs_request_multi_cluster_mock.return_value = (
+        {data_cluster: (risk_predictors, "https://console_url.com")},
+        {data_cluster, no_data_cluster},
+    )
+
+    def slow_inference(rhobs_result):
+        time.sleep(0.1)
+        raise DeadlineExceededError()
+
+    get_cluster_inference_mock.side_effect = slow_inference
+
+    response = client.post(
+        "/upgrade-risks-prediction",
+        headers={"X-Request-Timeout": "0.05"},
+        json={"clusters": [str(data_cluster), str(no_data_cluster)]},
+    )
+
+    assert response.status_code == 200
+    assert [
+        (prediction["cluster_id"], prediction["prediction_status"])
+        for prediction in response.json()["predictions"]
+    ] == [
+        (str(data_cluster), "Request timed out"),
+        (str(no_data_cluster), "No data for the cluster"),
+    ]
+
+
+@patch.dict(os.environ, needed_env)
+@patch("ccx_upgrades_data_eng.main.get_session_manager")
+@patch("ccx_upgrades_data_eng.main.get_cluster_inference")
+@patch("ccx_upgrades_data_eng.rhobs.get_session_manager")
+@patch("ccx_upgrades_data_eng.rhobs.get_circuit_breaker")
+@patch(
+    "ccx_upgrades_data_eng.responses.multi_cluster_responses_cache",
+    InstrumentedTTLCache("test_multi_cluster_circuit_open", maxsize=10, ttl=100),
+)
+def test_multi_cluster_endpoint_circuit_open_partial_results(
+    get_circuit_breaker_mock,
+    rhobs_get_session_manager_mock,
+    get_cluster_inference_mock,
+    get_session_manager_mock,
+):
+    """While RHOBS is unavailable, the clusters without stale results are reported so."""
+    stale_cluster = UUID("34c3ecc5-624a-49a5-bab8-4fdc5e51a266")
+    missing_cluster = UUID("2b9195d4-85d4-428f-944b-4b46f08911f8")
+    get_circuit_breaker_mock.return_value.before_call.side_effect = CircuitOpenError()
+    get_cluster_inference_mock.return_value = UpgradeApiResponse(
+        upgrade_recommended=True,
+        upgrade_risks_predictors=UpgradeRisksPredictorsWithURLs(
+            alerts=[], operator_conditions=[]
+        ),
+        last_checked_at=datetime.now(),
+    )
+    get_settings.cache_clear()
+    with patch.dict(os.environ, needed_env_cache_enabled):
+        cache = CustomTTLCache("test_multi_cluster_stale", ttl=0.05, keep_stale=True)
+    get_settings.cache_clear()
+    cache[(stale_cluster,)] = (
+        UpgradeRisksPredictors(alerts=[], operator_conditions=[]),
+        "https://console_url.com",
+    )
+    time.sleep(0.1)
+
+    app.dependency_overrides[get_settings] = lambda: Settings(
+        response_cache_enabled=True
+    )
+    try:
+        with patch.object(rhobs.perform_rhobs_request, "cache", cache):
+            response = client.post(
+                "/upgrade-risks-prediction",
+                json={"clusters": [str(stale_cluster), str(missing_cluster)]},
+            )
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    assert [
+        (prediction["cluster_id"], prediction["prediction_status"])
+        for prediction in response.json()["predictions"]
+    ] == [
+        (str(stale_cluster), "ok"),
+        (str(missing_cluster), "RHOBS unavailable"),
+    ]
+    # The partial response is not cached
+    assert len(responses.multi_cluster_responses_cache) == 0
+
+
+@patch.dict(os.environ, {**needed_env, "REQUEST_DEADLINE": "0.000001"})
+@patch("ccx_upgrades_data_eng.main.get_session_manager")
+@patch("ccx_upgrades_data_eng.rhobs.get_session_manager")
+def test_single_cluster_endpoint_deadline_exceeded(
+    rhobs_get_session_manager_mock, get_session_manager_mock
+):
+    """A single cluster request returns a 504 if its deadline expires."""
+    get_settings.cache_clear()
+    try:
+        response = client.get(
+            "/cluster/34c3ecc5-624a-49a5-bab8-4fdc5e51a266/upgrade-risks-prediction"
+        )
+    finally:
+        get_settings.cache_clear()
+
+    assert response.status_code == 504
+    session = rhobs_get_session_manager_mock.return_value.get_session.return_value
+    session.get.assert_not_called()
@@ -1,15 +1,27 @@
 """Test the /metrics endpoint."""
 
+import asyncio
 import os
+import time
+from datetime import datetime
 from unittest import mock
 
+import pytest
 from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
 
 from ccx_upgrades_data_eng.main import app
+from ccx_upgrades_data_eng.metrics import RequestTimings, monitor_event_loop_lag
+from ccx_upgrades_data_eng.models import (
+    UpgradeApiResponse,
+    UpgradeRisksPredictors,
+    UpgradeRisksPredictorsWithURLs,
+)
 
 needed_env = {
     "CLIENT_ID": "client-id",
     "CLIENT_SECRET": "secret",
+    "INFERENCE_URL": "http://inference:8000",
 }
 
 
@@ -19,9 +31,100 @@ def test_metrics_are_populated(get_session_manager_mock):
     """Check that the metrics exist."""
     with TestClient(app) as client:
         response = client.get("/metrics")
-        assert get_session_manager_mock.called
+        assert not get_session_manager_mock.called  # no SSO token needed
         assert response.status_code == 200
         assert "http_requests_total" in response.text
         assert "ccx_upgrades_prediction_total" in response.text
         assert "ccx_upgrades_risks_total" in response.text
         assert "ccx_upgrades_rhobs_time" in response.text
+        assert "ccx_upgrades_stage_time" in response.text
+        assert "ccx_upgrades_inference_time" in response.text
+        assert 'ccx_upgrades_cache_hits_total{cache="rhobs"}' in response.text
+        assert 'ccx_upgrades_cache_size{cache="inference"}' in response.text
+        assert 'http_requests_inprogress{handler="/metrics"' in response.text
+        assert "ccx_upgrades_event_loop_lag" in response.text
+        assert "ccx_upgrades_rhobs_in_flight" in response.text
+        assert "ccx_upgrades_inference_in_flight" in response.text
+
+        response = client.get(
+            "/metrics", headers={"Accept": "application/openmetrics-text"}
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith(
+            "application/openmetrics-text"
+        )
+
+
+def get_stage_count(endpoint, stage):
+    """Return the number of observations of a stage for the given endpoint."""
+    labels = {"endpoint": endpoint, "stage": stage}
+    return REGISTRY.get_sample_value("ccx_upgrades_stage_time_count", labels) or 0
+
+
+@mock.patch.dict(os.environ, needed_env)
+@mock.patch("ccx_upgrades_data_eng.main.get_session_manager")
+@mock.patch("ccx_upgrades_data_eng.main.get_filled_inference_with_fallback")
+@mock.patch("ccx_upgrades_data_eng.main.perform_rhobs_request_with_fallback")
+def test_stage_times_are_labelled_by_endpoint(
+    perform_rhobs_request_mock,
+    get_filled_inference_for_predictors_mock,
+    get_session_manager_mock,
+):
+    """Check that the stages are observed with the route of the request."""
+    predictors = UpgradeRisksPredictors(alerts=[], operator_conditions=[])
+    perform_rhobs_request_mock.return_value = (predictors, "https://console_url.com")
+    get_filled_inference_for_predictors_mock.return_value = UpgradeApiResponse(
+        upgrade_recommended=True,
+        upgrade_risks_predictors=UpgradeRisksPredictorsWithURLs.model_validate(
+            predictors.model_dump()
+        ),
+        last_checked_at=datetime.now(),
+    )
+    endpoint = "/cluster/{cluster_id}/upgrade-risks-prediction"
+    sso_count = get_stage_count(endpoint, "sso_token_refresh")
+    serialization_count = get_stage_count(endpoint, "serialization")
+    etag_count = get_stage_count(endpoint, "etag")
+
+    with TestClient(app) as client:
+        cluster_id = "34c3ecc5-624a-49a5-bab8-4fdc5e51a266"
+        response = client.get(f"/cluster/{cluster_id}/upgrade-risks-prediction")
+        assert response.status_code == 200
+
+    assert get_stage_count(endpoint, "sso_token_refresh") == sso_count + 1
+    # The body is serialized once, and the ETag computed in a stage of its own
+    assert get_stage_count(endpoint, "serialization") == serialization_count + 1
+    assert get_stage_count(endpoint, "etag") == etag_count + 1
+
+
+def test_request_timings_to_header():
+    """Check the Server-Timing header format."""
+    timings = RequestTimings()
+    assert timings.to_header() == ""
+
+    timings.add_duration("rhobs_fetch", 0.0123)
+    timings.add_duration("rhobs_fetch", 0.001)
+    timings.add_cache_result("rhobs", hit=True)
+    timings.add_cache_result("inference", hit=False)
+    timings.add_cache_result("responses", hit=True)
+    timings.add_cache_result("responses", hit=False)
+    timings.add_count("clusters-cached", 3)
+
+    assert timings.to_header() == (
+        "rhobs_fetch;dur=13.3, "
+        'cache-rhobs;desc="hit", '
+        'cache-inference;desc="miss", '
+        'cache-responses;desc="hit=1 miss=1", '
+        "clusters-cached;desc=3"
+    )
+
+
+@pytest.mark.asyncio
+async def test_monitor_event_loop_lag():
+    """The lag measures how long the event loop was blocked."""
+    monitor = asyncio.create_task(monitor_event_loop_lag(0.05))
+    await asyncio.sleep(0)  # let the monitor start its first probe
+    time.sleep(0.2)  # block the event loop
+    await asyncio.sleep(0.01)  # let the monitor finish the probe
+    monitor.cancel()
+
+    assert REGISTRY.get_sample_value("ccx_upgrades_event_loop_lag") >= 0.1
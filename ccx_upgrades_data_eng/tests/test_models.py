@@ -1,6 +1,7 @@
 """Test models.py."""
 
 import datetime
+from uuid import UUID
 
 import pydantic
 import pytest
@@ -15,6 +16,7 @@ from ccx_upgrades_data_eng.models import (
     FOC,
     Alert,
     ClusterPrediction,
+    ClustersList,
     InferenceResponse,
     MultiClusterUpgradeApiResponse,
     UpgradeApiResponse,
@@ -300,6 +302,7 @@ def test_cluster_prediction_without_optional():
     assert prediction.last_checked_at is None
     assert prediction.upgrade_recommended is None
     assert prediction.upgrade_risks_predictors is None
+    assert prediction.etag is None
 
 
 def test_cluster_prediction():
@@ -321,6 +324,17 @@ def test_cluster_prediction():
     assert prediction.last_checked_at == datetime.datetime.fromisoformat(EXAMPLE_DATE)
 
 
+def test_clusters_list_etags():
+    """Test the ClustersList accepts optional ETags per cluster."""
+    clusters_list = ClustersList(clusters=[EXAMPLE_CLUSTER_ID])
+    assert clusters_list.etags == {}
+
+    clusters_list = ClustersList(
+        clusters=[EXAMPLE_CLUSTER_ID], etags={EXAMPLE_CLUSTER_ID: 'W/"abc"'}
+    )
+    assert clusters_list.etags == {UUID(EXAMPLE_CLUSTER_ID): 'W/"abc"'}
+
+
 def test_multi_cluster_upgrade_api_response():
     """Test the MultiClusterUpgradeApiResponse can be created and fields are populated."""
     response = MultiClusterUpgradeApiResponse(predictions=[])
@@ -0,0 +1,234 @@
+"""Tests for the responses module."""
+
+import json
+from datetime import datetime
+from unittest.mock import patch
+from uuid import UUID
+
+from prometheus_client import REGISTRY
+
+from ccx_upgrades_data_eng import inference, rhobs
+from ccx_upgrades_data_eng.config import Settings
+from ccx_upgrades_data_eng.examples import (
+    EXAMPLE_CONSOLE_URL,
+    EXAMPLE_PREDICTORS,
+    EXAMPLE_PREDICTORS_WITH_URL,
+)
+from ccx_upgrades_data_eng.models import (
+    UpgradeApiResponse,
+    UpgradeRisksPredictors,
+    UpgradeRisksPredictorsWithURLs,
+)
+from ccx_upgrades_data_eng.responses import (
+    cache_multi_cluster_response,
+    cache_response,
+    compute_etag,
+    etag_matches,
+    get_cached_multi_cluster_response,
+    get_cached_response,
+    get_caching_headers,
+    get_clusters_digest,
+    serialize_response,
+)
+from ccx_upgrades_data_eng.utils import InstrumentedTTLCache
+
+CLUSTER_ID = UUID("34c3ecc5-624a-49a5-bab8-4fdc5e51a266")
+NO_DATA_CLUSTER_ID = UUID("2b9195d4-85d4-428f-944b-4b46f08911f8")
+
+
+def build_entries():
+    """Return a RHOBS result and the inference result built from it."""
+    rhobs_result = (
+        UpgradeRisksPredictors.model_validate(EXAMPLE_PREDICTORS),
+        EXAMPLE_CONSOLE_URL,
+    )
+    inference_result = UpgradeApiResponse(
+        upgrade_recommended=False,
+        upgrade_risks_predictors=UpgradeRisksPredictorsWithURLs.model_validate(
+            EXAMPLE_PREDICTORS_WITH_URL
+        ),
+        last_checked_at=datetime(2024, 1, 1),
+    )
+    return rhobs_result, inference_result
+
+
+def test_serialize_response():
+    """The serialized body matches the pydantic JSON dump."""
+    _, inference_result = build_entries()
+    body = serialize_response(inference_result)
+    assert json.loads(body) == json.loads(inference_result.model_dump_json())
+
+
+def test_compute_etag_ignores_last_checked_at():
+    """The ETag only depends on the prediction content."""
+    _, inference_result = build_entries()
+    etag = compute_etag(inference_result)
+    assert etag.startswith('W/"')
+
+    refreshed = inference_result.model_copy(update={"last_checked_at": datetime.now()})
+    assert compute_etag(refreshed) == etag
+
+    changed = inference_result.model_copy(update={"upgrade_recommended": True})
+    assert compute_etag(changed) != etag
+
+
+def test_etag_matches():
+    """Check the If-None-Match weak comparison."""
+    etag = 'W/"abc"'
+    assert etag_matches('W/"abc"', etag)
+    assert etag_matches('"abc"', etag)
+    assert etag_matches('"xyz", W/"abc"', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('W/"xyz"', etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches("", etag)
+
+
+def test_get_caching_headers():
+    """The max-age follows the cache TTL when the cache is enabled."""
+    settings = Settings(
+        client_id="id",
+        client_secret="secret",
+        inference_url="http://inference",
+        cache_enabled=True,
+        cache_ttl=30,
+    )
+    assert get_caching_headers('W/"abc"', settings) == {
+        "ETag": 'W/"abc"',
+        "Cache-Control": "max-age=30",
+    }
+
+    settings.cache_enabled = False
+    assert get_caching_headers('W/"abc"', settings)["Cache-Control"] == "no-cache"
+
+
+@patch(
+    "ccx_upgrades_data_eng.responses.serialized_responses_cache",
+    InstrumentedTTLCache("test_responses", maxsize=10, ttl=100),
+)
+@patch.object(
+    rhobs.perform_rhobs_request, "cache", InstrumentedTTLCache("test_rhobs", 10, 100)
+)
+@patch.object(
+    inference.get_filled_inference_for_predictors,
+    "cache",
+    InstrumentedTTLCache("test_inference", 10, 100),
+)
+def test_cached_response_is_served_while_entries_are_cached():
+    """The serialized body is served while the underlying entries are cached."""
+    rhobs_result, inference_result = build_entries()
+    rhobs.perform_rhobs_request.cache[(CLUSTER_ID,)] = rhobs_result
+    inference.get_filled_inference_for_predictors.cache[rhobs_result] = inference_result
+
+    body, etag = cache_response(CLUSTER_ID, rhobs_result, inference_result)
+    hits = REGISTRY.get_sample_value(
+        "ccx_upgrades_cache_hits_total", {"cache": "test_rhobs"}
+    )
+    assert get_cached_response(CLUSTER_ID) == (inference_result, body, etag)
+
+    # Checking the underlying entries doesn't count as reading them
+    assert (
+        REGISTRY.get_sample_value(
+            "ccx_upgrades_cache_hits_total", {"cache": "test_rhobs"}
+        )
+        == hits
+    )
+
+
+@patch(
+    "ccx_upgrades_data_eng.responses.serialized_responses_cache",
+    InstrumentedTTLCache("test_responses", maxsize=10, ttl=100),
+)
+@patch.object(
+    rhobs.perform_rhobs_request, "cache", InstrumentedTTLCache("test_rhobs", 10, 100)
+)
+@patch.object(
+    inference.get_filled_inference_for_predictors,
+    "cache",
+    InstrumentedTTLCache("test_inference", 10, 100),
+)
+def test_cached_response_is_invalidated_with_underlying_entries():
+    """Evicting the RHOBS or inference entries invalidates the serialized body."""
+    rhobs_result, inference_result = build_entries()
+    rhobs.perform_rhobs_request.cache[(CLUSTER_ID,)] = rhobs_result
+    inference.get_filled_inference_for_predictors.cache[rhobs_result] = inference_result
+    cache_response(CLUSTER_ID, rhobs_result, inference_result)
+
+    del inference.get_filled_inference_for_predictors.cache[rhobs_result]
+    assert get_cached_response(CLUSTER_ID) is None
+
+    # The stale entry is removed, so it is not served even if the inference
+    # entry comes back
+    inference.get_filled_inference_for_predictors.cache[rhobs_result] = inference_result
+    assert get_cached_response(CLUSTER_ID) is None
+
+
+def test_cache_response_disabled_cache():
+    """With the cache disabled the body is returned but not stored."""
+    rhobs_result, inference_result = build_entries()
+    body, etag = cache_response(CLUSTER_ID, rhobs_result, inference_result)
+    assert body == serialize_response(inference_result)
+    assert etag == compute_etag(inference_result)
+    assert get_cached_response(CLUSTER_ID) is None
+
+
+def test_get_clusters_digest():
+    """The digest only depends on the set of clusters."""
+    digest = get_clusters_digest([CLUSTER_ID, NO_DATA_CLUSTER_ID])
+    assert get_clusters_digest([NO_DATA_CLUSTER_ID, CLUSTER_ID, CLUSTER_ID]) == digest
+    assert get_clusters_digest([CLUSTER_ID]) != digest
+
+
+@patch(
+    "ccx_upgrades_data_eng.responses.multi_cluster_responses_cache",
+    InstrumentedTTLCache("test_responses", maxsize=10, ttl=100),
+)
+@patch.object(
+    rhobs.perform_rhobs_request, "cache", InstrumentedTTLCache("test_rhobs", 10, 100)
+)
+@patch.object(
+    inference.get_filled_inference_for_predictors,
+    "cache",
+    InstrumentedTTLCache("test_inference", 10, 100),
+)
+def test_cached_multi_cluster_response_is_invalidated_with_underlying_entries():
+    """A change in the entry of any of its clusters invalidates the response."""
+    rhobs_result, inference_result = build_entries()
+    rhobs.perform_rhobs_request.cache[(CLUSTER_ID,)] = rhobs_result
+    inference.get_filled_inference_for_predictors.cache[rhobs_result] = inference_result
+    clusters = [CLUSTER_ID, NO_DATA_CLUSTER_ID]
+    digest = get_clusters_digest(clusters)
+
+    cache_multi_cluster_response(
+        digest, clusters, [(CLUSTER_ID, rhobs_result, inference_result)], b"body"
+    )
+    assert get_cached_multi_cluster_response(digest) == b"body"
+
+    # A new RHOBS result for the cluster replaces the one the response used
+    rhobs.perform_rhobs_request.cache[(CLUSTER_ID,)] = build_entries()[0]
+    assert get_cached_multi_cluster_response(digest) is None
+
+
+@patch(
+    "ccx_upgrades_data_eng.responses.multi_cluster_responses_cache",
+    InstrumentedTTLCache("test_responses", maxsize=10, ttl=100),
+)
+@patch.object(
+    rhobs.perform_rhobs_request, "cache", InstrumentedTTLCache("test_rhobs", 10, 100)
+)
+@patch.object(
+    inference.get_filled_inference_for_predictors,
+    "cache",
+    InstrumentedTTLCache("test_inference", 10, 100),
+)
+def test_cached_multi_cluster_response_is_invalidated_by_new_data():
+    """New data for a cluster reported without data invalidates the response."""
+    rhobs_result, _ = build_entries()
+    digest = get_clusters_digest([NO_DATA_CLUSTER_ID])
+    cache_multi_cluster_response(digest, [NO_DATA_CLUSTER_ID], [], b"body")
+
+    rhobs.perform_rhobs_request.cache[(NO_DATA_CLUSTER_ID,)] = (None, None)
+    assert get_cached_multi_cluster_response(digest) == b"body"
+
+    rhobs.perform_rhobs_request.cache[(NO_DATA_CLUSTER_ID,)] = rhobs_result
+    assert get_cached_multi_cluster_response(digest) is None
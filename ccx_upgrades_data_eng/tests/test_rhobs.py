@@ -1,20 +1,35 @@
 """Tests for the rhobs module."""
 
 import importlib
+import json
 import os
 import sys
+import threading
+import time
 from unittest.mock import MagicMock, patch
-from uuid import UUID
+from uuid import UUID, uuid4
 
 import pytest
 from fastapi import HTTPException
+from prometheus_client import REGISTRY
 from requests.exceptions import ConnectionError
 
+import ccx_upgrades_data_eng.rhobs as rhobs
+import ccx_upgrades_data_eng.utils as utils
+from ccx_upgrades_data_eng import deadline
+from ccx_upgrades_data_eng.auth import TokenError
+from ccx_upgrades_data_eng.config import get_settings
+from ccx_upgrades_data_eng.deadline import DeadlineExceededError
 from ccx_upgrades_data_eng.models import UpgradeRisksPredictors
 from ccx_upgrades_data_eng.rhobs import (
+    RHOBSUnavailableError,
     alerts_and_focs,
+    iter_rhobs_request_multi_cluster,
+    parse_multi_cluster_results,
     perform_rhobs_request,
+    perform_rhobs_request_chunk,
     perform_rhobs_request_multi_cluster,
+    perform_rhobs_request_with_fallback,
     update_cache_for_cluster,
 )
 from ccx_upgrades_data_eng.tests import (
@@ -25,7 +40,11 @@ from ccx_upgrades_data_eng.tests import (
     needed_env,
     needed_env_cache_enabled,
 )
-from ccx_upgrades_data_eng.utils import LoggedTTLCache
+from ccx_upgrades_data_eng.utils import (
+    CircuitOpenError,
+    CustomTTLCache,
+    InstrumentedTTLCache,
+)
 
 
 def test_alerts_and_focs():
@@ -198,7 +217,7 @@ def test_perform_rhobs_request_multi_cluster_nok(
 
     # Perform the request
     cluster_id = "34c3ecc5-624a-49a5-bab8-4fdc5e51a266"
-    result = perform_rhobs_request_multi_cluster([cluster_id])
+    result, _ = perform_rhobs_request_multi_cluster([cluster_id])
     assert result == {}
 
 
@@ -219,16 +238,61 @@ def test_perform_rhobs_request_multi_cluster_all_cached(get_session_manager_mock
 
     # Re-create perform_rhobs_request cache to use enabled TTLCache
     old_cache = perform_rhobs_request.cache
-    perform_rhobs_request.cache = LoggedTTLCache(maxsize=1, ttl=10)
+    perform_rhobs_request.cache = InstrumentedTTLCache("test_rhobs", maxsize=1, ttl=10)
     perform_rhobs_request.cache[(cluster_id,)] = predictors, "console_url"
 
-    result = perform_rhobs_request_multi_cluster([cluster_id])
+    result, _ = perform_rhobs_request_multi_cluster([cluster_id])
     assert not session_mock.get.called
     assert cluster_id in result
 
     perform_rhobs_request.cache = old_cache
 
 
+@patch.dict(os.environ, {**needed_env, "RHOBS_MULTI_CLUSTER_CHUNK_SIZE": "2"})
+@patch("ccx_upgrades_data_eng.rhobs.get_session_manager")
+def test_iter_rhobs_request_multi_cluster_chunks(get_session_manager_mock):
+    """Check the missing clusters are requested in chunks after the cached ones."""
+    get_settings.cache_clear()
+
+    rhobs_response_mock = MagicMock()
+    rhobs_response_mock.status_code = 200
+    rhobs_response_mock.json.return_value = RHOBS_EMPTY_REPONSE
+
+    session_mock = MagicMock()
+    session_mock.get.return_value = rhobs_response_mock
+
+    session_manager_mock = MagicMock()
+    session_manager_mock.get_session.return_value = session_mock
+
+    get_session_manager_mock.return_value = session_manager_mock
+
+    cached_cluster_id = UUID("34c3ecc5-624a-49a5-bab8-4fdc5e51a266")
+    predictors = UpgradeRisksPredictors(alerts=[], operator_conditions=[])
+    clusters = [
+        cached_cluster_id,
+        UUID("2b9195d4-85d4-428f-944b-4b46f08911f8"),
+        UUID("aae0ff10-9892-4572-b77f-73eb3e39825f"),
+        UUID("b0b3b9ce-d3b9-4eec-b13d-241dffdb1395"),
+    ]
+
+    old_cache = perform_rhobs_request.cache
+    perform_rhobs_request.cache = InstrumentedTTLCache("test_rhobs", maxsize=1, ttl=10)
+    perform_rhobs_request.cache[(cached_cluster_id,)] = predictors, "console_url"
+
+    chunks = list(iter_rhobs_request_multi_cluster(clusters))
+
+    perform_rhobs_request.cache = old_cache
+    get_settings.cache_clear()
+
+    assert chunks == [{cached_cluster_id: (predictors, "console_url")}, {}, {}]
+    assert session_mock.get.call_count == 2
+    queries = [
+        call.kwargs["params"]["query"] for call in session_mock.get.call_args_list
+    ]
+    assert queries[0] == alerts_and_focs(clusters[1:3])
+    assert queries[1] == alerts_and_focs(clusters[3:])
+
+
 @patch.dict(os.environ, needed_env)
 @patch("ccx_upgrades_data_eng.rhobs.get_session_manager")
 def test_perform_rhobs_request_multi_cluster_empty(get_session_manager_mock):
@@ -250,7 +314,7 @@ def test_perform_rhobs_request_multi_cluster_empty(get_session_manager_mock):
     # Perform the request
     cluster_id = "34c3ecc5-624a-49a5-bab8-4fdc5e51a266"
 
-    result = perform_rhobs_request_multi_cluster([cluster_id])
+    result, _ = perform_rhobs_request_multi_cluster([cluster_id])
     assert cluster_id not in result
 
 
@@ -281,9 +345,12 @@ def test_perform_rhobs_request_multi_cluster(get_session_manager_mock):
         uuid_missing,
     ]
 
-    cluster_predictions = perform_rhobs_request_multi_cluster(clusters)
+    cluster_predictions, queried_clusters = perform_rhobs_request_multi_cluster(
+        clusters
+    )
 
     assert len(cluster_predictions) == 2
+    assert queried_clusters == set(clusters)
     assert len(cluster_predictions[uuid_ok][0].alerts) == 1
     assert len(cluster_predictions[uuid_ok][0].operator_conditions) == 1
     assert (
@@ -312,6 +379,340 @@ def test_perform_rhobs_request_multi_cluster(get_session_manager_mock):
     )
 
 
+def rhobs_session_manager(content: bytes) -> MagicMock:
+    """Return a session manager whose RHOBS responses have the given content."""
+    rhobs_response_mock = MagicMock()
+    rhobs_response_mock.status_code = 200
+    rhobs_response_mock.content = content
+    rhobs_response_mock.json.side_effect = lambda: json.loads(content)
+
+    session_manager_mock = MagicMock()
+    session_manager_mock.get_session.return_value.get.return_value = rhobs_response_mock
+    return session_manager_mock
+
+
+@patch.dict(os.environ, {**needed_env, "RHOBS_PARSING_MIN_BYTES": "1000"})
+@patch("ccx_upgrades_data_eng.rhobs.get_session_manager")
+def test_perform_rhobs_request_chunk_parsing_pool(get_session_manager_mock):
+    """Large responses are parsed in the parsing processes with the same results."""
+    get_settings.cache_clear()
+    content = json.dumps(RHOBS_RESPONSE_MULTI_CLUSTER).encode()
+    assert len(content) > 1000
+    get_session_manager_mock.return_value = rhobs_session_manager(content)
+    clusters = [
+        UUID("34c3ecc5-624a-49a5-bab8-4fdc5e51a266"),
+        UUID("2b9195d4-85d4-428f-944b-4b46f08911f8"),
+    ]
+
+    rhobs.start_parsing_pool(1)
+    try:
+        cluster_predictions = perform_rhobs_request_chunk(clusters)
+    finally:
+        rhobs.stop_parsing_pool()
+
+    expected = parse_multi_cluster_results(
+        RHOBS_RESPONSE_MULTI_CLUSTER["data"]["result"]
+    )
+    assert cluster_predictions == expected
+    for cluster_id, (predictors, _) in cluster_predictions.items():
+        assert predictors.model_dump() == expected[cluster_id][0].model_dump()
+
+
+@patch.dict(os.environ, {**needed_env, "RHOBS_PARSING_MIN_BYTES": "1000000"})
+@patch("ccx_upgrades_data_eng.rhobs.get_session_manager")
+@patch("ccx_upgrades_data_eng.rhobs._parsing_pool")
+def test_perform_rhobs_request_chunk_small_response_inline(
+    parsing_pool_mock, get_session_manager_mock
+):
+    """Responses under RHOBS_PARSING_MIN_BYTES are parsed inline."""
+    get_settings.cache_clear()
+    content = json.dumps(RHOBS_RESPONSE_MULTI_CLUSTER).encode()
+    get_session_manager_mock.return_value = rhobs_session_manager(content)
+
+    cluster_predictions = perform_rhobs_request_chunk(
+        [UUID("34c3ecc5-624a-49a5-bab8-4fdc5e51a266")]
+    )
+
+    assert len(cluster_predictions) == 2
+    parsing_pool_mock.submit.assert_not_called()
+
+
+@patch.dict(os.environ, {**needed_env, "RHOBS_MAX_IN_FLIGHT_CLUSTERS": "1"})
+@patch("ccx_upgrades_data_eng.rhobs.get_session_manager")
+def test_perform_rhobs_request_chunk_limiter(get_session_manager_mock):
+    """The RHOBS queries wait for the limiter and their wait is observed."""
+    get_settings.cache_clear()
+    rhobs.get_rhobs_limiter.cache_clear()
+    content = json.dumps(RHOBS_RESPONSE_MULTI_CLUSTER).encode()
+    get_session_manager_mock.return_value = rhobs_session_manager(content)
+    count = REGISTRY.get_sample_value("ccx_upgrades_rhobs_queue_time_count") or 0
+
+    try:
+        limiter = rhobs.get_rhobs_limiter()
+        perform_rhobs_request_chunk([UUID("34c3ecc5-624a-49a5-bab8-4fdc5e51a266")])
+    finally:
+        rhobs.get_rhobs_limiter.cache_clear()
+
+    assert REGISTRY.get_sample_value("ccx_upgrades_rhobs_queue_time_count") == count + 1
+    assert limiter.in_use == 0
+
+
+@patch.dict(
+    os.environ,
+    {
+        **needed_env,
+        "RHOBS_MAX_IN_FLIGHT_CLUSTERS": "1",
+        "RHOBS_MAX_QUEUE_TIME": "0.01",
+        "CIRCUIT_BREAKER_ENABLED": "1",
+        "CIRCUIT_BREAKER_MIN_CALLS": "1",
+    },
+)
+@patch("ccx_upgrades_data_eng.rhobs.get_session_manager")
+def test_perform_rhobs_request_chunk_limiter_sheds(get_session_manager_mock):
+    """A RHOBS query waiting too long for the limiter is shed with a 503."""
+    get_settings.cache_clear()
+    rhobs.get_rhobs_limiter.cache_clear()
+    utils.get_circuit_breaker.cache_clear()
+    content = json.dumps(RHOBS_RESPONSE_MULTI_CLUSTER).encode()
+    get_session_manager_mock.return_value = rhobs_session_manager(content)
+
+    try:
+        limiter = rhobs.get_rhobs_limiter()
+        limiter.acquire(1)
+        with pytest.raises(HTTPException) as ex:
+            perform_rhobs_request_chunk([UUID("34c3ecc5-624a-49a5-bab8-4fdc5e51a266")])
+        # Not counted as a failure of RHOBS
+        assert utils.get_circuit_breaker("rhobs").state == utils.CircuitBreaker.CLOSED
+    finally:
+        rhobs.get_rhobs_limiter.cache_clear()
+        utils.get_circuit_breaker.cache_clear()
+
+    assert ex.value.status_code == 503
+    get_session_manager_mock.return_value.get_session.return_value.get.assert_not_called()
+
+
+@patch.dict(
+    os.environ,
+    {**needed_env, "RHOBS_HEDGING_ENABLED": "1", "RHOBS_HEDGE_MIN_DELAY": "0.01"},
+)
+@patch("ccx_upgrades_data_eng.rhobs.get_session_manager")
+def test_perform_rhobs_request_chunk_hedged(get_session_manager_mock):
+    """A slow RHOBS query is hedged and the first response is used."""
+    get_settings.cache_clear()
+    rhobs.get_rhobs_hedger.cache_clear()
+    content = json.dumps(RHOBS_RESPONSE_MULTI_CLUSTER).encode()
+    session_manager_mock = rhobs_session_manager(content)
+    get_session_manager_mock.return_value = session_manager_mock
+    fast_response = session_manager_mock.get_session.return_value.get.return_value
+    slow_response = MagicMock()
+    release = threading.Event()
+
+    def get(*args, **kwargs):
+        if session_get.call_count == 1:
+            release.wait(timeout=5)
+            return slow_response
+        return fast_response
+
+    session_get = session_manager_mock.get_session.return_value.get
+    session_get.side_effect = get
+
+    try:
+        cluster_predictions = perform_rhobs_request_chunk(
+            [UUID("34c3ecc5-624a-49a5-bab8-4fdc5e51a266")]
+        )
+    finally:
+        release.set()
+        rhobs.get_rhobs_hedger.cache_clear()
+
+    assert len(cluster_predictions) == 2
+    assert session_get.call_count == 2
+    slow_response.json.assert_not_called()
+
+
+@patch.dict(os.environ, {**needed_env, "RETRY_ENABLED": "1"})
+@patch("ccx_upgrades_data_eng.rhobs.get_session_manager")
+@patch("time.sleep", return_value=None)
+def test_perform_rhobs_request_chunk_retried(mock_sleep, get_session_manager_mock):
+    """The RHOBS queries failing with a 503 are retried."""
+    get_settings.cache_clear()
+    utils.get_retry_policy.cache_clear()
+    content = json.dumps(RHOBS_RESPONSE_MULTI_CLUSTER).encode()
+    session_manager_mock = rhobs_session_manager(content)
+    get_session_manager_mock.return_value = session_manager_mock
+    session_get = session_manager_mock.get_session.return_value.get
+    session_get.side_effect = [MagicMock(status_code=503), session_get.return_value]
+
+    try:
+        cluster_predictions = perform_rhobs_request_chunk(
+            [UUID("34c3ecc5-624a-49a5-bab8-4fdc5e51a266")]
+        )
+    finally:
+        utils.get_retry_policy.cache_clear()
+
+    assert len(cluster_predictions) == 2
+    assert session_get.call_count == 2
+    mock_sleep.assert_called_once()
+
+
+@patch.dict(os.environ, needed_env)
+@patch("ccx_upgrades_data_eng.rhobs.get_session_manager")
+def test_perform_rhobs_request_deadline_expired(get_session_manager_mock):
+    """No query is sent once the request deadline expired, and a 504 is returned."""
+    try:
+        deadline.start_deadline(-1)
+        with pytest.raises(DeadlineExceededError) as ex:
+            perform_rhobs_request(uuid4())
+    finally:
+        deadline.start_deadline(None)
+
+    assert ex.value.status_code == 504
+    get_session_manager_mock.return_value.get_session.return_value.get.assert_not_called()
+
+
+@patch.dict(os.environ, needed_env)
+@patch("ccx_upgrades_data_eng.rhobs.perform_rhobs_request_chunk")
+def test_perform_rhobs_request_multi_cluster_deadline(perform_rhobs_request_chunk_mock):
+    """The cached clusters are returned if the deadline expires."""
+    cached_cluster = uuid4()
+    result = (UpgradeRisksPredictors(alerts=[], operator_conditions=[]), "url")
+    perform_rhobs_request_chunk_mock.side_effect = DeadlineExceededError()
+
+    with patch.object(perform_rhobs_request, "cache", {(cached_cluster,): result}):
+        clusters_results, queried_clusters = perform_rhobs_request_multi_cluster(
+            [cached_cluster, uuid4()]
+        )
+
+    assert clusters_results == {cached_cluster: result}
+    assert queried_clusters == {cached_cluster}
+
+
+@patch.dict(os.environ, {**needed_env, "RHOBS_MULTI_CLUSTER_CHUNK_SIZE": "1"})
+@patch("ccx_upgrades_data_eng.rhobs.perform_rhobs_request_chunk")
+def test_perform_rhobs_request_multi_cluster_single_query(
+    perform_rhobs_request_chunk_mock,
+):
+    """The missing clusters are requested in a single query, whatever the chunk size."""
+    get_settings.cache_clear()
+    clusters = [uuid4(), uuid4(), uuid4()]
+    perform_rhobs_request_chunk_mock.return_value = {}
+
+    perform_rhobs_request_multi_cluster(clusters)
+    get_settings.cache_clear()
+
+    perform_rhobs_request_chunk_mock.assert_called_once_with(clusters)
+
+
+@patch.dict(os.environ, needed_env)
+@patch("ccx_upgrades_data_eng.rhobs.get_session_manager")
+@patch("ccx_upgrades_data_eng.rhobs.get_circuit_breaker")
+def test_circuit_open_serves_stale_results(
+    get_circuit_breaker_mock, get_session_manager_mock
+):
+    """While the circuit breaker is open, the stale results are served if kept."""
+    get_circuit_breaker_mock.return_value.before_call.side_effect = CircuitOpenError()
+    stale_cluster = uuid4()
+    missing_cluster = uuid4()
+    stale_result = (
+        UpgradeRisksPredictors(alerts=[], operator_conditions=[]),
+        "https://console.com",
+    )
+    get_settings.cache_clear()
+    with patch.dict(os.environ, needed_env_cache_enabled):
+        cache = CustomTTLCache("test_rhobs_stale", ttl=0.05, keep_stale=True)
+    get_settings.cache_clear()
+    cache[(stale_cluster,)] = stale_result
+    time.sleep(0.1)
+
+    with patch.object(perform_rhobs_request, "cache", cache):
+        # The cached function fails, so the stale result is not cached again
+        with pytest.raises(CircuitOpenError):
+            perform_rhobs_request(stale_cluster)
+
+        assert perform_rhobs_request_with_fallback(stale_cluster) is stale_result
+        assert cache.peek((stale_cluster,)) is None
+        with pytest.raises(HTTPException) as ex:
+            perform_rhobs_request_with_fallback(missing_cluster)
+        assert ex.value.status_code == 503
+
+        assert perform_rhobs_request_chunk([stale_cluster]) == {
+            stale_cluster: stale_result
+        }
+        with pytest.raises(RHOBSUnavailableError) as ex:
+            perform_rhobs_request_chunk([stale_cluster, missing_cluster])
+        assert ex.value.status_code == 503
+        assert ex.value.stale_results == {stale_cluster: stale_result}
+
+    get_session_manager_mock.return_value.get_session.return_value.get.assert_not_called()
+
+
+@patch.dict(os.environ, needed_env)
+@patch("ccx_upgrades_data_eng.rhobs.get_session_manager")
+@patch("ccx_upgrades_data_eng.rhobs.get_circuit_breaker")
+def test_circuit_open_multi_cluster_skips_clusters_without_stale_results(
+    get_circuit_breaker_mock, get_session_manager_mock
+):
+    """While the circuit breaker is open, only the stale clusters count as queried."""
+    get_circuit_breaker_mock.return_value.before_call.side_effect = CircuitOpenError()
+    stale_cluster = uuid4()
+    missing_cluster = uuid4()
+    stale_result = (
+        UpgradeRisksPredictors(alerts=[], operator_conditions=[]),
+        "https://console.com",
+    )
+    get_settings.cache_clear()
+    with patch.dict(os.environ, needed_env_cache_enabled):
+        cache = CustomTTLCache("test_rhobs_stale_multi", ttl=0.05, keep_stale=True)
+    get_settings.cache_clear()
+    cache[(stale_cluster,)] = stale_result
+    time.sleep(0.1)
+
+    with patch.object(perform_rhobs_request, "cache", cache):
+        results, queried_clusters = perform_rhobs_request_multi_cluster(
+            [stale_cluster, missing_cluster]
+        )
+        assert results == {stale_cluster: stale_result}
+        assert queried_clusters == {stale_cluster}
+
+        chunks = iter_rhobs_request_multi_cluster([stale_cluster, missing_cluster])
+        assert next(chunks) == {stale_cluster: stale_result}
+        with pytest.raises(RHOBSUnavailableError):
+            next(chunks)
+
+
+@patch.dict(os.environ, needed_env)
+@patch("ccx_upgrades_data_eng.rhobs.get_session_manager")
+def test_perform_rhobs_request_sso_error(get_session_manager_mock):
+    """A 503 is returned if the SSO token needed by the query cannot be obtained."""
+    get_session_manager_mock.return_value.get_session.side_effect = TokenError("test")
+
+    with pytest.raises(HTTPException) as ex:
+        perform_rhobs_request(uuid4())
+
+    assert ex.value.status_code == 503
+    assert ex.value.detail == "Unable to update SSO token"
+
+
+def test_needs_rhobs_query():
+    """RHOBS is only needed for the clusters not cached, with or without data."""
+    cached_cluster = uuid4()
+    no_data_cluster = uuid4()
+    cache = InstrumentedTTLCache("test_needs_rhobs_query", maxsize=10, ttl=10)
+    cache[(cached_cluster,)] = (
+        UpgradeRisksPredictors(alerts=[], operator_conditions=[]),
+        "https://console.com",
+    )
+    cache[(no_data_cluster,)] = (None, None)
+
+    with patch.object(perform_rhobs_request, "cache", cache):
+        assert not rhobs.needs_rhobs_query([cached_cluster])
+        assert rhobs.needs_rhobs_query([cached_cluster, uuid4()])
+        assert not rhobs.needs_rhobs_query([cached_cluster, no_data_cluster])
+
+    assert REGISTRY.get_sample_value(
+        "ccx_upgrades_cache_hits_total", {"cache": "test_needs_rhobs_query"}
+    ) in (None, 0)
+
+
 def test_update_cache_for_cluster():
     """Check if the RHOBS cache is updated properly."""
     cluster_id = "dc549b77-1913-46b2-8be6-088b54fb4da6"
@@ -319,7 +720,9 @@ def test_update_cache_for_cluster():
     expected_console_url = "https://the-console-url.com"
 
     old_cache = perform_rhobs_request.cache
-    perform_rhobs_request.cache = LoggedTTLCache(maxsize=1, ttl=1000000)
+    perform_rhobs_request.cache = InstrumentedTTLCache(
+        "test_rhobs", maxsize=1, ttl=1000000
+    )
 
     # Update the cache
     update_cache_for_cluster(cluster_id, (expected_predictors, expected_console_url))
@@ -358,7 +761,7 @@ def test_rhobs_result_none(get_session_manager_mock):
         uuid_missing,
     ]
 
-    cluster_predictions = perform_rhobs_request_multi_cluster(clusters)
+    cluster_predictions, _ = perform_rhobs_request_multi_cluster(clusters)
 
     assert len(cluster_predictions) == 0
 
@@ -371,6 +774,7 @@ def test_perform_rhobs_request_multi_cluster_after_single_cluster_empty(
     """Check RHOBS multi cluster response after cached no data single cluster response."""
     # RHOBS functions need to be reloaded because cache
     # has to be initialized with correct env variables
+    get_settings.cache_clear()
     importlib.reload(sys.modules["ccx_upgrades_data_eng.rhobs"])
     from ccx_upgrades_data_eng.rhobs import (
         perform_rhobs_request,
@@ -406,5 +810,5 @@ def test_perform_rhobs_request_multi_cluster_after_single_cluster_empty(
     assert cached_console_url is None
 
     # Perform the multi cluster RHOBS request using cached result
-    result = perform_rhobs_request_multi_cluster([cluster_id])
+    result, _ = perform_rhobs_request_multi_cluster([cluster_id])
     assert cluster_id not in result
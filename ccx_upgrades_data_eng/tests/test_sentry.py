@@ -0,0 +1,84 @@
+"""Tests for the sentry module."""
+
+import os
+from unittest.mock import patch
+
+import sentry_sdk
+
+from ccx_upgrades_data_eng import sentry
+
+
+def sampling_context(method, path, parent_sampled=None):
+    """Build the sampling context Sentry passes to the traces sampler."""
+    return {
+        "asgi_scope": {"type": "http", "method": method, "path": path},
+        "parent_sampled": parent_sampled,
+    }
+
+
+@patch.dict(os.environ, {"SENTRY_TRACES_SAMPLE_RATE": "0.25"})
+def test_traces_sampler_prediction_endpoints():
+    """Only the prediction endpoints are sampled, with the configured rate."""
+    cluster_path = (
+        "/cluster/34c3ecc5-624a-49a5-bab8-4fdc5e51a266/upgrade-risks-prediction"
+    )
+    assert sentry.traces_sampler(sampling_context("GET", cluster_path)) == 0.25
+    assert (
+        sentry.traces_sampler(sampling_context("POST", "/upgrade-risks-prediction"))
+        == 0.25
+    )
+
+    assert sentry.traces_sampler(sampling_context("GET", "/metrics")) == 0
+    assert (
+        sentry.traces_sampler(
+            sampling_context("POST", "/upgrade-risks-prediction/jobs")
+        )
+        == 0
+    )
+    assert sentry.traces_sampler({}) == 0
+
+
+@patch.dict(os.environ, {"SENTRY_TRACES_SAMPLE_RATE": "0.25"})
+def test_traces_sampler_keeps_parent_decision():
+    """The sampling decision of the incoming trace is kept."""
+    path = "/upgrade-risks-prediction"
+    assert sentry.traces_sampler(sampling_context("POST", path, True)) == 1
+    assert sentry.traces_sampler(sampling_context("POST", path, False)) == 0
+
+
+def test_get_traces_sample_rate():
+    """The sample rate is read from SENTRY_TRACES_SAMPLE_RATE and disabled by default."""
+    with patch.dict(os.environ, {}, clear=True):
+        assert sentry.get_traces_sample_rate() == 0
+
+    with patch.dict(os.environ, {"SENTRY_TRACES_SAMPLE_RATE": "1"}):
+        assert sentry.get_traces_sample_rate() == 1
+
+
+def test_get_traces_sample_rate_invalid():
+    """An invalid sample rate disables performance monitoring instead of failing."""
+    for value in ("abc", "-0.5", "2", "nan"):
+        with patch.dict(os.environ, {"SENTRY_TRACES_SAMPLE_RATE": value}):
+            assert sentry.get_traces_sample_rate() == 0
+
+
+@patch("ccx_upgrades_data_eng.sentry._performance_enabled", True)
+def test_start_span_in_transaction():
+    """A child span is only started inside a transaction."""
+    with sentry.start_span("rhobs.query", "RHOBS query"):
+        assert sentry_sdk.get_current_span() is None
+
+    with (
+        sentry_sdk.start_transaction(name="test", op="http.server"),
+        sentry.start_span("rhobs.query", "RHOBS query"),
+    ):
+        assert sentry_sdk.get_current_span().op == "rhobs.query"
+
+
+def test_start_span_performance_disabled():
+    """No span is started if performance monitoring is disabled."""
+    with (
+        sentry_sdk.start_transaction(name="test", op="http.server") as transaction,
+        sentry.start_span("rhobs.query", "RHOBS query"),
+    ):
+        assert sentry_sdk.get_current_span() is transaction
@@ -1,17 +1,29 @@
 """Tests for SSO refresh logic functionality."""
 
 import os
+from datetime import datetime
 from unittest.mock import AsyncMock, MagicMock, patch
+from uuid import uuid4
 
 import pytest
-from fastapi import Request
+from fastapi import HTTPException, Request
+from fastapi.testclient import TestClient
 
+from ccx_upgrades_data_eng import rhobs
 from ccx_upgrades_data_eng.auth import SessionManagerError, TokenError
 from ccx_upgrades_data_eng.main import (
+    app,
+    ensure_sso_token,
     get_session_and_refresh_token,
-    refresh_sso_token,
+    prepare_request,
+)
+from ccx_upgrades_data_eng.models import (
+    UpgradeApiResponse,
+    UpgradeRisksPredictors,
+    UpgradeRisksPredictorsWithURLs,
 )
 from ccx_upgrades_data_eng.tests import needed_env
+from ccx_upgrades_data_eng.utils import InstrumentedTTLCache
 
 
 # Mock for the call_next function in middleware
@@ -20,25 +32,35 @@ async def mock_call_next(request):
     return "next called"
 
 
+@pytest.mark.asyncio
+@patch.dict(os.environ, needed_env)
+@patch("ccx_upgrades_data_eng.main.get_session_manager")
+async def test_prepare_request_does_not_refresh_token(get_session_manager_mock):
+    """Check that the middleware doesn't need SSO to process the request."""
+    resp = await prepare_request(Request({"type": "http"}), mock_call_next)
+
+    assert not get_session_manager_mock.called
+    assert resp == "next called"
+
+
 @pytest.mark.asyncio
 @patch.dict(os.environ, needed_env)
 @patch("ccx_upgrades_data_eng.main.get_session_manager")
 @patch("ccx_upgrades_data_eng.utils.asyncio.sleep", new_callable=AsyncMock)
 @patch("ccx_upgrades_data_eng.utils.time.sleep", return_value=None)
-async def test_refresh_sso_token_session_ok(
+async def test_ensure_sso_token_session_ok(
     time_sleep_mock, asyncio_sleep_mock, get_session_manager_mock
 ):
-    """Check that refresh_sso_token tries to get the session and refresh the token."""
+    """Check that ensure_sso_token tries to get the session and refresh the token."""
     session_manager_mock = MagicMock()
     get_session_manager_mock.return_value = session_manager_mock
 
-    resp = await refresh_sso_token(Request({"type": "http"}), mock_call_next)
+    await ensure_sso_token()
 
     assert get_session_manager_mock.called
     assert session_manager_mock.refresh_token.called
     assert not time_sleep_mock.called
     assert not asyncio_sleep_mock.called
-    assert resp == "next called"
 
 
 @pytest.mark.asyncio
@@ -46,19 +68,20 @@ async def test_refresh_sso_token_session_ok(
 @patch("ccx_upgrades_data_eng.main.get_session_manager")
 @patch("ccx_upgrades_data_eng.utils.asyncio.sleep", new_callable=AsyncMock)
 @patch("ccx_upgrades_data_eng.utils.time.sleep", return_value=None)
-async def test_refresh_sso_token_session_manager_exception(
+async def test_ensure_sso_token_session_manager_exception(
     time_sleep_mock, asyncio_sleep_mock, get_session_manager_mock
 ):
-    """Check that refresh_sso_token handles SessionManagerError."""
+    """Check that ensure_sso_token handles SessionManagerError."""
     get_session_manager_mock.side_effect = SessionManagerError("test")
 
-    resp = await refresh_sso_token(Request({"type": "http"}), mock_call_next)
+    with pytest.raises(HTTPException) as ex:
+        await ensure_sso_token()
 
     assert get_session_manager_mock.called
     assert not time_sleep_mock.called
     assert asyncio_sleep_mock.called
-    assert resp.status_code == 503
-    assert resp.body == b'"Unable to initialize SSO session"'
+    assert ex.value.status_code == 503
+    assert ex.value.detail == "Unable to initialize SSO session"
 
 
 @pytest.mark.asyncio
@@ -66,22 +89,94 @@ async def test_refresh_sso_token_session_manager_exception(
 @patch("ccx_upgrades_data_eng.main.get_session_manager")
 @patch("ccx_upgrades_data_eng.utils.asyncio.sleep", new_callable=AsyncMock)
 @patch("ccx_upgrades_data_eng.utils.time.sleep", return_value=None)
-async def test_refresh_sso_token_token_exception(
+async def test_ensure_sso_token_token_exception(
     time_sleep_mock, asyncio_sleep_mock, get_session_manager_mock
 ):
-    """Check that refresh_sso_token handles TokenError."""
+    """Check that ensure_sso_token handles TokenError."""
     session_manager_mock = MagicMock()
     session_manager_mock.refresh_token.side_effect = TokenError("test")
     get_session_manager_mock.return_value = session_manager_mock
 
-    resp = await refresh_sso_token(Request({"type": "http"}), mock_call_next)
+    with pytest.raises(HTTPException) as ex:
+        await ensure_sso_token()
 
     assert get_session_manager_mock.called
     assert session_manager_mock.refresh_token.called
     assert not time_sleep_mock.called
     assert asyncio_sleep_mock.called
-    assert resp.status_code == 503
-    assert resp.body == b'"Unable to update SSO token"'
+    assert ex.value.status_code == 503
+    assert ex.value.detail == "Unable to update SSO token"
+
+
+@patch.dict(os.environ, needed_env)
+@patch("ccx_upgrades_data_eng.main.get_session_manager")
+@patch("ccx_upgrades_data_eng.main.get_filled_inference_with_fallback")
+@patch("ccx_upgrades_data_eng.main.perform_rhobs_request_with_fallback")
+@patch("ccx_upgrades_data_eng.utils.asyncio.sleep", new_callable=AsyncMock)
+def test_cached_prediction_served_without_sso(
+    asyncio_sleep_mock,
+    perform_rhobs_request_mock,
+    get_filled_inference_for_predictors_mock,
+    get_session_manager_mock,
+):
+    """A prediction whose RHOBS data is cached is served while SSO is down."""
+    get_session_manager_mock.side_effect = SessionManagerError("test")
+    cached_cluster = uuid4()
+    predictors = UpgradeRisksPredictors(alerts=[], operator_conditions=[])
+    perform_rhobs_request_mock.return_value = (predictors, "https://console_url.com")
+    get_filled_inference_for_predictors_mock.return_value = UpgradeApiResponse(
+        upgrade_recommended=True,
+        upgrade_risks_predictors=UpgradeRisksPredictorsWithURLs(
+            alerts=[], operator_conditions=[]
+        ),
+        last_checked_at=datetime.now(),
+    )
+    cache = InstrumentedTTLCache("test_cache_first", maxsize=10, ttl=100)
+    cache[(cached_cluster,)] = (predictors, "https://console_url.com")
+
+    client = TestClient(app)
+    with patch.object(rhobs.perform_rhobs_request, "cache", cache):
+        response = client.get(f"/cluster/{cached_cluster}/upgrade-risks-prediction")
+        assert response.status_code == 200
+        assert not get_session_manager_mock.called
+
+        response = client.get(f"/cluster/{uuid4()}/upgrade-risks-prediction")
+        assert response.status_code == 503
+        perform_rhobs_request_mock.assert_called_once()
+        assert response.json() == {"detail": "Unable to initialize SSO session"}
+
+
+@patch.dict(os.environ, needed_env)
+@patch("ccx_upgrades_data_eng.main.get_session_manager")
+@patch("ccx_upgrades_data_eng.rhobs.get_session_manager")
+@patch("ccx_upgrades_data_eng.main.perform_rhobs_request_with_fallback")
+def test_cached_no_data_cluster_served_without_sso(
+    perform_rhobs_request_mock,
+    rhobs_get_session_manager_mock,
+    get_session_manager_mock,
+):
+    """A cluster cached without RHOBS data is reported so while SSO is down."""
+    get_session_manager_mock.side_effect = SessionManagerError("test")
+    no_data_cluster = uuid4()
+    perform_rhobs_request_mock.return_value = (None, None)
+    cache = InstrumentedTTLCache("test_cache_no_data", maxsize=10, ttl=100)
+    cache[(no_data_cluster,)] = (None, None)
+
+    client = TestClient(app)
+    with patch.object(rhobs.perform_rhobs_request, "cache", cache):
+        response = client.get(f"/cluster/{no_data_cluster}/upgrade-risks-prediction")
+        assert response.status_code == 404
+
+        response = client.post(
+            "/upgrade-risks-prediction", json={"clusters": [str(no_data_cluster)]}
+        )
+        assert response.status_code == 200
+        [prediction] = response.json()["predictions"]
+        assert prediction["cluster_id"] == str(no_data_cluster)
+        assert prediction["prediction_status"] == "No data for the cluster"
+
+    assert not get_session_manager_mock.called
+    assert not rhobs_get_session_manager_mock.called
 
 
 @pytest.mark.asyncio
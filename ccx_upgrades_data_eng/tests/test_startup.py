@@ -0,0 +1,70 @@
+"""Startup time benchmark of the service."""
+
+import os
+import re
+import subprocess
+import sys
+
+from ccx_upgrades_data_eng.tests import needed_env
+
+# Modules only needed when their integration is enabled
+OPTIONAL_MODULES = ("boto3", "watchtower", "sentry_sdk", "opentelemetry")
+
+# Maximum time to import the service on top of fastapi, relative to the time to
+# import fastapi itself in the same interpreter, so it does not depend on the
+# speed of the machine. It is about 0.65, so the budget catches a heavy import
+# creeping back in.
+IMPORT_TIME_BUDGET = float(os.environ.get("IMPORT_TIME_BUDGET", 1.5))
+
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def get_import_times() -> dict[str, float]:
+    """Import the service in a new interpreter and return the cumulative import times.
+
+    The times are in seconds, by module, as reported by -X importtime. fastapi
+    is imported first, so its time is not included in the one of the service.
+    """
+    env = {"PATH": os.environ.get("PATH", ""), **needed_env}
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            "import fastapi; import ccx_upgrades_data_eng.main",
+        ],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    import_times = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            import_times[match.group(4)] = int(match.group(2)) / 1_000_000
+
+    return import_times
+
+
+def test_startup_skips_disabled_integrations():
+    """Importing the service does not import the integrations that are not enabled."""
+    imported_optional_modules = [
+        module
+        for module in get_import_times()
+        if module.split(".")[0] in OPTIONAL_MODULES
+    ]
+    assert imported_optional_modules == []
+
+
+def test_startup_time():
+    """Importing the service stays in budget, relative to the import of fastapi."""
+    import_times = get_import_times()
+    fastapi_time = import_times["fastapi"]
+    startup_time = import_times["ccx_upgrades_data_eng.main"]
+    assert startup_time < IMPORT_TIME_BUDGET * fastapi_time, (
+        f"importing the service took {startup_time:.2f}s, over "
+        f"{IMPORT_TIME_BUDGET} times the {fastapi_time:.2f}s import of fastapi"
+    )
@@ -0,0 +1,110 @@
+"""Tests for the tracing module."""
+
+import os
+from datetime import timedelta
+from unittest.mock import MagicMock, patch
+from uuid import uuid4
+
+import pytest
+from fastapi.testclient import TestClient
+
+from ccx_upgrades_data_eng import metrics, tracing
+from ccx_upgrades_data_eng.config import get_settings
+from ccx_upgrades_data_eng.examples import EXAMPLE_PREDICTORS
+from ccx_upgrades_data_eng.main import app
+from ccx_upgrades_data_eng.tests import needed_env
+
+pytest.importorskip("opentelemetry.sdk")
+
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor  # noqa: E402
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import (  # noqa: E402
+    InMemorySpanExporter,
+)
+
+
+@pytest.fixture
+def span_exporter():
+    """Enable tracing exporting the spans to memory."""
+    exporter = InMemorySpanExporter()
+    tracing.init_tracing(True, SimpleSpanProcessor(exporter))
+    yield exporter
+    tracing.shutdown_tracing()
+
+
+def test_helpers_do_nothing_when_disabled():
+    """No span, headers nor exemplars are produced if tracing is disabled."""
+    with tracing.start_span("test") as span:
+        assert span is None
+
+    tracing.set_span_attribute(span, "key", "value")
+    assert tracing.inject_trace_headers({}) == {}
+    assert tracing.get_exemplar() is None
+
+
+def test_exemplar_and_headers_from_current_span(span_exporter):
+    """The current trace is propagated in the headers and the exemplars."""
+    with tracing.start_span("test") as span:
+        trace_id = format(span.get_span_context().trace_id, "032x")
+        assert tracing.get_exemplar() == {"trace_id": trace_id}
+        assert trace_id in tracing.inject_trace_headers({})["traceparent"]
+
+    assert [span.name for span in span_exporter.get_finished_spans()] == ["test"]
+
+
+@patch.dict(os.environ, needed_env)
+@patch("ccx_upgrades_data_eng.main.get_session_manager")
+@patch("ccx_upgrades_data_eng.rhobs.get_session_manager")
+@patch("requests.get")
+def test_single_cluster_request_spans(
+    inference_get_mock,
+    rhobs_session_manager_mock,
+    main_session_manager_mock,
+    span_exporter,
+):
+    """The SSO, RHOBS, cache and inference spans belong to the request trace."""
+    rhobs_response = MagicMock(status_code=200, content=b"0123456789")
+    rhobs_response.json.return_value = {
+        "data": {
+            "result": [
+                {"metric": {"__name__": "console_url", "url": "https://console.com"}}
+            ]
+        }
+    }
+    rhobs_response.elapsed = timedelta(seconds=0.1)
+    session_manager_mock = MagicMock()
+    session_manager_mock.get_session.return_value.get.return_value = rhobs_response
+    rhobs_session_manager_mock.return_value = session_manager_mock
+
+    inference_get_mock.return_value = MagicMock(status_code=200)
+    inference_get_mock.return_value.json.return_value = {
+        "upgrade_risks_predictors": EXAMPLE_PREDICTORS
+    }
+
+    get_settings.cache_clear()
+    client = TestClient(app)
+    cluster_id = uuid4()  # not cached by other tests
+    response = client.get(f"/cluster/{cluster_id}/upgrade-risks-prediction")
+    assert response.status_code == 200, response.text
+
+    spans = {span.name: span for span in span_exporter.get_finished_spans()}
+    request_span = spans["GET /cluster/{cluster_id}/upgrade-risks-prediction"]
+    assert request_span.attributes["http.response.status_code"] == 200
+    for name in (
+        "sso.token_refresh",
+        "rhobs.query",
+        "inference.request",
+        "cache.lookup",
+    ):
+        assert spans[name].context.trace_id == request_span.context.trace_id
+
+    assert spans["rhobs.query"].attributes["rhobs.cluster_count"] == 1
+    assert spans["rhobs.query"].attributes["rhobs.response_bytes"] == 10
+    assert spans["cache.lookup"].attributes["cache.hit"] is False
+
+    trace_id = format(request_span.context.trace_id, "032x")
+    headers = inference_get_mock.call_args.kwargs["headers"]
+    assert trace_id in headers["traceparent"]
+
+    # The histograms link to the trace in the OpenMetrics format
+    content, _ = metrics.generate_metrics("application/openmetrics-text")
+    assert f'trace_id="{trace_id}"' in content.decode()
@@ -1,27 +1,689 @@
 """Tests for utils module."""
 
+import asyncio
+import os
+import threading
+import time
 from random import seed
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
+import requests
+from cachetools import cached
+from prometheus_client import REGISTRY
 
 import ccx_upgrades_data_eng.utils as utils
+from ccx_upgrades_data_eng import deadline
+from ccx_upgrades_data_eng.config import get_settings
+from ccx_upgrades_data_eng.models import Alert, UpgradeRisksPredictors
+from ccx_upgrades_data_eng.tests import needed_env_cache_enabled
 
 
 # ----------------------------------------------------------------------
-# Tests for LoggedTTLCache
+# Tests for InstrumentedTTLCache
 # ----------------------------------------------------------------------
-@patch("ccx_upgrades_data_eng.utils.logger")
-def test_logged_ttl_cache_popitem(logger_mock):
-    """Test the LoggedTTLCache class."""
-    cache = utils.LoggedTTLCache(maxsize=1, ttl=10)
+def get_cache_metric(metric, cache_name):
+    """Return the value of a cache metric for the given cache."""
+    return REGISTRY.get_sample_value(metric, {"cache": cache_name}) or 0
+
+
+def test_instrumented_ttl_cache_hits_and_misses():
+    """Reads through cached and get are counted as hits or misses."""
+    cache = utils.InstrumentedTTLCache("test_hits", maxsize=10, ttl=100)
+
+    @cached(cache=cache)
+    def double(value):
+        return value * 2
+
+    assert double(1) == 2
+    assert double(1) == 2
+    assert cache.get(2) is None
+    assert cache.get((1,)) == 2
+    assert cache.pop((1,)) == 2
+
+    assert get_cache_metric("ccx_upgrades_cache_hits_total", "test_hits") == 2
+    assert get_cache_metric("ccx_upgrades_cache_misses_total", "test_hits") == 2
+    assert get_cache_metric("ccx_upgrades_cache_size", "test_hits") == 0
+
+
+def test_instrumented_ttl_cache_evictions_and_expirations():
+    """Evicted and expired items are counted and the size gauges updated."""
+    timer = MagicMock(return_value=0)
+    cache = utils.InstrumentedTTLCache("test_evictions", maxsize=2, ttl=10, timer=timer)
 
-    cache[0] = 0
-    key, value = cache.popitem()
+    cache[1] = 1
+    cache[2] = 2
+    assert get_cache_metric("ccx_upgrades_cache_fill_ratio", "test_evictions") == 1
 
-    assert key == 0
-    assert value == 0
-    assert logger_mock.debug.called
+    cache[3] = 3
+    assert get_cache_metric("ccx_upgrades_cache_evictions_total", "test_evictions") == 1
+    assert get_cache_metric("ccx_upgrades_cache_size", "test_evictions") == 2
+
+    timer.return_value = 20
+    cache.expire()
+    assert (
+        get_cache_metric("ccx_upgrades_cache_expirations_total", "test_evictions") == 2
+    )
+    assert get_cache_metric("ccx_upgrades_cache_size", "test_evictions") == 0
+    assert get_cache_metric("ccx_upgrades_cache_fill_ratio", "test_evictions") == 0
+    assert (
+        get_cache_metric(
+            "ccx_upgrades_cache_expirations_per_sweep_sum", "test_evictions"
+        )
+        == 2
+    )
+
+
+def test_instrumented_ttl_cache_ttl_jitter():
+    """The items added together expire at different times within the jitter."""
+    seed(0)
+    timer = MagicMock(return_value=0)
+    cache = utils.InstrumentedTTLCache(
+        "test_jitter", maxsize=100, ttl=10, ttl_jitter=0.5, timer=timer
+    )
+    for i in range(100):
+        cache[i] = i
+
+    timer.return_value = 5
+    assert not cache.expire()
+
+    timer.return_value = 7.5
+    assert 0 < len(cache.expire()) < 100
+
+    timer.return_value = 10
+    assert cache.expire()
+    assert len(cache) == 0
+    assert (
+        get_cache_metric(
+            "ccx_upgrades_cache_expirations_per_sweep_count", "test_jitter"
+        )
+        == 2
+    )
+
+
+def test_instrumented_ttl_cache_thread_safe():
+    """The cache can be used from several threads at the same time."""
+    cache = utils.InstrumentedTTLCache(
+        "test_threads", maxsize=20, ttl=0.001, ttl_jitter=0.5
+    )
+    errors = []
+
+    def use_cache(offset):
+        try:
+            for i in range(2000):
+                key = (offset + i) % 50
+                cache[key] = i
+                cache.get(key)
+                cache.pop((key + 1) % 50, None)
+                len(cache)
+        except Exception as ex:
+            errors.append(ex)
+
+    threads = [threading.Thread(target=use_cache, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+
+
+# ----------------------------------------------------------------------
+# Tests for CustomTTLCache
+# ----------------------------------------------------------------------
+def test_custom_ttl_cache_size_split_between_workers():
+    """Each worker gets its share of CACHE_SIZE."""
+    get_settings.cache_clear()
+    with patch.dict(os.environ, needed_env_cache_enabled):
+        assert utils.CustomTTLCache("test_workers").maxsize == 10
+
+    get_settings.cache_clear()
+    with patch.dict(os.environ, {**needed_env_cache_enabled, "WEB_CONCURRENCY": "4"}):
+        assert utils.CustomTTLCache("test_workers").maxsize == 2
+
+    get_settings.cache_clear()
+    with patch.dict(os.environ, {**needed_env_cache_enabled, "WEB_CONCURRENCY": "20"}):
+        assert utils.CustomTTLCache("test_workers").maxsize == 1
+
+    get_settings.cache_clear()
+
+
+def test_custom_ttl_cache_keeps_stale_items():
+    """The expired items are served by get_stale, without writing to the cache."""
+    get_settings.cache_clear()
+    with patch.dict(os.environ, needed_env_cache_enabled):
+        cache = utils.CustomTTLCache("test_stale", ttl=0.05, keep_stale=True)
+        assert utils.CustomTTLCache("test_no_stale", ttl=0.05).stale is None
+    get_settings.cache_clear()
+
+    cache[1] = "value"
+    time.sleep(0.1)
+
+    assert 1 not in cache
+    assert cache.get_stale(1) == "value"
+    assert cache.get_stale(2) is None
+
+
+def test_custom_ttl_cache_stale_items_within_size():
+    """The stale items only use the room left by the live ones."""
+    get_settings.cache_clear()
+    with patch.dict(os.environ, needed_env_cache_enabled):
+        cache = utils.CustomTTLCache("test_stale_size", ttl=0.05, keep_stale=True)
+    get_settings.cache_clear()
+
+    for i in range(10):
+        cache[i] = i
+    time.sleep(0.1)
+    assert cache.get_stale(0) == 0
+    assert len(cache.stale) == 10
+
+    for i in range(10, 14):
+        cache[i] = i
+    assert len(cache) + len(cache.stale) == 10
+
+
+def test_custom_ttl_cache_ttl():
+    """The TTL given replaces CACHE_TTL."""
+    get_settings.cache_clear()
+    with patch.dict(os.environ, needed_env_cache_enabled):
+        assert utils.CustomTTLCache("test_ttl").ttl == 1
+        assert utils.CustomTTLCache("test_ttl", ttl=5).ttl == 5
+    get_settings.cache_clear()
+
+
+def test_estimate_size():
+    """The size includes the referenced objects, counted once."""
+    value = "x" * 1000
+    assert utils.estimate_size(value) > 1000
+    assert utils.estimate_size([value]) > utils.estimate_size(value)
+    assert utils.estimate_size([value, value]) < 2 * utils.estimate_size(value)
+
+    predictors = UpgradeRisksPredictors(alerts=[], operator_conditions=[])
+    with_alert = UpgradeRisksPredictors(
+        alerts=[
+            Alert(name="alert", namespace="namespace", severity="critical"),
+        ],
+        operator_conditions=[],
+    )
+    assert utils.estimate_size(with_alert) > utils.estimate_size(predictors)
+
+
+def test_custom_ttl_cache_max_bytes():
+    """With CACHE_MAX_BYTES, the cache is bounded by the size of its items."""
+    get_settings.cache_clear()
+    with patch.dict(
+        os.environ, {**needed_env_cache_enabled, "CACHE_MAX_BYTES": "10000"}
+    ):
+        cache = utils.CustomTTLCache("test_bytes")
+    get_settings.cache_clear()
+
+    assert cache.maxsize == 10000
+    cache[1] = "x" * 4000
+    cache[2] = "x" * 4000
+    assert get_cache_metric("ccx_upgrades_cache_bytes", "test_bytes") == (
+        cache.currsize
+    )
+
+    cache[3] = "x" * 4000
+    assert 1 not in cache
+    assert len(cache) == 2
+    assert get_cache_metric("ccx_upgrades_cache_evictions_total", "test_bytes") == 1
+
+    # Too large to be cached: the previous value is not served anymore
+    cache[2] = "x" * 20000
+    assert 2 not in cache
+    assert 3 in cache
+
+
+# ----------------------------------------------------------------------
+# Tests for SingleFlight
+# ----------------------------------------------------------------------
+@pytest.mark.asyncio
+async def test_single_flight_shares_the_call_in_progress():
+    """Concurrent calls with the same key share a single run."""
+    flight = utils.SingleFlight("test_shared")
+    release = asyncio.Event()
+    calls = []
+
+    async def func(value):
+        calls.append(value)
+        await release.wait()
+        return value
+
+    tasks = [
+        asyncio.create_task(flight.run("key", func, 1)),
+        asyncio.create_task(flight.run("key", func, 2)),
+        asyncio.create_task(flight.run("other", func, 3)),
+    ]
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await asyncio.gather(*tasks) == [1, 1, 3]
+    assert calls == [1, 3]
+    assert (
+        REGISTRY.get_sample_value(
+            "ccx_upgrades_single_flight_waits_total", {"name": "test_shared"}
+        )
+        == 1
+    )
+
+    # Once finished, the next call runs again
+    assert await flight.run("key", func, 4) == 4
+    assert calls == [1, 3, 4]
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_the_exception():
+    """The waiting calls get the exception raised by the shared call."""
+    flight = utils.SingleFlight("test_exception")
+    release = asyncio.Event()
+
+    async def func():
+        await release.wait()
+        raise ValueError("test")
+
+    tasks = [asyncio.create_task(flight.run("key", func)) for _ in range(2)]
+    await asyncio.sleep(0)
+    release.set()
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_single_flight_does_not_share_partial_results():
+    """The waiting calls run func themselves if the shared result is partial."""
+    flight = utils.SingleFlight("test_partial", shareable=lambda result: result[1])
+    release = asyncio.Event()
+    calls = []
+
+    async def func(value):
+        calls.append(value)
+        await release.wait()
+        return value, value != 1
+
+    tasks = [
+        asyncio.create_task(flight.run("key", func, 1)),
+        asyncio.create_task(flight.run("key", func, 2)),
+    ]
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await asyncio.gather(*tasks) == [(1, False), (2, True)]
+    assert calls == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_single_flight_does_not_share_deadline_exceeded():
+    """The waiting calls run func themselves if the shared call ran out of time."""
+    flight = utils.SingleFlight("test_deadline")
+    release = asyncio.Event()
+    calls = []
+
+    async def func(value):
+        calls.append(value)
+        await release.wait()
+        if value == 1:
+            raise deadline.DeadlineExceededError()
+        return value
+
+    tasks = [
+        asyncio.create_task(flight.run("key", func, 1)),
+        asyncio.create_task(flight.run("key", func, 2)),
+    ]
+    await asyncio.sleep(0)
+    release.set()
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    assert isinstance(results[0], deadline.DeadlineExceededError)
+    assert results[1] == 2
+    assert calls == [1, 2]
+
+
+# ----------------------------------------------------------------------
+# Tests for CircuitBreaker
+# ----------------------------------------------------------------------
+def get_breaker_state(name):
+    """Return the value of the state gauge of a circuit breaker."""
+    return REGISTRY.get_sample_value(
+        "ccx_upgrades_circuit_breaker_state", {"dependency": name}
+    )
+
+
+def test_circuit_breaker_opens_on_failure_rate():
+    """The breaker opens once the failure rate is reached with enough calls."""
+    breaker = utils.CircuitBreaker("test_opens", 0.5, 4, 4, 30)
+
+    for success in (True, False, True):
+        breaker.before_call()
+        breaker.record(success)
+    assert breaker.state == breaker.CLOSED  # not enough calls yet
+
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+    assert get_breaker_state("test_opens") == 2
+
+    with pytest.raises(utils.CircuitOpenError):
+        breaker.before_call()
+    assert (
+        REGISTRY.get_sample_value(
+            "ccx_upgrades_circuit_breaker_rejected_total", {"dependency": "test_opens"}
+        )
+        == 1
+    )
+
+
+def test_circuit_breaker_half_open_probe():
+    """After open_time, a single probe closes the breaker or opens it again."""
+    timer = MagicMock(return_value=0)
+    breaker = utils.CircuitBreaker("test_probe", 0.5, 2, 1, 30, timer=timer)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+
+    timer.return_value = 30
+    breaker.before_call()
+    assert breaker.state == breaker.HALF_OPEN
+    assert get_breaker_state("test_probe") == 1
+    with pytest.raises(utils.CircuitOpenError):
+        breaker.before_call()  # only one probe at a time
+
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+    with pytest.raises(utils.CircuitOpenError):
+        breaker.before_call()
+
+    timer.return_value = 60
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == breaker.CLOSED
+    assert get_breaker_state("test_probe") == 0
+    breaker.before_call()
+
+
+def test_circuit_breaker_cancel_call():
+    """A probe that was not made lets the next call probe the dependency."""
+    timer = MagicMock(return_value=0)
+    breaker = utils.CircuitBreaker("test_cancel", 0.5, 2, 1, 30, timer=timer)
+    breaker.before_call()
+    breaker.record_failure()
+
+    timer.return_value = 30
+    breaker.before_call()
+    breaker.cancel_call()
+    breaker.before_call()
+    assert breaker.state == breaker.HALF_OPEN
+
+
+# ----------------------------------------------------------------------
+# Tests for WeightedLimiter
+# ----------------------------------------------------------------------
+def test_weighted_limiter_fifo():
+    """The waiting operations start in arrival order, even if a later one fits."""
+    limiter = utils.WeightedLimiter(10)
+    limiter.acquire(6)
+    started = []
+
+    def run(name, weight):
+        limiter.acquire(weight)
+        started.append(name)
+
+    heavy = threading.Thread(target=run, args=("heavy", 8))
+    heavy.start()
+    while not limiter._queue:
+        time.sleep(0.001)
+    light = threading.Thread(target=run, args=("light", 2))
+    light.start()
+
+    time.sleep(0.05)
+    assert started == []  # light fits, but heavy arrived first
+
+    limiter.release(6)
+    heavy.join(timeout=1)
+    light.join(timeout=1)
+    assert started == ["heavy", "light"]
+    assert limiter.in_use == 10
+
+
+def test_weighted_limiter_timeout():
+    """An operation not started within the timeout gives up its place in the queue."""
+    limiter = utils.WeightedLimiter(10)
+    limiter.acquire(10)
+
+    assert not limiter.acquire(1, timeout=0.01)
+    assert not limiter._queue
+
+    limiter.release(10)
+    assert limiter.acquire(1, timeout=0.01)
+
+
+def test_weighted_limiter_caps_weight():
+    """Operations heavier than the capacity run alone."""
+    limiter = utils.WeightedLimiter(10)
+    limiter.acquire(50)
+    assert limiter.in_use == 10
+
+    limiter.release(50)
+    assert limiter.in_use == 0
+
+
+# ----------------------------------------------------------------------
+# Tests for RequestBudget and RequestHedger
+# ----------------------------------------------------------------------
+def get_hedged_count(name, winner):
+    """Return the number of hedged requests won by the first request or the hedge."""
+    return (
+        REGISTRY.get_sample_value(
+            "ccx_upgrades_hedged_requests_total",
+            {"dependency": name, "winner": winner},
+        )
+        or 0
+    )
+
+
+def test_request_budget():
+    """Each request deposits ratio tokens and each extra request takes one."""
+    budget = utils.RequestBudget(0.5, max_tokens=2)
+    assert budget.withdraw()
+    assert budget.withdraw()
+    assert not budget.withdraw()
+
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
+
+
+def test_request_hedger_delay_percentile():
+    """The hedge delay is the percentile of the recent latencies of the same kind."""
+    hedger = utils.RequestHedger("test_delay", 90, 0.05, 0.1, min_samples=10)
+    hedger._latencies["single"].extend(i / 10 for i in range(10))
+    assert hedger.get_delay("single") == pytest.approx(0.8)
+    assert hedger.get_delay("multi") == 0.05  # not enough samples
+
+    hedger._latencies["single"].extend([0.01] * 90)
+    assert hedger.get_delay("single") == 0.05
+
+
+def test_request_hedger_hedge_wins():
+    """A slow request is hedged, the hedge result is used and the slow one closed."""
+    hedger = utils.RequestHedger("test_wins", 95, 0.01, 0.1)
+    release = threading.Event()
+    slow_result = MagicMock()
+    hedge_result = MagicMock()
+    results = iter([slow_result, hedge_result])
+
+    def call():
+        result = next(results)
+        if result is slow_result:
+            release.wait(timeout=5)
+        return result
+
+    assert hedger.run(call) is hedge_result
+    assert get_hedged_count("test_wins", "hedge") == 1
+
+    release.set()
+    hedger._executor.shutdown(wait=True)
+    slow_result.close.assert_called_once()
+    hedge_result.close.assert_not_called()
+
+
+def test_request_hedger_first_wins_if_hedge_fails():
+    """If the hedge fails, the result of the first request is used."""
+    hedger = utils.RequestHedger("test_hedge_fails", 95, 0.01, 0.1)
+    calls = iter([0.05, None])
+
+    def call():
+        delay = next(calls)
+        if delay is None:
+            raise ConnectionError()
+        time.sleep(delay)
+        return "first"
+
+    assert hedger.run(call) == "first"
+    assert get_hedged_count("test_hedge_fails", "first") == 1
+
+
+def test_request_hedger_budget_spent():
+    """Slow requests are not hedged once the budget is spent."""
+    hedger = utils.RequestHedger("test_budget", 95, 0.01, 0)
+    hedger.budget.tokens = 0
+    call = MagicMock(side_effect=lambda: time.sleep(0.05) or "first")
+
+    assert hedger.run(call) == "first"
+    call.assert_called_once()
+    assert (
+        REGISTRY.get_sample_value(
+            "ccx_upgrades_hedges_skipped_total",
+            {"dependency": "test_budget", "reason": "budget"},
+        )
+        == 1
+    )
+
+
+def test_request_hedger_both_fail():
+    """If both requests fail, the error of the first one is raised."""
+    hedger = utils.RequestHedger("test_both_fail", 95, 0.01, 0.1)
+    errors = iter([ConnectionError("first"), ConnectionError("hedge")])
+
+    def call():
+        error = next(errors)
+        time.sleep(0.05)
+        raise error
+
+    with pytest.raises(ConnectionError, match="first"):
+        hedger.run(call)
+    assert get_hedged_count("test_both_fail", "none") == 1
+    assert get_hedged_count("test_both_fail", "first") == 0
+
+
+def test_request_hedger_limiter():
+    """The hedge takes a limiter slot of its own and frees it once done."""
+    hedger = utils.RequestHedger("test_limiter", 95, 0.01, 0.1)
+    limiter = utils.WeightedLimiter(2)
+    limiter.acquire(1)  # slot of the first request
+    in_use = []
+
+    def call():
+        in_use.append(limiter.in_use)
+        time.sleep(0.05)
+        return "result"
+
+    assert hedger.run(call, limiter=limiter) == "result"
+    hedger._executor.shutdown(wait=True)
+    assert in_use == [1, 2]
+    assert limiter.in_use == 1
+
+
+def test_request_hedger_limiter_full():
+    """A slow request is not hedged if the limiter has no free slot."""
+    hedger = utils.RequestHedger("test_limiter_full", 95, 0.01, 0.1)
+    limiter = utils.WeightedLimiter(1)
+    limiter.acquire(1)
+    call = MagicMock(side_effect=lambda: time.sleep(0.05) or "first")
+
+    assert hedger.run(call, limiter=limiter) == "first"
+    call.assert_called_once()
+    assert limiter.in_use == 1
+    assert (
+        REGISTRY.get_sample_value(
+            "ccx_upgrades_hedges_skipped_total",
+            {"dependency": "test_limiter_full", "reason": "limiter"},
+        )
+        == 1
+    )
+
+
+# ----------------------------------------------------------------------
+# Tests for RetryPolicy
+# ----------------------------------------------------------------------
+def get_retries_count(name, reason):
+    """Return the number of retries of a dependency for the given reason."""
+    return (
+        REGISTRY.get_sample_value(
+            "ccx_upgrades_retries_total", {"dependency": name, "reason": reason}
+        )
+        or 0
+    )
+
+
+@patch("time.sleep", return_value=None)
+def test_retry_policy_retries_transient_errors(mock_sleep):
+    """Connection errors and 502, 503 and 504 responses are retried."""
+    policy = utils.RetryPolicy("test_transient", 3, 0.1, 1, 0.1)
+    unavailable = MagicMock(status_code=503)
+    ok = MagicMock(status_code=200)
+    send = MagicMock(
+        side_effect=[requests.exceptions.ConnectionError(), unavailable, ok]
+    )
+
+    assert policy.call(send, "query") is ok
+
+    send.assert_called_with("query")
+    assert send.call_count == 3
+    unavailable.close.assert_called_once()
+    assert get_retries_count("test_transient", "connection_error") == 1
+    assert get_retries_count("test_transient", "503") == 1
+    assert mock_sleep.call_count == 2
+    assert 0.2 <= mock_sleep.call_args.args[0] <= 0.3
+
+
+@patch("time.sleep", return_value=None)
+def test_retry_policy_returns_last_response(mock_sleep):
+    """Other errors are not retried and the last response is returned."""
+    policy = utils.RetryPolicy("test_last", 2, 0.1, 1, 0.1)
+    send = MagicMock(return_value=MagicMock(status_code=500))
+    assert policy.call(send).status_code == 500
+    assert send.call_count == 1
+
+    send = MagicMock(return_value=MagicMock(status_code=502))
+    assert policy.call(send).status_code == 502
+    assert send.call_count == 2
+
+    send = MagicMock(side_effect=requests.exceptions.ConnectionError())
+    with pytest.raises(requests.exceptions.ConnectionError):
+        policy.call(send)
+    assert send.call_count == 2
+
+
+@patch("time.sleep", return_value=None)
+def test_retry_policy_budget(mock_sleep):
+    """The requests are not retried once the retry budget is spent."""
+    policy = utils.RetryPolicy("test_retry_budget", 3, 0.1, 1, 0.1)
+    policy.budget.tokens = 1
+    send = MagicMock(return_value=MagicMock(status_code=503))
+
+    assert policy.call(send).status_code == 503
+
+    assert send.call_count == 2
+    assert (
+        REGISTRY.get_sample_value(
+            "ccx_upgrades_retry_budget_exhausted_total",
+            {"dependency": "test_retry_budget"},
+        )
+        == 1
+    )
 
 
 # ----------------------------------------------------------------------
@@ -65,6 +727,25 @@ def test_retry_with_exponential_backoff_max_attempts(mock_sleep):
     assert mock_sleep.call_count == 2
 
 
+@patch("time.sleep", return_value=None)
+def test_retry_with_exponential_backoff_stops_at_deadline(mock_sleep):
+    """The retries stop if the request deadline would expire during the delay."""
+    mock_func = MagicMock(side_effect=Exception("fail"))
+    decorated_func = utils.retry_with_exponential_backoff(max_attempts=3, base_delay=2)(
+        mock_func
+    )
+
+    try:
+        deadline.start_deadline(1)
+        with pytest.raises(Exception, match="fail"):
+            decorated_func()
+    finally:
+        deadline.start_deadline(None)
+
+    assert mock_func.call_count == 1
+    mock_sleep.assert_not_called()
+
+
 @patch("time.sleep", return_value=None)
 def test_retry_with_exponential_backoff_delay(mock_sleep):
     """Test that the function uses exponential backoff delay."""
@@ -211,6 +892,9 @@ def test_calculate_delay():
     delay = utils.calculate_delay(4, base_delay=1, max_delay=10)
     assert 8 <= delay <= 10
 
+    delay = utils.calculate_delay(2, base_delay=0.1, max_delay=10, jitter=0.1)
+    assert 0.2 <= delay <= 0.3
+
 
 @patch("ccx_upgrades_data_eng.utils.logger")
 def test_log_attempt(logger_mock):
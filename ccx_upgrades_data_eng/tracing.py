@@ -0,0 +1,126 @@
+"""Opt-in OpenTelemetry tracing of the requests to SSO, RHOBS and inference.
+
+Tracing is enabled with TRACING_ENABLED and needs the "tracing" extra to be
+installed. The exporter and the sampler are configured with the standard
+OTEL_* environment variables, like OTEL_EXPORTER_OTLP_ENDPOINT and
+OTEL_TRACES_SAMPLER. When tracing is disabled, OpenTelemetry is not even
+imported and the helpers in this module do nothing.
+"""
+
+import logging
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
+from starlette.requests import Request
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "ccx-upgrades-data-eng"
+
+_tracer_provider = None
+_tracer = None
+
+
+def init_tracing(enabled: bool, span_processor=None) -> None:
+    """Configure the tracer exporting the spans with OTLP over HTTP.
+
+    A different span processor can be passed, for example to export the spans
+    to memory in the tests.
+    """
+    global _tracer_provider, _tracer
+
+    if not enabled:
+        return
+
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        logger.error("Tracing is enabled but OpenTelemetry SDK is not installed")
+        return
+
+    if span_processor is None:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+            OTLPSpanExporter,
+        )
+
+        span_processor = BatchSpanProcessor(OTLPSpanExporter())
+
+    logger.info("Initializing tracing")
+    _tracer_provider = TracerProvider(
+        resource=Resource.create({"service.name": SERVICE_NAME})
+    )
+    _tracer_provider.add_span_processor(span_processor)
+    _tracer = _tracer_provider.get_tracer(__name__)
+
+
+def shutdown_tracing() -> None:
+    """Export the pending spans and disable tracing."""
+    global _tracer_provider, _tracer
+
+    if _tracer_provider is not None:
+        _tracer_provider.shutdown()
+
+    _tracer_provider = None
+    _tracer = None
+
+
+@contextmanager
+def start_span(name: str, attributes: dict[str, Any] | None = None) -> Iterator[Any]:
+    """Run the block in a new span, yielding None if tracing is disabled."""
+    if _tracer is None:
+        yield None
+        return
+
+    with _tracer.start_as_current_span(name, attributes=attributes) as span:
+        yield span
+
+
+@contextmanager
+def start_request_span(request: Request, route: str) -> Iterator[Any]:
+    """Run the block in a server span continuing the trace of the incoming request."""
+    if _tracer is None:
+        yield None
+        return
+
+    from opentelemetry import propagate, trace
+
+    with _tracer.start_as_current_span(
+        f"{request.method} {route}",
+        context=propagate.extract(request.headers),
+        kind=trace.SpanKind.SERVER,
+        attributes={"http.request.method": request.method, "http.route": route},
+    ) as span:
+        yield span
+
+
+def set_span_attribute(span, key: str, value: Any) -> None:
+    """Set an attribute in the span, if any."""
+    if span is not None:
+        span.set_attribute(key, value)
+
+
+def inject_trace_headers(headers: dict[str, str]) -> dict[str, str]:
+    """Add the trace context headers to propagate the current trace."""
+    if _tracer is not None:
+        from opentelemetry import propagate
+
+        propagate.inject(headers)
+
+    return headers
+
+
+def get_exemplar() -> dict[str, str] | None:
+    """Return the trace ID of the current span as exemplar for the histograms."""
+    if _tracer is None:
+        return None
+
+    from opentelemetry import trace
+
+    span_context = trace.get_current_span().get_span_context()
+    if not span_context.is_valid or not span_context.trace_flags.sampled:
+        return None
+
+    return {"trace_id": trace.format_trace_id(span_context.trace_id)}
@@ -1,18 +1,30 @@
 """Utilities used in the other modules of this package."""
 
 import asyncio
+import contextvars
 import logging
+import math
 import random
+import sys
+import threading
 import time
-from functools import wraps
+from collections import defaultdict, deque
+from collections.abc import Hashable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from functools import lru_cache, partial, wraps
 
-from cachetools import TTLCache
+import requests
+from cachetools import Cache, LRUCache, TLRUCache
 from pydantic import ValidationError
 
+from ccx_upgrades_data_eng import deadline, metrics, tracing
 from ccx_upgrades_data_eng.config import (
     DEFAULT_CACHE_ENABLED,
+    DEFAULT_CACHE_MAX_BYTES,
     DEFAULT_CACHE_SIZE,
     DEFAULT_CACHE_TTL,
+    DEFAULT_CACHE_TTL_JITTER,
+    DEFAULT_WEB_CONCURRENCY,
     get_settings,
 )
 
@@ -22,63 +34,855 @@ DEFAULT_SSO_RETRY_MAX_ATTEMPTS = 5
 DEFAULT_SSO_RETRY_BASE_DELAY = 1
 DEFAULT_SSO_RETRY_MAX_DELAY = 30
 
+# Responses of the upstream services worth retrying: the error is usually
+# transient, from a proxy or an overloaded instance
+RETRYABLE_STATUS_CODES = {502, 503, 504}
 
-class LoggedTTLCache(TTLCache):
-    """TTL Cache with log for items eviction."""
+
+def estimate_size(value) -> int:
+    """Estimate the bytes used by the value and the objects it references.
+
+    The containers and the attributes of the objects, like the fields of the
+    pydantic models, are followed, counting each object once.
+    """
+    size = 0
+    seen = set()
+    pending = [value]
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, str | bytes | int | float | type):
+            continue
+
+        if isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+        elif isinstance(obj, list | tuple | set | frozenset):
+            pending.extend(obj)
+        elif hasattr(obj, "__dict__"):
+            pending.append(obj.__dict__)
+
+    return size
+
+
+class InstrumentedTTLCache(TLRUCache):
+    """TTL Cache exporting Prometheus metrics labelled with the name of the cache.
+
+    Hits and misses are counted for every read, either through the cached
+    decorator or directly with get.
+
+    Each item lives for a random time between (1 - ttl_jitter) * ttl and ttl
+    seconds, so the items added together, like the results of a multi cluster
+    query, don't all expire at once.
+
+    If getsizeof is given, maxsize is in the unit it returns, like bytes with
+    estimate_size, and the size in use is exported too. Items larger than
+    maxsize are not cached.
+
+    It is thread-safe, as the caches are shared by the event loop and the
+    threadpool.
+    """
+
+    __marker = object()
+
+    def __init__(self, name: str, maxsize, ttl, ttl_jitter: float = 0, **kwargs):
+        """Initialize the cache and its metrics."""
+        self._lock = threading.RLock()
+        self._ttl = ttl
+        self.ttl_jitter = ttl_jitter
+        super().__init__(maxsize=maxsize, ttu=self._get_expiration_time, **kwargs)
+        self.name = name
+        self._hits = metrics.CCX_UPGRADES_CACHE_HITS_TOTAL.labels(name)
+        self._misses = metrics.CCX_UPGRADES_CACHE_MISSES_TOTAL.labels(name)
+        self._evictions = metrics.CCX_UPGRADES_CACHE_EVICTIONS_TOTAL.labels(name)
+        self._expirations = metrics.CCX_UPGRADES_CACHE_EXPIRATIONS_TOTAL.labels(name)
+        self._size = metrics.CCX_UPGRADES_CACHE_SIZE.labels(name)
+        self._fill_ratio = metrics.CCX_UPGRADES_CACHE_FILL_RATIO.labels(name)
+        self._expirations_per_sweep = (
+            metrics.CCX_UPGRADES_CACHE_EXPIRATIONS_PER_SWEEP.labels(name)
+        )
+        self._bytes = None
+        if kwargs.get("getsizeof") is not None:
+            self._bytes = metrics.CCX_UPGRADES_CACHE_BYTES.labels(name)
+        self._update_size_metrics()
+
+    @property
+    def ttl(self):
+        """The maximum time-to-live of the items."""
+        return self._ttl
+
+    def _get_expiration_time(self, key, value, now: float) -> float:
+        """Return the time when the item expires, with the jitter applied."""
+        ttl = self._ttl
+        if self.ttl_jitter > 0:
+            ttl -= ttl * self.ttl_jitter * random.random()
+        return now + ttl
+
+    def __contains__(self, key):
+        """Check if the key is cached and not expired."""
+        with self._lock:
+            return super().__contains__(key)
+
+    def __len__(self):
+        """Return the number of items not expired."""
+        with self._lock:
+            return super().__len__()
+
+    def __getitem__(self, key):
+        """Count the read as a hit or a miss."""
+        with (
+            self._lock,
+            tracing.start_span("cache.lookup", {"cache.name": self.name}) as span,
+        ):
+            try:
+                value = super().__getitem__(key)
+                hit = True
+            except KeyError:
+                hit = False
+            self._count_read(hit, span)
+
+        if not hit:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        """Update the size metrics after adding an item.
+
+        An item too large for the cache is not added, and the previous value
+        for the key is dropped.
+        """
+        with self._lock:
+            try:
+                super().__setitem__(key, value)
+            except ValueError:
+                logger.debug("Item %s is too large for the %s cache", key, self.name)
+                self.pop(key, None)
+            self._update_size_metrics()
+
+    def __delitem__(self, key):
+        """Update the size metrics after removing an item."""
+        with self._lock:
+            try:
+                super().__delitem__(key)
+            finally:
+                self._update_size_metrics()
+
+    def get(self, key, default=None):
+        """Count the read as a hit or a miss."""
+        with (
+            self._lock,
+            self.timer,
+            tracing.start_span("cache.lookup", {"cache.name": self.name}) as span,
+        ):
+            hit = key in self
+            value = super().__getitem__(key) if hit else default
+            self._count_read(hit, span)
+
+        return value
+
+    def peek(self, key, default=None):
+        """Return the item without counting it as a read."""
+        with self._lock, self.timer:
+            if key in self:
+                return super().__getitem__(key)
+        return default
+
+    def pop(self, key, default=__marker):
+        """Remove the item without counting it as a read."""
+        with self._lock, self.timer:
+            if key in self:
+                value = super().__getitem__(key)
+                del self[key]
+                return value
+        if default is self.__marker:
+            raise KeyError(key)
+        return default
 
     def popitem(self):
-        """Overwrite TTLCache's popitem method to log evicted keys."""
-        key, value = super().popitem()
+        """Log and count the evicted item."""
+        with self._lock:
+            key, value = super().popitem()
         logger.debug(f"Key {key} evicted")
+        self._evictions.inc()
         return key, value
 
     def expire(self, time=None):
-        """Overwrite TTLCache's expire to add logs."""
+        """Count the expired items, and how many expired together."""
         logger.debug("expiring items from cache")
-        return super().expire(time)
+        with self._lock:
+            expired = super().expire(time)
+            if expired:
+                self._expirations.inc(len(expired))
+                self._expirations_per_sweep.observe(len(expired))
+                self._update_size_metrics()
+        return expired
+
+    def clear(self):
+        """Update the size metrics after clearing the cache."""
+        with self._lock:
+            super().clear()
+            self._update_size_metrics()
+
+    def _count_read(self, hit: bool, span=None):
+        """Count a hit or a miss, also in the Server-Timing and the span of the request."""
+        tracing.set_span_attribute(span, "cache.hit", hit)
+        if hit:
+            self._hits.inc()
+        else:
+            self._misses.inc()
+
+        timings = metrics.current_timings.get()
+        if timings is not None:
+            timings.add_cache_result(self.name, hit)
+
+    def _update_size_metrics(self):
+        """Update the size and fill ratio gauges.
+
+        Cache.currsize and Cache.__len__ are used because the TLRUCache ones
+        expire items first, which would call this method again.
+        """
+        self._size.set(Cache.__len__(self))
+        currsize = Cache.currsize.fget(self)
+        if self._bytes is not None:
+            self._bytes.set(currsize)
+        if self.maxsize:
+            self._fill_ratio.set(currsize / self.maxsize)
+        else:
+            self._fill_ratio.set(0)
 
 
-class CustomTTLCache(LoggedTTLCache):
+class CustomTTLCache(InstrumentedTTLCache):
     """TTL Cache with TTL for items eviction.
 
-    Use CACHE_ENABLED, CACHE_TTL, and CACHE size env vars to configure it.
+    Use CACHE_ENABLED, CACHE_TTL, CACHE_TTL_JITTER and CACHE size env vars to
+    configure it. If CACHE_MAX_BYTES is set, the cache is bounded by the
+    estimated size of its items instead of their number. When running
+    several workers (WEB_CONCURRENCY), the cache size is split between them,
+    as each worker process has its own caches.
+
+    If keep_stale is set, the expired items are kept in the stale LRU cache,
+    to be served while the service they come from is down. They only use the
+    room left by the live items, so both together stay within the cache size.
     """
 
-    def __init__(self):
-        """Read settings or use default values to configure the cache."""
+    def __init__(self, name: str, ttl: float | None = None, keep_stale: bool = False):
+        """Read settings or use default values to configure the cache.
+
+        If given, ttl is used instead of CACHE_TTL.
+        """
+        self.stale = None
         try:
             settings = get_settings()
-            ttl = settings.cache_ttl
+            cache_ttl = settings.cache_ttl
+            ttl_jitter = settings.cache_ttl_jitter
             enabled = settings.cache_enabled
             maxsize = settings.cache_size
+            max_bytes = settings.cache_max_bytes
+            workers = settings.web_concurrency
         except ValidationError:
             logger.debug("Settings not loaded yet. Using default values")
             enabled = DEFAULT_CACHE_ENABLED
-            ttl = DEFAULT_CACHE_TTL
+            cache_ttl = DEFAULT_CACHE_TTL
+            ttl_jitter = DEFAULT_CACHE_TTL_JITTER
             maxsize = DEFAULT_CACHE_SIZE
+            max_bytes = DEFAULT_CACHE_MAX_BYTES
+            workers = DEFAULT_WEB_CONCURRENCY
+
+        if ttl is None:
+            ttl = cache_ttl
+        getsizeof = None
+        if max_bytes > 0:
+            maxsize = max_bytes
+            getsizeof = estimate_size
+        if workers > 1 and maxsize > 0:
+            maxsize = max(maxsize // workers, 1)
 
         logger.debug(
-            f"Cache settings: Enabled: {enabled}, Max size: {maxsize}, TTL: {ttl} seconds"
+            f"Cache settings: Enabled: {enabled}, Max size: {maxsize}"
+            f"{' bytes' if getsizeof else ''}, TTL: {ttl} seconds"
         )
         if enabled:
-            super().__init__(maxsize=maxsize, ttl=ttl)
+            super().__init__(
+                name,
+                maxsize=maxsize,
+                ttl=ttl,
+                ttl_jitter=ttl_jitter,
+                getsizeof=getsizeof,
+            )
+        else:
+            super().__init__(name, maxsize=0, ttl=0)
+        if keep_stale and self.maxsize:
+            self.stale = LRUCache(maxsize=self.maxsize, getsizeof=getsizeof)
+
+    def __setitem__(self, key, value):
+        """Make room for the new item in the stale cache too."""
+        with self._lock:
+            super().__setitem__(key, value)
+            self._trim_stale()
+
+    def expire(self, time=None):
+        """Keep the expired items in the stale cache."""
+        with self._lock:
+            expired = super().expire(time)
+            if self.stale is not None and expired:
+                for key, value in expired:
+                    try:
+                        self.stale[key] = value
+                    except ValueError:
+                        logger.debug("Stale item %s is too large", key)
+                self._trim_stale()
+        return expired
+
+    def get_stale(self, key, default=None):
+        """Return the item, or its expired value if still kept in the stale cache.
+
+        cachetools only expires the items when writing, so they are expired
+        first: while the service is down, nothing new is written.
+        """
+        if self.stale is None:
+            return default
+
+        with self._lock:
+            self.expire()
+            value = self.peek(key)
+            if value is not None:
+                return value
+            return self.stale.get(key, default)
+
+    def _trim_stale(self):
+        """Evict stale items until the live and stale items fit in maxsize."""
+        if self.stale is None:
+            return
+
+        while self.stale and Cache.currsize.fget(self) + self.stale.currsize > (
+            self.maxsize
+        ):
+            self.stale.popitem()
+        self._update_size_metrics()
+
+    def _update_size_metrics(self):
+        """Include the stale items in the size in bytes."""
+        super()._update_size_metrics()
+        if self._bytes is not None and self.stale is not None:
+            self._bytes.set(Cache.currsize.fget(self) + self.stale.currsize)
+
+
+class SingleFlight:
+    """Run a coroutine once for all the concurrent calls with the same key.
+
+    The calls arriving while it runs wait for it and get the same result, or
+    the same exception. It runs in its own task, so it is not cancelled if
+    the caller that started it goes away.
+
+    The call runs with the deadline of the caller that started it, so the
+    waiting calls don't get the results rejected by shareable, nor a
+    DeadlineExceededError: they run func themselves instead.
+
+    It must only be used from the event loop.
+    """
+
+    def __init__(self, name: str, shareable=None):
+        """Initialize the single flight group and its metric."""
+        self.name = name
+        self.shareable = shareable
+        self._tasks: dict[Hashable, asyncio.Task] = {}
+        self._waits = metrics.CCX_UPGRADES_SINGLE_FLIGHT_WAITS_TOTAL.labels(name)
+
+    async def run(self, key: Hashable, func, *args):
+        """Return the result of func(*args), or of the same call already running."""
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args))
+            self._tasks[key] = task
+            task.add_done_callback(partial(self._forget, key))
+            return await asyncio.shield(task)
+
+        logger.debug("Waiting for the %s call in progress", self.name)
+        self._waits.inc()
+        try:
+            result = await asyncio.shield(task)
+        except deadline.DeadlineExceededError:
+            logger.debug("The shared %s call ran out of time", self.name)
+            return await func(*args)
+
+        if self.shareable is not None and not self.shareable(result):
+            logger.debug("The shared %s call result is partial", self.name)
+            return await func(*args)
+
+        return result
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        """Remove the finished task, so the next call runs func again."""
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            # Avoid the warning about an exception never retrieved when all
+            # the callers went away
+            task.exception()
+
+
+class WeightedLimiter:
+    """Limit the total weight of the operations running at the same time.
+
+    The waiting operations start in arrival order, so a heavy operation is not
+    starved by the lighter ones arriving after it. Weights over the capacity
+    are capped to it, so they run alone instead of waiting forever.
+
+    It is thread-safe, as the blocking operations run in the threadpool.
+    """
+
+    def __init__(self, capacity: int):
+        """Initialize the limiter with the total weight allowed."""
+        self.capacity = capacity
+        self.in_use = 0
+        self._condition = threading.Condition()
+        self._queue: deque[object] = deque()
+
+    def acquire(self, weight: int, timeout: float | None = None) -> bool:
+        """Wait until the operation can start, after the ones that arrived first.
+
+        Return False if it could not start within timeout seconds.
+        """
+        weight = min(weight, self.capacity)
+        ticket = object()
+        with self._condition:
+            self._queue.append(ticket)
+            try:
+                acquired = self._condition.wait_for(
+                    lambda: (
+                        self._queue[0] is ticket
+                        and self.in_use + weight <= self.capacity
+                    ),
+                    timeout,
+                )
+                if acquired:
+                    self.in_use += weight
+                return acquired
+            finally:
+                self._queue.remove(ticket)
+                # The next operation in the queue may fit too
+                self._condition.notify_all()
+
+    def release(self, weight: int) -> None:
+        """Free the weight of a finished operation."""
+        with self._condition:
+            self.in_use -= min(weight, self.capacity)
+            self._condition.notify_all()
+
+
+class CircuitOpenError(Exception):
+    """The call was not made because the circuit breaker of the dependency is open."""
+
+
+class CircuitBreaker:
+    """Stop calling a dependency while most of the recent calls to it fail.
+
+    The breaker opens when at least failure_rate of the last window calls
+    failed, once min_calls were made. While open, the calls fail fast with
+    CircuitOpenError. After open_time seconds, a single probe call is let
+    through (half-open): the breaker closes if it succeeds, or opens again.
+
+    It is thread-safe, as the clients run in the threadpool.
+    """
+
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+    _STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float,
+        window: int,
+        min_calls: int,
+        open_time: float,
+        timer=time.monotonic,
+    ):
+        """Initialize a closed circuit breaker."""
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_time = open_time
+        self.timer = timer
+        self.state = self.CLOSED
+        self._outcomes: deque[bool] = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self._state_gauge = metrics.CCX_UPGRADES_CIRCUIT_BREAKER_STATE.labels(name)
+        self._rejected = metrics.CCX_UPGRADES_CIRCUIT_BREAKER_REJECTED_TOTAL.labels(
+            name
+        )
+        self._set_state(self.CLOSED)
+
+    def before_call(self) -> None:
+        """Check if the dependency can be called, raising CircuitOpenError if not."""
+        with self._lock:
+            if (
+                self.state == self.OPEN
+                and self.timer() - self._opened_at >= self.open_time
+            ):
+                self._set_state(self.HALF_OPEN)
+
+            if self.state == self.CLOSED:
+                return
+
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+
+        self._rejected.inc()
+        raise CircuitOpenError(f"The circuit breaker for {self.name} is open")
+
+    def cancel_call(self) -> None:
+        """Forget a call allowed by before_call that was finally not made.
+
+        A half-open breaker lets the next call through as its probe.
+        """
+        with self._lock:
+            self._probing = False
+
+    def record(self, success: bool) -> None:
+        """Record the result of a call."""
+        if success:
+            self.record_success()
         else:
-            super().__init__(maxsize=0, ttl=0)
+            self.record_failure()
+
+    def record_success(self) -> None:
+        """Record a successful call, closing the breaker after a probe."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._outcomes.clear()
+                self._set_state(self.CLOSED)
+            else:
+                self._outcomes.append(True)
+
+    def record_failure(self) -> None:
+        """Record a failed call, opening the breaker if too many calls failed."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._open()
+                return
+
+            self._outcomes.append(False)
+            failures = self._outcomes.count(False)
+            if (
+                self.state == self.CLOSED
+                and len(self._outcomes) >= self.min_calls
+                and failures >= self.failure_rate * len(self._outcomes)
+            ):
+                self._open()
+
+    def _open(self) -> None:
+        """Open the breaker."""
+        logger.warning("Opening the circuit breaker for %s", self.name)
+        self._opened_at = self.timer()
+        self._set_state(self.OPEN)
+
+    def _set_state(self, state: str) -> None:
+        """Update the state and its gauge."""
+        logger.debug("Circuit breaker for %s is %s", self.name, state)
+        self.state = state
+        self._probing = False
+        self._state_gauge.set(self._STATE_VALUES[state])
+
+
+@lru_cache
+def get_circuit_breaker(name: str) -> CircuitBreaker | None:
+    """Return the circuit breaker for the given dependency, if enabled."""
+    settings = get_settings()
+    if not settings.circuit_breaker_enabled:
+        return None
+
+    return CircuitBreaker(
+        name,
+        settings.circuit_breaker_failure_rate,
+        settings.circuit_breaker_window,
+        settings.circuit_breaker_min_calls,
+        settings.circuit_breaker_open_time,
+    )
+
+
+class RequestBudget:
+    """Token bucket limiting the extra requests to a ratio of the normal ones.
+
+    Each request deposits ratio tokens and each extra request takes a whole
+    one, so the extra requests stay under ratio of the traffic. The bucket
+    holds at most max_tokens, which is also the burst allowed after a quiet
+    period.
+
+    It is thread-safe, as the clients run in the threadpool.
+    """
+
+    def __init__(self, ratio: float, max_tokens: float = 10):
+        """Initialize a full bucket."""
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        """Add the tokens of a request."""
+        with self._lock:
+            self.tokens = min(self.tokens + self.ratio, self.max_tokens)
+
+    def withdraw(self) -> bool:
+        """Take a token for an extra request, returning False if there are none left."""
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class RequestHedger:
+    """Send a second identical request when the first one is slower than usual.
+
+    The hedge is sent once the first request has been pending for the given
+    percentile of the latencies of the recent requests of the same kind, and
+    never before min_delay. The first successful response is used and the
+    other request is cancelled if it didn't start yet, or its response is
+    closed when it arrives. The hedges are limited by a RequestBudget with
+    the budget ratio and, if given, take a slot of their own in a
+    WeightedLimiter: a request is not hedged if no slot is free.
+
+    The requests run in a thread pool of their own, so that the calling
+    thread can wait for both of them.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        percentile: float,
+        min_delay: float,
+        budget: float,
+        window: int = 100,
+        min_samples: int = 20,
+        max_workers: int = 64,
+    ):
+        """Initialize the hedger with no latencies recorded."""
+        self.name = name
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.budget = RequestBudget(budget)
+        self._latencies: defaultdict[str, deque[float]] = defaultdict(
+            lambda: deque(maxlen=window)
+        )
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=f"{name}-hedging"
+        )
+
+    def get_delay(self, kind: str) -> float:
+        """Return the time to wait for the first request before hedging it."""
+        with self._lock:
+            latencies = sorted(self._latencies[kind])
+
+        if len(latencies) < self.min_samples:
+            return self.min_delay
+
+        index = max(math.ceil(self.percentile / 100 * len(latencies)) - 1, 0)
+        return max(latencies[index], self.min_delay)
+
+    def run(
+        self,
+        func,
+        kind: str = "default",
+        limiter: WeightedLimiter | None = None,
+        weight: int = 1,
+    ):
+        """Call func, hedging it if it is slow, and return the first successful result.
+
+        The hedge takes weight from limiter, without waiting for it. If both
+        calls fail, the exception of the first one is raised.
+        """
+        self.budget.deposit()
+        first = self._submit(func, kind)
+        if wait([first], timeout=self.get_delay(kind)).done:
+            return first.result()
+
+        if limiter is not None and not limiter.acquire(weight, timeout=0):
+            self._skip("limiter")
+            return first.result()
+
+        if not self.budget.withdraw():
+            if limiter is not None:
+                limiter.release(weight)
+            self._skip("budget")
+            return first.result()
+
+        logger.debug("Hedging slow %s request", self.name)
+        hedge = self._submit(func, kind)
+        if limiter is not None:
+            # Also called if the hedge is cancelled before it starts
+            hedge.add_done_callback(lambda _: limiter.release(weight))
+
+        winner = None
+        pending = {first, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            succeeded = [
+                call
+                for call in (first, hedge)
+                if call in done and call.exception() is None
+            ]
+            if succeeded:
+                winner = succeeded[0]
+                break
+
+        for call in pending:
+            self._discard(call)
+
+        if winner is None:
+            metrics.CCX_UPGRADES_HEDGED_REQUESTS_TOTAL.labels(self.name, "none").inc()
+            return first.result()
+
+        metrics.CCX_UPGRADES_HEDGED_REQUESTS_TOTAL.labels(
+            self.name, "hedge" if winner is hedge else "first"
+        ).inc()
+        return winner.result()
+
+    def _skip(self, reason: str) -> None:
+        """Count a slow request not hedged for the given reason."""
+        metrics.CCX_UPGRADES_HEDGES_SKIPPED_TOTAL.labels(self.name, reason).inc()
+
+    def _submit(self, func, kind: str) -> Future:
+        """Run func in the thread pool, in a copy of the current context."""
+        context = contextvars.copy_context()
+        return self._executor.submit(context.run, self._call, func, kind)
+
+    def _call(self, func, kind: str):
+        """Call func and record its latency if it succeeds."""
+        start = time.perf_counter()
+        result = func()
+        with self._lock:
+            self._latencies[kind].append(time.perf_counter() - start)
+        return result
+
+    @staticmethod
+    def _discard(call: Future) -> None:
+        """Cancel the losing call, or close its result once it is done."""
+        if call.cancel():
+            return
+
+        def close_result(call: Future) -> None:
+            if call.exception() is None and hasattr(call.result(), "close"):
+                call.result().close()
+
+        call.add_done_callback(close_result)
+
+
+class RetryPolicy:
+    """Retry the idempotent requests to a dependency on transient errors.
+
+    Only the connection errors and the RETRYABLE_STATUS_CODES responses are
+    retried, with exponential backoff, making at most max_attempts requests.
+    The retries are limited by a RequestBudget with the budget ratio, so they
+    don't amplify the load on a dependency that is already failing, and stop
+    if the deadline of the request would expire during the backoff.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_attempts: int,
+        base_delay: float,
+        max_delay: float,
+        budget: float,
+    ):
+        """Initialize the retry policy of the dependency."""
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = RequestBudget(budget)
+        self._budget_exhausted = (
+            metrics.CCX_UPGRADES_RETRY_BUDGET_EXHAUSTED_TOTAL.labels(name)
+        )
+
+    def call(self, func, *args) -> requests.Response:
+        """Call func, which sends a request, retrying it on transient errors.
+
+        The last response or connection error is returned or raised once the
+        request cannot be retried anymore.
+        """
+        self.budget.deposit()
+        for attempt in range(1, self.max_attempts + 1):
+            last_attempt = attempt == self.max_attempts
+            try:
+                response = func(*args)
+            except requests.exceptions.ConnectionError:
+                if last_attempt or not self._before_retry(attempt, "connection_error"):
+                    raise
+                continue
+
+            if (
+                response.status_code not in RETRYABLE_STATUS_CODES
+                or last_attempt
+                or not self._before_retry(attempt, str(response.status_code))
+            ):
+                return response
+            response.close()
+
+    def _before_retry(self, attempt: int, reason: str) -> bool:
+        """Wait before retrying the request, returning False if it must not be retried."""
+        delay = calculate_delay(
+            attempt, self.base_delay, self.max_delay, self.base_delay
+        )
+        if exceeds_deadline(delay):
+            return False
+
+        if not self.budget.withdraw():
+            logger.debug("Not retrying the %s request: no retry budget", self.name)
+            self._budget_exhausted.inc()
+            return False
+
+        logger.info(
+            "Retrying the %s request in %.2f seconds after %s", self.name, delay, reason
+        )
+        metrics.CCX_UPGRADES_RETRIES_TOTAL.labels(self.name, reason).inc()
+        time.sleep(delay)
+        return True
+
+
+@lru_cache
+def get_retry_policy(name: str) -> RetryPolicy | None:
+    """Return the retry policy for the given dependency, if enabled."""
+    settings = get_settings()
+    if not settings.retry_enabled:
+        return None
+
+    return RetryPolicy(
+        name,
+        settings.retry_max_attempts,
+        settings.retry_base_delay,
+        settings.retry_max_delay,
+        settings.retry_budget,
+    )
 
 
 def calculate_delay(
     attempt,
     base_delay=DEFAULT_SSO_RETRY_BASE_DELAY,
     max_delay=DEFAULT_SSO_RETRY_MAX_DELAY,
+    jitter=1,
 ):
     """Calculate the delay for the given attempt using exponential backoff.
 
     :param attempt: The current attempt number
     :param base_delay: The base delay in seconds
     :param max_delay: The maximum delay in seconds
+    :param jitter: The maximum random delay added, in seconds
     :return: The calculated delay in seconds
     """
-    return min(base_delay * (2 ** (attempt - 1)) + random.uniform(0, 1), max_delay)
+    return min(base_delay * (2 ** (attempt - 1)) + random.uniform(0, jitter), max_delay)
 
 
 def log_attempt(attempt, max_attempts):
@@ -106,6 +910,20 @@ def log_max_retries(attempt):
     logger.debug(f"Max retries reached: {attempt}")
 
 
+def exceeds_deadline(delay):
+    """Check if retrying after the delay would exceed the deadline of the request.
+
+    :param delay: The delay in seconds
+    :return: True if there is not enough time left to retry
+    """
+    remaining = deadline.remaining_time()
+    if remaining is None or delay < remaining:
+        return False
+
+    logger.debug("Not retrying: the request deadline expires in %s seconds", remaining)
+    return True
+
+
 def retry_with_exponential_backoff(
     max_attempts=DEFAULT_SSO_RETRY_MAX_ATTEMPTS,
     base_delay=DEFAULT_SSO_RETRY_BASE_DELAY,
@@ -113,6 +931,9 @@ def retry_with_exponential_backoff(
 ):
     """Decorate a function with exponential backoff on any exception.
 
+    The retries stop early if the deadline of the request would expire during
+    the delay.
+
     :param max_attempts: Maximum number of retry attempts
     :param base_delay: Initial delay between retries in seconds
     :param max_delay: Maximum delay between retries in seconds
@@ -130,6 +951,8 @@ def retry_with_exponential_backoff(
                         log_max_retries(attempt)
                         raise e
                     delay = calculate_delay(attempt, base_delay, max_delay)
+                    if exceeds_deadline(delay):
+                        raise e
                     log_retry(delay)
                     await asyncio.sleep(delay)
 
@@ -144,6 +967,8 @@ def retry_with_exponential_backoff(
                         log_max_retries(attempt)
                         raise e
                     delay = calculate_delay(attempt, base_delay, max_delay)
+                    if exceeds_deadline(delay):
+                        raise e
                     log_retry(delay)
                     time.sleep(delay)
 
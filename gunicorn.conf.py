@@ -0,0 +1,74 @@
+"""Gunicorn configuration to run the service with several worker processes.
+
+Run it with:
+
+    gunicorn -c gunicorn.conf.py ccx_upgrades_data_eng.main:app
+
+The number of workers is read from WEB_CONCURRENCY. The application is loaded
+once in the master process before forking the workers, and the Prometheus
+metrics of all the workers are collected from PROMETHEUS_MULTIPROC_DIR.
+"""
+
+import glob
+import os
+import tempfile
+
+import yaml
+
+# The multiprocess directory must be configured before prometheus_client is
+# imported by the application, and must not keep files from previous runs.
+os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="ccx-upgrades-prometheus-")
+)
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+for path in glob.glob(os.path.join(os.environ["PROMETHEUS_MULTIPROC_DIR"], "*.db")):
+    os.remove(path)
+
+# Share the worker count with the application, used to split the caches size
+# and to reject the prediction jobs, which are kept by the worker running them
+workers = int(os.environ.setdefault("WEB_CONCURRENCY", "1"))
+worker_class = "uvicorn_worker.UvicornWorker"
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+preload_app = True
+
+with open(os.environ.get("LOGGING_CONFIG", "logging.yaml")) as logging_config:
+    logconfig_dict = yaml.safe_load(logging_config)
+
+
+def get_handlers(logger_name: str) -> list[str]:
+    """Return the handlers configured for a logger, including the propagated ones."""
+    handlers = []
+    while True:
+        if logger_name:
+            logger_config = logconfig_dict["loggers"].get(logger_name, {})
+        else:
+            logger_config = logconfig_dict.get("root", {})
+        handlers += [
+            handler
+            for handler in logger_config.get("handlers", [])
+            if handler not in handlers
+        ]
+        if not logger_name or not logger_config.get("propagate", True):
+            return handlers
+        logger_name = logger_name.rpartition(".")[0]
+
+
+# The logging configuration replaces the gunicorn one, so its loggers are added.
+# UvicornWorker replaces the handlers of the uvicorn loggers with the ones of
+# the gunicorn loggers, so these get the handlers configured for uvicorn.
+logconfig_dict.setdefault("loggers", {})
+for gunicorn_logger, uvicorn_logger in (
+    ("gunicorn.error", "uvicorn.error"),
+    ("gunicorn.access", "uvicorn.access"),
+):
+    logconfig_dict["loggers"].setdefault(
+        gunicorn_logger,
+        {"level": "INFO", "handlers": get_handlers(uvicorn_logger), "propagate": False},
+    )
+
+
+def child_exit(server, worker):
+    """Remove the live gauges of the finished worker from the metrics."""
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)